@@ -23,6 +23,7 @@ sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 
 import pywikibot
 
+import pageindex
 from utils import param_from_params
 
 NULLS = ['.',
@@ -36,10 +37,15 @@ NULLS = ['.',
 CAT = '[[Category:No In-game Description]]'
 summary = 'Robot: Added category No In-game Description'
 
-def fix_category(cat):
-    c = pywikibot.Category(pywikibot.Site(), cat)
+def fix_category(cat, snap=None, index=None):
+    if index is None:
+        pages = pywikibot.Category(pywikibot.Site(), cat).articles()
+    else:
+        # Skip the pages that already have the category
+        titles = index.pages_in_category(cat) - index.pages_in_category(u'No In-game Description')
+        pages = [snap.page(title) for title in sorted(titles)]
 
-    for d in c.articles():
+    for d in pages:
         for t,p in d.templatesWithParams():
             t_name = t.title(withNamespace=False)
             #if 'Lieutenant' in t_name:
@@ -48,6 +54,9 @@ def fix_category(cat):
                 # We have a description, but does it indicate that there isn't one?
                 if desc in NULLS:
                     print("Description for %s is '%s'" % (d.title(), desc))
+                    if index is not None:
+                        # Update the page on the wiki, not the snapshot
+                        d = pywikibot.Page(pywikibot.Site(), d.title())
                     # Check if the category is already present
                     text = d.get()
                     if CAT not in text:
@@ -55,6 +64,14 @@ def fix_category(cat):
                         text += CAT
                         d.put(text, summary)
 
-fix_category(u'Category:Lieutenants')
-fix_category(u'Category:Special Items')
+# -index:<name> finds the pages in the index of snapshot <name>,
+# and reads them from the snapshot rather than the wiki
+snap = None
+index = None
+for arg in pywikibot.handleArgs():
+    if arg.startswith(u'-index:'):
+        (snap, index) = pageindex.open_snapshot(arg[len(u'-index:'):])
+
+fix_category(u'Category:Lieutenants', snap, index)
+fix_category(u'Category:Special Items', snap, index)
 
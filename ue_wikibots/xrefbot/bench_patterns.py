@@ -0,0 +1,124 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Script to measure the CPU time that patterns.py saves for each page.
+
+Runs some of xref.py's own code that uses patterns.py on the text of a
+typical item page twice - once with patterns.compiled() compiling the
+pattern on every call, as xref.py used to, and once as it is - and
+reports the time per page. Only the text-handling parts of xref.py are
+run, so this is a lower bound for a whole page.
+
+Doesn't talk to the wiki.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import io
+import re
+import timeit
+
+import patterns
+import xref
+
+# Categories that xref.py checks every page for
+CATEGORIES = [u'Items', u'Common Items', u'Uncommon Items', u'Rare Items',
+              u'Epic Items', u'Legendary Items', u'Special Items',
+              u'Basic Items', u'Battle Rank Items', u'Ingredients', u'Gear',
+              u'Vehicles', u'Weapons', u'Rifle', u'Heavy Weapons',
+              u'Handguns', u'Melee Weapons', u'Gift Items', u'Faction Items',
+              u'Needs Type', u'Needs Description', u'No In-game Description',
+              u'Needs Cost', u'Needs Image', u'Needs Rewards']
+
+SAMPLE_TEXT = u'''{{Special Item
+|image=Sample.png
+|description=A sample item.
+|atk=12
+|def=10
+|time=3 days
+|from=<br/>
+*[[Sample Boss]]
+*{{Lab
+|part_1=Sample Part
+|part_1_img=Sample Part.png
+|part_2=Other Part
+|part_2_img=Other Part.png
+}}
+|power=All [[:Category:Rare Lieutenants|Rare Lts]] get +1 attack when fighting
+}}
+==Rewards==
+[[Category:Needs Cost]]
+[[Category:Special Items]]
+'''
+
+# Pairs of time parameters that xref.py compares
+TIME_PAIRS = [(u'3 days', u'3d'), (u'12 hours', u'12 hrs')]
+
+def xref_work(toolkit, text):
+    """Do some of the regex work that xref.py does for one page."""
+    for c in CATEGORIES:
+        toolkit._remove_category(text, c)
+    toolkit._fix_needs_description(text)
+    for (a, b) in TIME_PAIRS:
+        xref.time_params_match(a, b)
+
+def compile_every_time(pattern, flags=0):
+    """Stand-in for patterns.compiled() that doesn't keep the result."""
+    return re.compile(pattern, flags)
+
+def time_per_page(toolkit, text, pages, purge):
+    """
+    Return the best time, in microseconds, to process one page.
+
+    toolkit -- xref.XrefToolkit to use.
+    text -- page text.
+    pages -- number of pages to time in each run.
+    purge -- pass True to clear the re module's own cache before each page,
+             as happens in a long run that uses many different patterns.
+    """
+    if purge:
+        stmt = lambda: (re.purge(), xref_work(toolkit, text))
+    else:
+        stmt = lambda: xref_work(toolkit, text)
+    best = min(timeit.repeat(stmt, number=pages, repeat=5))
+    return best / pages * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=u'Time the regex work done for each page')
+    parser.add_argument('--file',
+                        help=u'file containing the text of the page to use')
+    parser.add_argument('--pages', type=int, default=2000,
+                        help=u'number of pages to time in each run')
+    args = parser.parse_args()
+    text = SAMPLE_TEXT
+    if args.file:
+        with io.open(args.file, 'r', encoding='utf-8') as f:
+            text = f.read()
+    toolkit = xref.XrefToolkit([])
+    registry = patterns.compiled
+    for purge in [False, True]:
+        patterns.compiled = compile_every_time
+        before = time_per_page(toolkit, text, args.pages, purge)
+        patterns.compiled = registry
+        after = time_per_page(toolkit, text, args.pages, purge)
+        print(u'%s: %.1f us/page compiling per call, %.1f us/page with patterns.py (%.1f us saved)'
+              % (u're cache cleared' if purge else u're cache warm', before, after, before - after))
+
+if __name__ == "__main__":
+    main()
@@ -24,18 +24,34 @@ sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 import pywikibot
 import re
 
+import pageindex
 from utils import param_from_params
 
-c = pywikibot.Category(pywikibot.Site(), u'Category:Areas')
+# -index:<name> finds the pages in the index of snapshot <name>,
+# and reads them from the snapshot rather than the wiki
+index = None
+for arg in pywikibot.handleArgs():
+    if arg.startswith(u'-index:'):
+        (snap, index) = pageindex.open_snapshot(arg[len(u'-index:'):])
 
-for d in c.articles():
+if index is None:
+    pages = pywikibot.Category(pywikibot.Site(), u'Category:Areas').articles()
+else:
+    # Only the pages that use the template
+    titles = index.pages_in_category(u'Areas') & index.pages_with_template(u'Job')
+    pages = [snap.page(title) for title in sorted(titles)]
+
+for d in pages:
     for t,p in d.templatesWithParams():
         t_name = t.title(withNamespace=False)
         if t_name == u'Job':
             lt = param_from_params(p, u'lieutenant')
             f = param_from_params(p, u'faction')
             if lt is not None and f is not None:
-                pg = pywikibot.Page(pywikibot.Site(), lt)
+                if index is None:
+                    pg = pywikibot.Page(pywikibot.Site(), lt)
+                else:
+                    pg = snap.page(lt)
                 for t1,p1 in pg.templatesWithParams():
                     t1_name = t1.title(withNamespace=False)
                     if u'Lieutenant' in t1_name:
@@ -0,0 +1,345 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Script to check that drops and sources agree across the whole wiki.
+
+Boss, job, and gift pages say what they drop (with the Drop, BossDrop,
+Mystery Gift Item, Execution Method, and Challenge Job templates), while
+item pages say where they come from (with their from parameter). This
+reads every page once, and then lists every drop that is only recorded
+on one side.
+
+Arguments:
+-snapshot:<name>  Read the pages from snapshot <name> (see snapshot.py).
+-report:<file>    Also write the mismatches to <file>, one JSON object
+                  per line.
+&params;
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import sys
+import os
+import io
+import json
+from collections import namedtuple
+sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
+
+import pywikibot
+from pywikibot import pagegenerators
+import pageindex
+import snapshot
+import utils
+import wikitext
+
+docuReplacements = {
+    '&params;': pagegenerators.parameterHelp
+}
+
+# Sources that items can list without that page listing the item
+GENERIC_SOURCES = [u':Category:Crates', # the original crate
+                   u'Bosses',           # "all bosses"
+                   u'Jobs']             # "all jobs"
+GENERIC_SOURCE_KEYS = set(wikitext.title_key(s) for s in GENERIC_SOURCES)
+
+# Templates for items whose from parameter lists their sources
+ITEM_TEMPLATES = [u'Faction Item',
+                  u'Special Item',
+                  u'Basic Item',
+                  u'Battle Rank Item',
+                  u'Ingredient',
+                  u'Insignia']
+
+# Ways a declared drop can name the item
+EXACT = u'exact'
+ITEM_IN_TEXT = u'item in text'
+TEXT_IN_ITEM = u'text in item'
+
+# Problems with a drop
+NOT_LISTED = u'drop not listed as a source on the item page'
+NOT_DROPPED = u'source does not list the item as a drop'
+
+Mismatch = namedtuple('Mismatch', ['item', 'source', 'problem'])
+
+class Drop(namedtuple('Drop', ['text', 'source', 'match'])):
+    """
+    One drop declared by a page.
+
+    text -- the item name, as written in the declaration.
+    source -- how the item should list this source in its from parameter.
+    match -- how text identifies the item - EXACT, ITEM_IN_TEXT, or
+             TEXT_IN_ITEM.
+    """
+
+    __slots__ = ()
+
+    def is_for(self, name):
+        """
+        Return whether this is a drop of the specified item.
+
+        name -- item name (page title).
+        """
+        if self.match == EXACT:
+            return wikitext.title_key(self.text) == wikitext.title_key(name)
+        if self.match == ITEM_IN_TEXT:
+            return name in self.text
+        # Challenge Jobs drop Recombinators
+        return u'Recombinator' in name and self.text in name
+
+def page_drops(title, templates):
+    """
+    Return the list of Drops declared by a page.
+
+    title -- page title.
+    templates -- list of 2-tuples of template name and parameters,
+                 as from utils.templates_with_params().
+    """
+    drops = []
+    for template, params in templates:
+        if (template == u'Drop') or (template == u'BossDrop'):
+            # TODO If it has creator=true, need to ensure that's reflected on the item page
+            name = utils.param_from_params(params, u'name')
+            if name:
+                drops.append(Drop(name, title, EXACT))
+        elif template == u'Mystery Gift Item':
+            for name in utils.params_to_dict(params).values():
+                drops.append(Drop(name, title, EXACT))
+        elif template == u'Execution Method':
+            bonus = utils.param_from_params(params, u'bonus')
+            if bonus:
+                drops.append(Drop(bonus, title, ITEM_IN_TEXT))
+        elif template == u'Challenge Job':
+            recombinator = utils.param_from_params(params, u'recombinator')
+            if recombinator:
+                source = u'{{Job Link|district=%s|job=%s}}' % (title,
+                                                              utils.param_from_params(params,
+                                                                                      u'name'))
+                drops.append(Drop(recombinator, source, TEXT_IN_ITEM))
+    return drops
+
+def implied_sources(name, referrers, achievements, events):
+    """
+    Return the set of sources of an item that aren't declared as drops.
+
+    name -- item name (page title).
+    referrers -- iterable of 2-tuples of the title and the list of category
+                 titles (without namespace) of each page that links to
+                 the item. Redirects should be left out.
+    achievements -- utils.Achievements to look up daily rewards in.
+    events -- utils.EventRewards to look up event rewards in.
+
+    Both xref.py and DropGraph use this, so that they agree.
+    """
+    sources = set()
+    for (title, categories) in referrers:
+        # TODO Pages referenced from HQ can either be requirements
+        # to build improvements, or drops after Wars with Shadow Broker.
+        # Assume any page linked to from the Favor Point page is available from the Black Market
+        if title == u'Favor Point':
+            sources.add(u'Black Market')
+        # If it's linked to from a giveaways page, assume it was given away
+        elif u'Giveaways' in categories:
+            sources.add(title)
+        # If it's linked from an event page, check whether it's in a list
+        # All rewards are in lists, although the converse may not be true
+        elif events.is_event(title):
+            if events.listed_in_bullet(name, title):
+                sources.add(title)
+    # Check whether it's a daily achievement reward
+    if achievements.is_daily_reward(name):
+        sources.add(u'Achievements#Daily')
+    return sources
+
+def listed_sources(from_param):
+    """
+    Return the sources listed in an item's from parameter.
+
+    from_param -- value of the from parameter, or None.
+
+    Return a 2-tuple of whether there's a Lab template, and a list of
+    2-tuples of source (page title or template) and whether the item
+    is no longer expected to be there (it came from there "before").
+    """
+    if not from_param:
+        return (False, [])
+    # Not worth caching the outline of one parameter
+    o = wikitext.SectionOutline(from_param)
+    lab = False
+    found = [(l.target, l.end) for l in o.first_links(outside_templates=True)]
+    for t in o.outermost_templates():
+        if t.name.startswith(u'Lab'):
+            # Links within the Lab template are ingredients, not sources
+            lab = True
+        else:
+            found.append((from_param[t.start:t.end], t.end))
+    sources = []
+    for (source, end) in found:
+        # Look at the rest of that line
+        eol = o.line_bounds(end)[1]
+        sources.append((source, u'before' in from_param[end:eol]))
+    return (lab, sources)
+
+class DropGraph:
+
+    """
+    Class to hold every declared drop and every listed source,
+    so that the two sides can be compared.
+    """
+
+    def __init__(self, achievements=None, events=None):
+        """
+        Instantiate the class.
+
+        achievements -- utils.Achievements to look up daily rewards in.
+        events -- utils.EventRewards to look up event rewards in.
+        """
+        self.achievements = achievements or utils.Achievements()
+        self.events = events or utils.EventRewards()
+        # Keyed by title key of item name, set of sources of EXACT drops
+        self._exact = {}
+        # Other Drops, which have to be matched against every item
+        self._partial = []
+        # Keyed by item name, list of 2-tuples from listed_sources()
+        self._listed = {}
+        # Keyed by title key of page title, list of titles of pages that link to it
+        self._referrers = {}
+        # Keyed by page title, list of category titles (without namespace)
+        self._categories = {}
+
+    def add_page(self, page):
+        """
+        Add the drops and sources declared by a page.
+
+        page -- Page (or snapshot.SnapshotPage) to read.
+        """
+        title = page.title()
+        templates = utils.templates_with_params(page)
+        for drop in page_drops(title, templates):
+            if drop.match == EXACT:
+                self._add_exact(drop.text, drop.source)
+            else:
+                self._partial.append(drop)
+        # Sources that are implied by the page are worked out later,
+        # by implied_sources(), from what links to each item
+        self._categories[title] = [c.title(withNamespace=False) for c in page.categories()]
+        for link in set(wikitext.title_key(l) for l in wikitext.links(page.get())):
+            self._referrers.setdefault(link, []).append(title)
+        for template, params in templates:
+            if template in ITEM_TEMPLATES:
+                from_param = utils.param_from_params(params, u'from')
+                self._listed[title] = listed_sources(from_param)[1]
+
+    def _add_exact(self, item, source):
+        """Record an EXACT drop of an item."""
+        self._exact.setdefault(wikitext.title_key(item), set()).add(source)
+
+    def drop_sources(self, item):
+        """
+        Return the set of sources that declare a drop of an item.
+
+        item -- item name (page title).
+        """
+        key = wikitext.title_key(item)
+        sources = set(self._exact.get(key, set()))
+        for drop in self._partial:
+            if drop.is_for(item):
+                sources.add(drop.source)
+        referrers = [(t, self._categories[t]) for t in self._referrers.get(key, [])]
+        sources |= implied_sources(item, referrers, self.achievements, self.events)
+        return sources
+
+    def mismatches(self):
+        """
+        Return a list of Mismatches, one for each drop recorded on only one side.
+
+        Only items with pages that list their sources are checked.
+        """
+        retval = []
+        for item in sorted(self._listed):
+            # Keyed by title key
+            dropped_by = dict((wikitext.title_key(s), s) for s in self.drop_sources(item))
+            listed = set()
+            for (source, before) in self._listed[item]:
+                key = wikitext.title_key(source)
+                listed.add(key)
+                if before or key in GENERIC_SOURCE_KEYS or key in dropped_by:
+                    continue
+                # Not necessarily an error, but worth investigating
+                retval.append(Mismatch(item, source, NOT_DROPPED))
+            for source in sorted(dropped_by[k] for k in set(dropped_by) - listed):
+                retval.append(Mismatch(item, source, NOT_LISTED))
+        return retval
+
+def _pages(snap, gen):
+    """
+    Generator to return the pages to read.
+
+    snap -- snapshot.Snapshot to read every page from, or None.
+    gen -- page generator to use if snap is None.
+    """
+    if snap is not None:
+        for record in snap.records():
+            yield snapshot.SnapshotPage(snap, record[u'title'], record)
+    else:
+        for page in pagegenerators.PreloadingGenerator(gen):
+            yield page
+
+def main():
+    snapshot_name = None
+    report_file = None
+    genFactory = pagegenerators.GeneratorFactory()
+
+    for arg in pywikibot.handleArgs():
+        if arg.startswith(u'-snapshot:'):
+            snapshot_name = arg[len(u'-snapshot:'):]
+        elif arg.startswith(u'-report:'):
+            report_file = arg[len(u'-report:'):]
+        else:
+            genFactory.handleArg(arg)
+
+    gen = genFactory.getCombinedGenerator()
+    if not snapshot_name and not gen:
+        pywikibot.showHelp()
+        return
+
+    snap = None
+    graph = DropGraph()
+    if snapshot_name:
+        # Look up achievements and event rewards in the snapshot too
+        (snap, index) = pageindex.open_snapshot(snapshot_name)
+        utils.use_snapshot(snap)
+        graph.events.use_index(index)
+    for page in _pages(snap, gen):
+        try:
+            graph.add_page(page)
+        except (pywikibot.NoPage, pywikibot.IsRedirectPage):
+            continue
+    mismatches = graph.mismatches()
+    for m in mismatches:
+        pywikibot.output(u'%s: %s (%s)' % (m.item, m.source, m.problem))
+    pywikibot.output(u'%d mismatches' % len(mismatches))
+    if report_file:
+        with io.open(report_file, 'w', encoding='utf-8') as f:
+            for m in mismatches:
+                f.write(u'%s\n' % json.dumps(m._asdict()))
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        pywikibot.stopme()
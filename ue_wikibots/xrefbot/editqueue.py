@@ -0,0 +1,246 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Queue of edits to upload to the wiki in the background.
+
+Edits are uploaded one at a time by a separate thread, so the scripts can
+carry on working out the next change while pywikibot waits for its put
+throttle or for the servers' replication lag to drop. Each edit records
+the revision its text was based on, and if the page has changed since,
+the change is worked out again from the current text.
+
+Results are handled, and changes worked out again, in the thread that
+submits the edits, so that code doesn't need to be thread-safe.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import sys
+import os
+import threading
+import time
+from collections import namedtuple
+from six.moves import queue
+sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
+
+import pywikibot
+
+# Outcomes of an edit
+SAVED = u'saved'
+UNCHANGED = u'unchanged'
+CONFLICT = u'conflict'
+LOCKED = u'locked'
+FAILED = u'failed'
+
+EditResult = namedtuple('EditResult', ['title', 'outcome', 'revid', 'error'])
+
+class Edit:
+
+    """Class to represent one change waiting to be uploaded."""
+
+    def __init__(self, title, text, summary, base_revid, transform=None):
+        """
+        Instantiate the class.
+
+        title -- title of the page to change.
+        text -- new text for the page.
+        summary -- edit summary.
+        base_revid -- revid of the page text that text was derived from,
+                      or None if the page didn't exist.
+        transform -- function taking the current page text and a fresh
+                     Page it was read from, and returning the new text,
+                     to re-run if the page has changed since base_revid,
+                     or None to give up in that case.
+        """
+        self.title = title
+        self.text = text
+        self.summary = summary
+        self.base_revid = base_revid
+        self.transform = transform
+        # Number of times the change has been re-run after a conflict
+        self.retries = 0
+
+def _latest_revision(page):
+    """Return the revid of a page, or None if the page doesn't exist."""
+    try:
+        return page.latestRevision()
+    except pywikibot.NoPage:
+        return None
+
+class EditQueue:
+
+    """Class to upload edits to the wiki in a background thread."""
+
+    def __init__(self, callback=None, retries=3, wait=5, max_wait=300, maxlag=None):
+        """
+        Instantiate the class, and start the upload thread.
+
+        callback -- function to call with the EditResult of each edit,
+                    or None.
+        retries -- number of times to re-run the change to a page that was
+                   edited by someone else, or to retry after a server error.
+        wait -- seconds to wait before the first retry after a server error.
+                The wait doubles after each consecutive error.
+        max_wait -- longest time to wait after a server error.
+        maxlag -- replication lag in seconds at which the servers should
+                  refuse edits (and pywikibot wait), or None for the
+                  pywikibot default.
+        """
+        self.callback = callback
+        self.retries = retries
+        self.wait = wait
+        self.max_wait = max_wait
+        if maxlag is not None:
+            pywikibot.config.maxlag = maxlag
+        # EditResults, in the order the edits completed
+        self.results = []
+        # Edits waiting to be uploaded, or None to stop
+        self._todo = queue.Queue()
+        # 2-tuples of Edit and EditResult, waiting to be handled
+        self._done = queue.Queue()
+        # Number of edits submitted but not yet handled
+        self._pending = 0
+        self._thread = threading.Thread(target=self._upload_all)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, page, text, summary, transform=None, base_revid=None):
+        """
+        Queue an edit to be uploaded.
+
+        page -- Page to change, as read to work out the change.
+        text -- new text for the page.
+        summary -- edit summary.
+        transform -- function taking the current page text and a fresh
+                     Page it was read from, and returning the new text,
+                     to re-run if someone else edits the page first,
+                     or None.
+        base_revid -- revid of the page text that text was derived from.
+                      Defaults to the latest revision of page.
+        """
+        self.handle_results()
+        if base_revid is None:
+            base_revid = _latest_revision(page)
+        self._queue(Edit(page.title(), text, summary, base_revid, transform))
+
+    def _queue(self, edit):
+        """Add an Edit to the upload queue."""
+        self._pending += 1
+        self._todo.put(edit)
+
+    def _upload_all(self):
+        """Upload each queued Edit, until told to stop. Runs in its own thread."""
+        while True:
+            edit = self._todo.get()
+            if edit is None:
+                break
+            self._done.put((edit, self._upload(edit)))
+
+    def _upload(self, edit):
+        """
+        Upload one Edit, waiting for the servers if necessary.
+
+        Return an EditResult.
+        """
+        wait = self.wait
+        errors = 0
+        while True:
+            page = pywikibot.Page(pywikibot.Site(), edit.title)
+            try:
+                if _latest_revision(page) != edit.base_revid:
+                    return EditResult(edit.title, CONFLICT, None, None)
+                page.put(edit.text, edit.summary)
+                return EditResult(edit.title, SAVED, _latest_revision(page), None)
+            except pywikibot.EditConflict as e:
+                return EditResult(edit.title, CONFLICT, None, e)
+            except pywikibot.LockedPage as e:
+                return EditResult(edit.title, LOCKED, None, e)
+            except pywikibot.ServerError as e:
+                # Includes timeouts when the servers are too lagged
+                errors += 1
+                if errors > self.retries:
+                    return EditResult(edit.title, FAILED, None, e)
+                time.sleep(wait)
+                wait = min(wait * 2, self.max_wait)
+            except pywikibot.Error as e:
+                return EditResult(edit.title, FAILED, None, e)
+
+    def _retry(self, edit):
+        """
+        Work out a conflicting Edit again from the current page text.
+
+        Return an EditResult if there's nothing to upload, otherwise None.
+        """
+        page = pywikibot.Page(pywikibot.Site(), edit.title)
+        try:
+            base_revid = page.latestRevision()
+            text = page.get()
+        except (pywikibot.NoPage, pywikibot.IsRedirectPage) as e:
+            return EditResult(edit.title, FAILED, None, e)
+        new_text = edit.transform(text, page)
+        if new_text == text:
+            return EditResult(edit.title, UNCHANGED, base_revid, None)
+        edit.text = new_text
+        edit.base_revid = base_revid
+        edit.retries += 1
+        self._queue(edit)
+        return None
+
+    def _handle(self, edit, result):
+        """Deal with the result of uploading an Edit."""
+        self._pending -= 1
+        if result.outcome == CONFLICT and edit.transform and edit.retries < self.retries:
+            pywikibot.output(u'%s was changed by someone else. Trying again.' % edit.title)
+            result = self._retry(edit)
+            if result is None:
+                return
+        self.results.append(result)
+        if self.callback:
+            self.callback(result)
+
+    def handle_results(self):
+        """Deal with the results of any edits uploaded so far."""
+        while True:
+            try:
+                edit, result = self._done.get_nowait()
+            except queue.Empty:
+                return
+            self._handle(edit, result)
+
+    def close(self):
+        """
+        Wait for all the queued edits to be uploaded, and stop the thread.
+
+        Return the list of EditResults.
+        """
+        while self._pending:
+            edit, result = self._done.get()
+            self._handle(edit, result)
+        self._todo.put(None)
+        self._thread.join()
+        return self.results
+
+    def report(self):
+        """Summarise the results of the edits so far."""
+        counts = {}
+        for r in self.results:
+            counts[r.outcome] = counts.get(r.outcome, 0) + 1
+        pywikibot.output(u', '.join(u'%d %s' % (counts[o], o) for o in sorted(counts)))
+        for r in self.results:
+            if r.outcome not in [SAVED, UNCHANGED]:
+                pywikibot.output(u'%s: %s %s' % (r.title, r.outcome, r.error or u''))
@@ -0,0 +1,191 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Classes to hold what every page in a snapshot says, for a whole-wiki run.
+
+A FactTable is built in one pass through a snapshot, parsing each page
+once. FactPages then answer all the questions that the scripts ask of
+pages (text, categories, templates, links, and what links to a page)
+from the table, without going back to the wiki or the snapshot.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import snapshot
+import wikitext
+
+class FactTable:
+
+    """Class to hold the parsed content of every page in a snapshot."""
+
+    def __init__(self):
+        """Instantiate the class."""
+        # Keyed by title, snapshot record dict
+        self._records = {}
+        # Keyed by title, list of 2-tuples of template name and parameter list
+        self._templates = {}
+        # Keyed by title, list of titles linked to
+        self._links = {}
+        # Keyed by title, set of titles of pages that link to,
+        # transclude, or redirect to it
+        self._refs = {}
+        # Keyed by category title, set of titles of pages in it
+        self._members = {}
+
+    @classmethod
+    def build(cls, snap):
+        """
+        Return a new FactTable of every page in a snapshot.
+
+        snap -- snapshot.Snapshot to read.
+        """
+        facts = cls()
+        for record in snap.records():
+            facts.add(record)
+        return facts
+
+    def add(self, record):
+        """
+        Add the facts from one page.
+
+        record -- snapshot record dict for the page.
+        """
+        title = record[u'title']
+        text = record[u'text']
+        self._records[title] = record
+        templates = []
+        for use in wikitext.outline(text).templates:
+            templates.append((use.name, [p.strip() for p in use.params(text)]))
+            self._refs.setdefault(u'Template:%s' % use.name, set()).add(title)
+        self._templates[title] = templates
+        links = wikitext.links(text)
+        self._links[title] = links
+        for link in links:
+            self._refs.setdefault(link, set()).add(title)
+        if record[u'redirect'] is not None:
+            self._refs.setdefault(record[u'redirect'], set()).add(title)
+        for c in record[u'categories']:
+            self._members.setdefault(c, set()).add(title)
+
+    def __len__(self):
+        """Return the number of pages."""
+        return len(self._records)
+
+    def __contains__(self, title):
+        """Return whether the page exists."""
+        return title in self._records
+
+    def titles(self):
+        """Return a sorted list of the titles of all the pages."""
+        return sorted(self._records)
+
+    def record(self, title):
+        """
+        Return the snapshot record for a page.
+
+        title -- page title, with namespace.
+
+        Raise KeyError if the page doesn't exist.
+        """
+        return self._records[title]
+
+    def templates(self, title):
+        """
+        Return the templates used on a page.
+
+        title -- page title, with namespace.
+
+        Return a list of 2-tuples of template name (without namespace)
+        and list of stripped parameter strings.
+        """
+        return self._templates.get(title, [])
+
+    def links(self, title):
+        """Return the list of titles of the pages a page links to."""
+        return self._links.get(title, [])
+
+    def references(self, title):
+        """
+        Return the set of titles of the pages that refer to a page.
+
+        title -- page title, with namespace.
+
+        Like Page.getReferences(), this includes pages that link to or
+        transclude the page, redirects to it, and pages that refer to
+        those redirects.
+        """
+        retval = set(self._refs.get(title, set()))
+        for r in list(retval):
+            if self._records[r][u'redirect'] == title:
+                retval |= self._refs.get(r, set())
+        retval.discard(title)
+        return retval
+
+    def articles(self, category, recurse=False):
+        """
+        Return a sorted list of the titles of the pages in a category.
+
+        category -- title of the category, with namespace.
+        recurse -- pass True to include pages in subcategories.
+
+        Like Category.articles(), subcategories aren't included.
+        """
+        retval = set()
+        todo = [category]
+        done = set()
+        while todo:
+            cat = todo.pop()
+            done.add(cat)
+            for title in self._members.get(cat, set()):
+                if not title.startswith(u'Category:'):
+                    retval.add(title)
+                elif recurse and title not in done:
+                    todo.append(title)
+        return sorted(retval)
+
+    def page(self, title):
+        """
+        Return a FactPage for the specified title.
+
+        title -- page title, with namespace.
+        """
+        return FactPage(self, title)
+
+class FactPage(snapshot.SnapshotPage):
+
+    """
+    Class that provides the parts of the pywikibot Page interface that
+    these scripts use, for a page in a FactTable.
+    """
+
+    def templatesWithParams(self):
+        """
+        Return a list of 2-tuples, one for each template used on the page,
+        of the template's FactPage and a list of parameter strings.
+        """
+        return [(FactPage(self.snapshot, u'Template:%s' % name), list(params))
+                for (name, params) in self.snapshot.templates(self._title)]
+
+    def linkedPages(self):
+        """Return a list of FactPages for the pages this page links to."""
+        return [FactPage(self.snapshot, t) for t in self.snapshot.links(self._title)]
+
+    def getReferences(self):
+        """Return a list of FactPages for the pages that refer to this page."""
+        return [FactPage(self.snapshot, t) for t in sorted(self.snapshot.references(self._title))]
@@ -24,11 +24,24 @@ sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 import pywikibot
 import re
 
+import pageindex
 from utils import param_from_params
 
-c = pywikibot.Category(pywikibot.Site(), u'Category:Special Items')
+# -index:<name> finds the pages in the index of snapshot <name>,
+# and reads them from the snapshot rather than the wiki
+index = None
+for arg in pywikibot.handleArgs():
+    if arg.startswith(u'-index:'):
+        (snap, index) = pageindex.open_snapshot(arg[len(u'-index:'):])
 
-for d in c.articles():
+if index is None:
+    pages = pywikibot.Category(pywikibot.Site(), u'Category:Special Items').articles()
+else:
+    # Only the pages that use the template
+    titles = index.pages_in_category(u'Special Items') & index.pages_with_template(u'Special Item')
+    pages = [snap.page(title) for title in sorted(titles)]
+
+for d in pages:
     for t,p in d.templatesWithParams():
         t_name = t.title(withNamespace=False)
         if t_name == u'Special Item':
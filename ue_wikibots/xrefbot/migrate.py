@@ -0,0 +1,309 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Script to run one-off migrations of page text on Underworld Empire Wiki
+
+Each migration is a function that takes the text of a page and returns
+the new text, registered against the category of pages it applies to.
+All the selected migrations for a category are run together, so each
+page is fetched once and saved (at most) once, however many migrations
+change it.
+
+Arguments:
+-migration:<name>  Run the named migration. May be repeated.
+                   With no migrations specified, the available ones
+                   are listed.
+-processes:<n>     Run the migrations in n processes.
+-always            Don't ask before saving each page.
+-queue             Upload changes from a background queue, rather than
+                   saving each page before moving on to the next.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import sys
+import os
+import importlib
+import multiprocessing
+from collections import namedtuple
+sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
+
+import pywikibot
+from pywikibot import pagegenerators
+import editqueue
+
+# Modules that register migrations
+MIGRATION_MODULES = [
+    u'add_item_time_units',
+    u'remove_needs_cost',
+    u'split_gear_params',
+    u'split_item_params',
+    u'use_boss_epicthresholds_template',
+    u'use_boss_speedkill_template',
+    u'use_new_boss_drop_template',
+    u'use_new_boss_stage_template',
+]
+
+Migration = namedtuple('Migration', ['name', 'category', 'recurse', 'summary', 'transform'])
+
+# All the registered migrations, by name
+_migrations = {}
+
+def register(name, category, summary, recurse=False):
+    """
+    Return a decorator that registers a function as a migration.
+
+    name -- name to select the migration by.
+    category -- name of the category of pages to apply it to.
+    summary -- edit summary to use for the change.
+    recurse -- pass True to also apply it to pages in subcategories.
+
+    The function will be passed the text of a page, and should return
+    the new text. It must not have any other effects.
+    """
+    def decorator(transform):
+        _migrations[name] = Migration(name, category, recurse, summary, transform)
+        return transform
+    return decorator
+
+def load_migrations():
+    """Import every module that registers migrations."""
+    for module in MIGRATION_MODULES:
+        importlib.import_module(module)
+
+def migrations(names):
+    """
+    Return a list of registered Migrations.
+
+    names -- names of the migrations of interest.
+
+    Raise KeyError if any name isn't registered.
+    """
+    return [_migrations[name] for name in names]
+
+def apply_migrations(text, names):
+    """
+    Run a set of migrations on some page text.
+
+    text -- page text to migrate.
+    names -- names of the migrations to run, in the order to run them.
+
+    Return a 2-tuple of the new text and a list of the names of
+    the migrations that changed it.
+    """
+    changed = []
+    for m in migrations(names):
+        new_text = m.transform(text)
+        if new_text != text:
+            changed.append(m.name)
+            text = new_text
+    return (text, changed)
+
+def _apply_to_page(args):
+    """
+    Wrapper for apply_migrations() for use with a multiprocessing Pool.
+
+    args -- 3-tuple of page title, page text, and migration names.
+
+    Return a 3-tuple of page title, new text, and changing migration names.
+    """
+    title, text, names = args
+    new_text, changed = apply_migrations(text, names)
+    return (title, new_text, changed)
+
+class MigrationBot:
+
+    """Class to run migrations on every page they apply to."""
+
+    def __init__(self, names, processes=1, acceptall=False, edits=None):
+        """
+        Class constructor.
+
+        names -- names of the migrations to run.
+        processes -- number of processes to run the migrations in.
+        acceptall -- pass True to not ask for user confirmation before
+                     updating pages.
+        edits -- editqueue.EditQueue to upload changes with, or None to
+                 upload each change before moving on to the next page.
+        """
+        self.migrations = migrations(names)
+        self.processes = processes
+        self.acceptall = acceptall
+        self.edits = edits
+        self.site = pywikibot.Site()
+
+    def _groups(self):
+        """
+        Return a list of the migrations to run together.
+
+        Each entry is a 3-tuple of category name, recurse flag, and a list
+        of migration names, in the order they were specified.
+        """
+        groups = []
+        for m in self.migrations:
+            for cat, recurse, names in groups:
+                if (cat, recurse) == (m.category, m.recurse):
+                    names.append(m.name)
+                    break
+            else:
+                groups.append((m.category, m.recurse, [m.name]))
+        return groups
+
+    def _texts(self, pages, names):
+        """
+        Generator to return the text of each page, with the migrations to run.
+
+        pages -- dict of Pages, indexed by title.
+        names -- names of the migrations to run.
+
+        Yields 3-tuples of page title, page text, and migration names.
+        """
+        for page in pages.values():
+            try:
+                yield (page.title(), page.get(), names)
+            except pywikibot.NoPage:
+                pywikibot.output("Page %s does not exist?!" % page.title(asLink=True))
+            except pywikibot.IsRedirectPage:
+                pywikibot.output("Page %s is a redirect; skipping." % page.title(asLink=True))
+
+    def _save(self, page, old_text, text, changed):
+        """
+        Show the changes to a page, and save it if the user agrees.
+
+        page -- Page to update.
+        old_text -- text of the page before the migrations.
+        text -- text of the page after the migrations.
+        changed -- list of the names of the migrations that changed it.
+        """
+        # Show the title of the page we're working on.
+        # Highlight the title in purple.
+        pywikibot.output(u"\n\n>>> \03{lightpurple}%s\03{default} <<<" % page.title())
+        # Ignore changes that are just to line endings
+        if old_text.splitlines() == text.splitlines():
+            pywikibot.output('No changes were necessary in %s' % page.title())
+            return
+        # Give the user some context
+        pywikibot.showDiff(old_text, text)
+        if not self.acceptall:
+            choice = pywikibot.input_choice(u'Do you want to accept these changes?',
+                                            [('Yes', 'Y'),
+                                             ('No', 'n'),
+                                             ('All', 'a')],
+                                            'N')
+            if choice == 'a':
+                self.acceptall = True
+        if self.acceptall or choice == 'y':
+            summary = u'; '.join(_migrations[name].summary for name in changed)
+            if self.edits is not None:
+                # If someone else edits the page first, migrate their text
+                self.edits.submit(page,
+                                  text,
+                                  summary,
+                                  lambda new_text, page: apply_migrations(new_text, changed)[0])
+                return
+            try:
+                page.put(text, summary)
+            except pywikibot.LockedPage:
+                pywikibot.output("Page %s is locked?!" % page.title(asLink=True))
+
+    def _run_group(self, category, recurse, names, pool):
+        """
+        Run a set of migrations on every page in a category.
+
+        category -- name of the category.
+        recurse -- True to include pages in subcategories.
+        names -- names of the migrations to run.
+        pool -- multiprocessing Pool to use, or None.
+        """
+        cat = pywikibot.Category(self.site, u'Category:%s' % category)
+        # Fetch the text of all the pages in bulk
+        gen = pagegenerators.PreloadingGenerator(cat.articles(recurse=recurse))
+        pages = {}
+        for page in gen:
+            pages[page.title()] = page
+        old_texts = {}
+        work = []
+        for item in self._texts(pages, names):
+            old_texts[item[0]] = item[1]
+            work.append(item)
+        if pool is None:
+            results = map(_apply_to_page, work)
+        else:
+            results = pool.imap(_apply_to_page, work)
+        for title, text, changed in results:
+            self._save(pages[title], old_texts[title], text, changed)
+
+    def run(self):
+        """Run all the migrations."""
+        pool = None
+        if self.processes > 1:
+            pool = multiprocessing.Pool(self.processes)
+        try:
+            for category, recurse, names in self._groups():
+                self._run_group(category, recurse, names, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if self.edits is not None:
+                self.edits.close()
+                self.edits.report()
+
+def main(names=None):
+    """
+    Run migrations.
+
+    names -- names of the migrations to run, in addition to any
+             specified on the command line.
+    """
+    names = list(names or [])
+    processes = 1
+    acceptall = False
+    edits = None
+    for arg in pywikibot.handleArgs():
+        if arg.startswith(u'-migration:'):
+            names.append(arg[len(u'-migration:'):])
+        elif arg.startswith(u'-processes:'):
+            processes = int(arg[len(u'-processes:'):])
+        elif arg == u'-always':
+            acceptall = True
+        elif arg == u'-queue':
+            edits = editqueue.EditQueue()
+        else:
+            pywikibot.output(u'Unknown argument %s' % arg)
+            return
+
+    load_migrations()
+    if not names:
+        pywikibot.output(u'Available migrations:')
+        for name in sorted(_migrations):
+            m = _migrations[name]
+            pywikibot.output(u'%s (Category:%s) - %s' % (name, m.category, m.summary))
+        return
+    try:
+        bot = MigrationBot(names, processes, acceptall, edits)
+    except KeyError as e:
+        pywikibot.output(u'Unknown migration %s' % e)
+        return
+    bot.run()
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        pywikibot.stopme()
@@ -0,0 +1,250 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Inverted index of the pages in a snapshot.
+
+Answers questions like "which pages are in this category", "which pages
+use this template", and "which pages mention this item in a list item"
+without reading any page text.
+
+The index of snapshot <name> is kept in <name>.terms.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import io
+import json
+import re
+import zlib
+from bisect import bisect_left
+
+import snapshot
+import wikitext
+
+# Words, for word terms
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Prefixes that identify the kind of each term
+_WORD = u'w:'
+_LINK = u'l:'
+_TEMPLATE = u't:'
+_CATEGORY = u'c:'
+
+def _words(text):
+    """Return the list of (lower-case) words in text."""
+    return [w.lower() for w in _WORD_RE.findall(text)]
+
+def mentions(text, name):
+    """
+    Return whether some text links to or mentions a page.
+
+    text -- text to look in, like one line of a page.
+    name -- title of the page of interest.
+
+    A mention is the words of name, in order, ignoring case and
+    punctuation, so "Gun" isn't found in "Shotgun". This is the rule that
+    PageIndex.listed_in_bullet() follows, for use without an index.
+    """
+    title = wikitext.page_title(name)
+    if any(l.title == title for l in wikitext.link_uses(text)):
+        return True
+    words = _words(name)
+    if not words:
+        return False
+    found = _words(text)
+    return any(found[i:i + len(words)] == words for i in range(len(found) - len(words) + 1))
+
+class PageIndex:
+
+    """
+    Class to find pages by the words, links, templates, and categories in them.
+
+    Word and link terms record where in the page they occur, as a list of
+    [word number, line number, whether the line has a '*' before it].
+    """
+
+    def __init__(self, postings=None):
+        """
+        Instantiate the class.
+
+        postings -- dict, keyed by term, of dicts, keyed by page title,
+                    of lists of positions, as from an earlier index.
+        """
+        self._postings = postings or {}
+
+    def _add(self, term, title, position=None):
+        """Record a term in a page."""
+        positions = self._postings.setdefault(term, {}).setdefault(title, [])
+        if position is not None:
+            positions.append(position)
+
+    def add_page(self, title, text, categories):
+        """
+        Add a page to the index.
+
+        title -- page title, with namespace.
+        text -- page text.
+        categories -- list of titles of the categories the page is in.
+        """
+        for c in categories:
+            self._add(_CATEGORY + wikitext.page_title(c.split(u':', 1)[-1]), title)
+        o = wikitext.outline(text)
+        for use in o.templates:
+            self._add(_TEMPLATE + use.name, title)
+        links = o.links
+        i = 0
+        pos = 0
+        for line_no, line in enumerate(text.split(u'\n')):
+            star = line.find(u'*')
+            word_starts = []
+            for m in _WORD_RE.finditer(line):
+                bullet = int(star != -1 and m.start() > star)
+                self._add(_WORD + m.group().lower(), title, [pos, line_no, bullet])
+                word_starts.append(m.start())
+                pos += 1
+            line_start = o.line_starts[line_no]
+            while i < len(links) and links[i].start < line_start + len(line):
+                l = links[i]
+                i += 1
+                if not l.title:
+                    continue
+                column = l.start - line_start
+                bullet = int(star != -1 and column > star)
+                # Links are at the position of the first word of the target
+                link_pos = pos - len(word_starts) + bisect_left(word_starts, column)
+                self._add(_LINK + l.title, title, [link_pos, line_no, bullet])
+
+    @classmethod
+    def build(cls, snap):
+        """
+        Return a new index of every page in a snapshot.
+
+        snap -- snapshot.Snapshot to index.
+        """
+        index = cls()
+        for record in snap.records():
+            index.add_page(record[u'title'], record[u'text'], record[u'categories'])
+        return index
+
+    @classmethod
+    def load(cls, name):
+        """
+        Return the index saved for a snapshot.
+
+        name -- name of the snapshot.
+
+        Raise IOError if there's no saved index.
+        """
+        with io.open(u'%s.terms' % name, 'rb') as f:
+            data = zlib.decompress(f.read()).decode('utf-8')
+        return cls(json.loads(data))
+
+    def save(self, name):
+        """
+        Save the index for a snapshot.
+
+        name -- name of the snapshot.
+        """
+        data = zlib.compress(json.dumps(self._postings).encode('utf-8'))
+        with io.open(u'%s.terms' % name, 'wb') as f:
+            f.write(data)
+
+    def pages_in_category(self, category):
+        """
+        Return the set of titles of pages in a category.
+
+        category -- name of the category, with or without namespace.
+        """
+        return set(self._postings.get(_CATEGORY + wikitext.page_title(category.split(u':', 1)[-1]), {}))
+
+    def pages_with_template(self, template):
+        """
+        Return the set of titles of pages that use a template.
+
+        template -- name of the template, without namespace.
+        """
+        return set(self._postings.get(_TEMPLATE + wikitext.template_name(template), {}))
+
+    def pages_linking_to(self, title, bullet=False):
+        """
+        Return the set of titles of pages that link to a page.
+
+        title -- title of the page linked to.
+        bullet -- pass True to only include links after a '*' on their line.
+        """
+        pages = self._postings.get(_LINK + wikitext.page_title(title), {})
+        if not bullet:
+            return set(pages)
+        return set(t for t, positions in pages.items() if any(p[2] for p in positions))
+
+    def pages_mentioning(self, phrase, bullet=False, pages=None):
+        """
+        Return the set of titles of pages that contain a phrase.
+
+        phrase -- words to look for, in order, on one line.
+                  Case and punctuation are ignored.
+        bullet -- pass True to only include mentions after a '*' on their line.
+        pages -- titles of the pages to look in, or None for all pages.
+        """
+        words = _words(phrase)
+        if not words:
+            return set()
+        postings = [self._postings.get(_WORD + w, {}) for w in words]
+        candidates = set(postings[0])
+        if pages is not None:
+            candidates &= set(pages)
+        for p in postings[1:]:
+            candidates &= set(p)
+        retval = set()
+        for title in candidates:
+            # Keyed by word number, line number
+            later = [dict((pos, line) for (pos, line, b) in p[title]) for p in postings[1:]]
+            for (pos, line, b) in postings[0][title]:
+                if bullet and not b:
+                    continue
+                if all(later[i].get(pos + i + 1) == line for i in range(len(later))):
+                    retval.add(title)
+                    break
+        return retval
+
+    def listed_in_bullet(self, name, title):
+        """
+        Return whether a page mentions name after a '*' on the same line.
+
+        name -- name of the item or Lt of interest.
+        title -- title of the page to look in.
+        """
+        if title in self.pages_linking_to(name, bullet=True):
+            return True
+        return bool(self.pages_mentioning(name, bullet=True, pages=[title]))
+
+def open_snapshot(name):
+    """
+    Return a 2-tuple of the snapshot.Snapshot and PageIndex for a snapshot.
+
+    name -- name of the snapshot.
+
+    The index is built and saved if it doesn't already exist.
+    """
+    snap = snapshot.Snapshot(name)
+    try:
+        index = PageIndex.load(name)
+    except IOError:
+        index = PageIndex.build(snap)
+        index.save(name)
+    return (snap, index)
@@ -0,0 +1,136 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Regular expressions used by the scripts, each compiled only once.
+
+Fixed patterns are compiled when the module is imported. Patterns that
+include a name from a small fixed set (like a category, section, or
+item_<n> parameter) are built by the functions below, which compile each
+variant the first time it is asked for and return the same compiled
+pattern after that. Patterns that include a value from a page (like an
+item name) are only compiled through re, whose cache is bounded, so that
+long-running modes don't keep every one of them.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import re
+
+# String used for category REs
+CATEGORY_RE_STR = r'\[\[\s*Category:\s*%s\s*\]\]'
+
+# Regexes used for item powers
+NO_STACK_RE = re.compile(r'\[no \[\[stack\]\]\]')
+NO_STACK_RE_2 = re.compile(r'{{No Stack}}')
+# Separators are with, for, and to
+SEP_RE = re.compile(r' with | for | to ')
+# Some follow completely different patterns
+# Note that here we deliberately avoid matching the powers of the four Medallions
+ALL_RE = re.compile(r'[Aa]ll (.*) (count as \d.*)')
+WHEN_RE = re.compile(r'(.*) when (.*)')
+
+# Number and units of a time parameter
+TIME_VALUE_RE = re.compile(r'(?P<value>\d*)\s*(?P<unit>\w*)')
+
+# Rows of the Property Cost Table template
+COST_RATIO_RE = re.compile(r'\|\s*(?P<level>\d+).*cost}}}\*(?P<ratio>[\d.]+)')
+# Rows of the cost table on a property page
+COST_ROW_RE = re.compile(r'\|\s*(?P<level>\d+).*formatnum:\s*(?P<cost>\d+)')
+
+# Keyed by 2-tuple of pattern string and flags, compiled pattern
+_compiled = {}
+
+def compiled(pattern, flags=0):
+    """
+    Return a compiled regex, compiling it only the first time.
+
+    pattern -- regex string.
+    flags -- flags to compile it with.
+
+    Every pattern passed in is kept, so only use this for patterns
+    drawn from a small fixed set.
+    """
+    try:
+        return _compiled[(pattern, flags)]
+    except KeyError:
+        regex = re.compile(pattern, flags)
+        _compiled[(pattern, flags)] = regex
+        return regex
+
+def category(name):
+    """
+    Return a regex that matches an explicit category.
+
+    name -- name of the category, without namespace, as a regex.
+    """
+    return compiled(CATEGORY_RE_STR % name)
+
+def header(title):
+    """
+    Return a regex that matches a header, of any level.
+
+    title -- title of the section, as a regex.
+    """
+    return compiled(r'=\s*%s\s*=' % title)
+
+def param(name):
+    """
+    Return a regex that matches the start of a template parameter.
+
+    name -- name of the parameter, as a regex.
+    """
+    return compiled(r'%s\s*=' % name)
+
+def param_line(name):
+    """
+    Return a regex that matches a template parameter and the rest of its line.
+
+    name -- name of the parameter, as a regex.
+    """
+    return compiled(r'%s\s*=\s*.*' % name)
+
+def param_value(name, value):
+    """
+    Return a regex that matches a template parameter with a specific value.
+
+    name -- name of the parameter, as a regex.
+    value -- value of the parameter, as a regex.
+
+    Group 1 is everything up to the value.
+    """
+    return re.compile(r'(\|\W*%s\W*=\W*)%s' % (name, value))
+
+def named_param_value(name, value):
+    """
+    Return a regex that matches a template parameter with a specific value.
+
+    name -- name of the parameter, as a regex.
+    value -- value of the parameter, as a regex.
+
+    Group 1 is the whole match.
+    """
+    return re.compile(r'(\|\W*%s\W*=\W*%s)' % (name, value))
+
+def name_param(item):
+    """
+    Return a regex that matches a name parameter with a specific value,
+    followed by another parameter.
+
+    item -- value of the name parameter, as a regex.
+    """
+    return re.compile(r'name\s*=\s*%s\s*\|' % item)
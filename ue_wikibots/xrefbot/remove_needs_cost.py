@@ -22,89 +22,42 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 import sys
 import os
-import operator
-from six.moves import range
 sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 
 import pywikibot
-from pywikibot import pagegenerators
-import re
-import difflib
+import migrate
+import patterns
 
 # Summary message when using this module as a stand-alone script
 summary = u'Robot: Remove from Needs Cost category'
 
-CATEGORY_RE_STR = r'\[\[\s*Category:\s*%s\s*\]\]'
+# This is copied from xref.py
+def _remove_category(text, category):
+    """
+    Return the text with the appropriate category removed.
 
-class ItemBot:
-    def __init__(self, generator, acceptall = False):
-        self.generator = generator
-        self.acceptall = acceptall
+    text -- current page text.
+    category -- the name of the category itself.
 
-    # This is copied from xref.py
-    def _remove_category(self, text, category):
-        """
-        Return the text with the appropriate category removed.
+    Return the new page text.
+    """
+    # Remove the category
+    return patterns.category(category).sub('', text)
 
-        text -- current page text.
-        category -- the name of the category itself.
+@migrate.register(u'remove_needs_cost', u'Special Items', summary)
+def remove_needs_cost(text):
+    """
+    Return text with the Needs Cost category removed.
 
-        Return the new page text.
-        """
-        Rcat = re.compile(CATEGORY_RE_STR % category)
-        # Remove the category
-        return Rcat.sub('', text)
-
-    def update_or_create_page(self, old_page, new_text):
-        """
-        Reads the current text of page old_page,
-        compare it with new_text, prompts the user,
-        and uploads the page
-        """
-        # Read the original content
-        old_text = old_page.get()
-        # Give the user some context
-        if old_text != new_text:
-            pywikibot.output(new_text)
-        pywikibot.showDiff(old_text, new_text)
-        # Get a decision
-        prompt = u'Modify this page ?'
-        # Did anything change ?
-        if old_text == new_text:
-            pywikibot.output(u'No changes necessary to %s' % old_page.title());
-        else:
-            if not self.acceptall:
-                choice = pywikibot.input_choice(u'Do you want to accept these changes?',  [('Yes', 'Y'), ('No', 'n'), ('All', 'a')], 'N')
-                if choice == 'a':
-                    self.acceptall = True
-            if self.acceptall or choice == 'y':
-                # Write out the new version
-                old_page.put(new_text, summary)
-
-    def update_lts(self):
-        """
-        Creates or updates each page in the Special Items category.
-        """
-        # Update every page in the Special Items category
-        cat = pywikibot.Category(pywikibot.Site(), u'Special Items')
-
-        for page in list(cat.articles(recurse=False)):
-            text = page.get()
-            text = self._remove_category(text, u'Needs Cost')
-            # Update the page
-            pywikibot.output(u"\n\n>>> \03{lightpurple}%s\03{default} <<<" % page.title())
-            self.update_or_create_page(page, text);
-
-    def run(self):
-        self.update_lts()
+    text -- current page text.
+    """
+    return _remove_category(text, u'Needs Cost')
 
 def main():
-    bot = ItemBot(None)
-    bot.run()
+    migrate.main([u'remove_needs_cost'])
 
 if __name__ == "__main__":
     try:
         main()
     finally:
         pywikibot.stopme()
-
@@ -0,0 +1,680 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Script and classes to save a snapshot of wiki pages, and read pages from it.
+
+A snapshot is two files:
+<name>.data -- page records, as zlib-compressed blocks of JSON lines.
+<name>.idx  -- index of the records, sorted by title, memory-mapped
+               when read so that any page can be found by binary search
+               without reading the whole snapshot.
+
+Each page record has the title, namespace number, revid, text,
+categories (titles with namespace), and redirect target (or None) of one
+page.
+
+A snapshot is saved along with a table of every redirect on the wiki,
+in <name>.redirects, so that redirects can be resolved without reading
+the redirect pages.
+
+Arguments:
+-snapshot:<name>  Save the snapshot as <name>.data and <name>.idx.
+&params;
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import sys
+import os
+import io
+import json
+import mmap
+import struct
+import threading
+import zlib
+sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
+
+import pywikibot
+from pywikibot import pagegenerators
+from pywikibot.data import api
+import wikitext
+
+docuReplacements = {
+    '&params;': pagegenerators.parameterHelp
+}
+
+# Identifies (and versions) an index file
+_MAGIC = b'UEWSNAP1'
+# Index header is the magic string and the number of entries
+_HEADER = struct.Struct('<8sQ')
+# Each index entry is title offset and length (in the titles that follow
+# the entries), block offset and length (in the data file),
+# record number within the block, and revid
+_ENTRY = struct.Struct('<QHQIHQ')
+
+# Default number of records in each compressed block
+BLOCK_RECORDS = 64
+
+# Keyed by prefix, number of each of the standard namespaces.
+# Other namespaces (like the project namespace) are read from the records
+NAMESPACES = {u'Media': -2,
+              u'Special': -1,
+              u'Talk': 1,
+              u'User': 2,
+              u'User talk': 3,
+              u'Project': 4,
+              u'Project talk': 5,
+              u'File': 6,
+              u'Image': 6,
+              u'File talk': 7,
+              u'Image talk': 7,
+              u'MediaWiki': 8,
+              u'MediaWiki talk': 9,
+              u'Template': 10,
+              u'Template talk': 11,
+              u'Help': 12,
+              u'Help talk': 13,
+              u'Category': 14,
+              u'Category talk': 15}
+
+class SnapshotWriter:
+
+    """Class to write a snapshot, one page record at a time."""
+
+    def __init__(self, name, block_records=BLOCK_RECORDS):
+        """
+        Instantiate the class.
+
+        name -- name of the snapshot, without the file extension.
+        block_records -- number of records to compress together.
+        """
+        self.name = name
+        self.block_records = block_records
+        self._data = io.open(u'%s.data' % name, 'wb')
+        # List of records waiting to be written
+        self._block = []
+        # List of (title, block offset, block length, record number, revid)
+        self._index = []
+
+    def add(self, title, revid, text, categories, redirect=None, namespace=0):
+        """
+        Add a page to the snapshot.
+
+        title -- page title, with namespace.
+        revid -- latest revision of the page.
+        text -- page text.
+        categories -- list of titles of the categories the page is in.
+        redirect -- title of the redirect target, if the page is a redirect.
+        namespace -- namespace number of the page.
+        """
+        self._block.append({u'title': title,
+                            u'namespace': namespace,
+                            u'revid': revid,
+                            u'text': text,
+                            u'categories': categories,
+                            u'redirect': redirect})
+        if len(self._block) >= self.block_records:
+            self._write_block()
+
+    def _write_block(self):
+        """Compress and write the waiting records."""
+        if not self._block:
+            return
+        lines = u'\n'.join(json.dumps(r) for r in self._block)
+        data = zlib.compress(lines.encode('utf-8'))
+        offset = self._data.tell()
+        self._data.write(data)
+        for i, r in enumerate(self._block):
+            self._index.append((r[u'title'], offset, len(data), i, r[u'revid'] or 0))
+        self._block = []
+
+    def close(self):
+        """Write any waiting records and the index."""
+        self._write_block()
+        self._data.close()
+        entries = sorted(self._index, key=lambda e: e[0].encode('utf-8'))
+        titles = []
+        title_off = 0
+        packed = []
+        for title, offset, length, record, revid in entries:
+            t = title.encode('utf-8')
+            packed.append(_ENTRY.pack(title_off, len(t), offset, length, record, revid))
+            titles.append(t)
+            title_off += len(t)
+        with io.open(u'%s.idx' % self.name, 'wb') as f:
+            f.write(_HEADER.pack(_MAGIC, len(entries)))
+            f.write(b''.join(packed))
+            f.write(b''.join(titles))
+
+class Snapshot:
+
+    """
+    Class to read pages from a snapshot.
+
+    The index and data files are memory-mapped read-only, so processes
+    forked after opening the snapshot share them, and instances passed to
+    other processes just map the same files again. Reads never move a
+    shared file offset, and each thread keeps its own most recently used
+    block, so threads can share an instance too.
+    """
+
+    def __init__(self, name):
+        """
+        Instantiate the class.
+
+        name -- name of the snapshot, without the file extension.
+        """
+        self.name = name
+        self._open()
+
+    def _open(self):
+        """Map the index and data files."""
+        with io.open(u'%s.idx' % self.name, 'rb') as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count = _HEADER.unpack_from(self._index, 0)
+        if magic != _MAGIC:
+            raise ValueError(u'%s.idx is not a snapshot index' % self.name)
+        self._titles_start = _HEADER.size + self._count * _ENTRY.size
+        with io.open(u'%s.data' % self.name, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Can't map an empty file, but there's nothing to read anyway
+                self._data = b''
+        # Per thread, most recently decompressed block, as (offset, list of lines)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        """Return the state to pickle - just the name."""
+        return self.name
+
+    def __setstate__(self, state):
+        """Restore from a pickle by mapping the files again."""
+        self.name = state
+        self._open()
+
+    def __len__(self):
+        """Return the number of pages in the snapshot."""
+        return self._count
+
+    def _entry(self, i):
+        """Return the ith index entry, with the title decoded."""
+        (title_off, title_len, offset, length, record, revid) = _ENTRY.unpack_from(self._index,
+                                                                                   _HEADER.size + i * _ENTRY.size)
+        start = self._titles_start + title_off
+        title = self._index[start:start + title_len].decode('utf-8')
+        return (title, offset, length, record, revid)
+
+    def _title_bytes(self, i):
+        """Return the encoded title of the ith index entry."""
+        (title_off, title_len) = _ENTRY.unpack_from(self._index,
+                                                    _HEADER.size + i * _ENTRY.size)[:2]
+        start = self._titles_start + title_off
+        return self._index[start:start + title_len]
+
+    def _find(self, title):
+        """
+        Return the index entry for the specified page.
+
+        title -- page title, with namespace.
+
+        Raise KeyError if the page isn't in the snapshot.
+        """
+        key = title.encode('utf-8')
+        lo = 0
+        hi = self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._title_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._count and self._title_bytes(lo) == key:
+            return self._entry(lo)
+        raise KeyError(title)
+
+    def __contains__(self, title):
+        """Return whether the page is in the snapshot."""
+        try:
+            self._find(title)
+        except KeyError:
+            return False
+        return True
+
+    def titles(self):
+        """Generator to return the title of each page, in sorted order."""
+        for i in range(self._count):
+            yield self._title_bytes(i).decode('utf-8')
+
+    def revid(self, title):
+        """
+        Return the revid of a page in the snapshot.
+
+        title -- page title, with namespace.
+
+        Raise KeyError if the page isn't in the snapshot.
+        """
+        return self._find(title)[4]
+
+    def _block(self, offset, length):
+        """Return the list of record lines in the block at offset."""
+        last_block = getattr(self._local, 'block', (None, None))
+        if last_block[0] != offset:
+            data = self._data[offset:offset + length]
+            last_block = (offset, zlib.decompress(data).decode('utf-8').split(u'\n'))
+            self._local.block = last_block
+        return last_block[1]
+
+    def record(self, title):
+        """
+        Return the record for a page, as a dict.
+
+        title -- page title, with namespace.
+
+        Raise KeyError if the page isn't in the snapshot.
+        """
+        (title, offset, length, record, revid) = self._find(title)
+        return json.loads(self._block(offset, length)[record])
+
+    def records(self):
+        """Generator to return every record, reading each block once."""
+        # Find the blocks from the index
+        blocks = {}
+        for i in range(self._count):
+            (offset, length) = _ENTRY.unpack_from(self._index,
+                                                  _HEADER.size + i * _ENTRY.size)[2:4]
+            blocks[offset] = length
+        for offset in sorted(blocks):
+            for line in self._block(offset, blocks[offset]):
+                yield json.loads(line)
+
+    def page(self, title):
+        """
+        Return a SnapshotPage for the specified title.
+
+        title -- page title, with namespace.
+        """
+        return SnapshotPage(self, title)
+
+class SnapshotPage:
+
+    """
+    Class that provides the parts of the pywikibot Page interface that
+    these scripts use, for a page in a Snapshot.
+    """
+
+    def __init__(self, snapshot, title, record=None):
+        """
+        Instantiate the class.
+
+        snapshot -- Snapshot that the page is in (or isn't).
+        title -- page title, with namespace.
+        record -- the page's record, if already read.
+        """
+        self.snapshot = snapshot
+        self._title = title
+        self._record = record
+
+    def __repr__(self):
+        return u'%s(%s)' % (self.__class__.__name__, self._title)
+
+    def __eq__(self, other):
+        return isinstance(other, SnapshotPage) and self._title == other._title
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._title)
+
+    def _get_record(self):
+        """
+        Return the page's record.
+
+        Raise pywikibot.NoPage if the page isn't in the snapshot.
+        """
+        if self._record is None:
+            try:
+                self._record = self.snapshot.record(self._title)
+            except KeyError:
+                raise pywikibot.NoPage(self)
+        return self._record
+
+    def _split_title(self):
+        """
+        Return a 2-tuple of the namespace number of the page and its title
+        without the namespace.
+
+        Standard namespaces are recognised from the prefix. Otherwise the
+        namespace is read from the page's record, so that main namespace
+        titles that include a colon keep all of their title.
+        """
+        (prefix, colon, rest) = self._title.partition(u':')
+        if not colon:
+            return (0, self._title)
+        try:
+            return (NAMESPACES[prefix], rest)
+        except KeyError:
+            pass
+        try:
+            ns = self._get_record().get(u'namespace', 0)
+        except pywikibot.NoPage:
+            ns = 0
+        if ns == 0:
+            return (0, self._title)
+        return (ns, rest)
+
+    def title(self, withNamespace=True, asLink=False):
+        """Return the title of the page."""
+        title = self._title
+        if not withNamespace:
+            title = self._split_title()[1]
+        if asLink:
+            return u'[[%s]]' % title
+        return title
+
+    def namespace(self):
+        """Return the namespace number of the page."""
+        return self._split_title()[0]
+
+    def exists(self):
+        """Return whether the page is in the snapshot."""
+        return self._title in self.snapshot
+
+    def isRedirectPage(self):
+        """Return whether the page is a redirect."""
+        return self._get_record()[u'redirect'] is not None
+
+    def getRedirectTarget(self):
+        """Return the SnapshotPage that this page redirects to."""
+        return self.__class__(self.snapshot, self._get_record()[u'redirect'])
+
+    def get(self, get_redirect=False):
+        """
+        Return the text of the page.
+
+        get_redirect -- pass True to return the text of a redirect page,
+                        rather than raising pywikibot.IsRedirectPage.
+        """
+        record = self._get_record()
+        if record[u'redirect'] is not None and not get_redirect:
+            raise pywikibot.IsRedirectPage(self)
+        return record[u'text']
+
+    def latestRevision(self):
+        """Return the revid of the page in the snapshot."""
+        return self._get_record()[u'revid']
+
+    def categories(self):
+        """Return a list of SnapshotPages for the categories the page is in."""
+        return [self.__class__(self.snapshot, c) for c in self._get_record()[u'categories']]
+
+    def templatesWithParams(self):
+        """
+        Return a list of 2-tuples, one for each template used on the page,
+        of the template's SnapshotPage and a list of parameter strings.
+        """
+        text = self.get(get_redirect=True)
+        retval = []
+        for use in wikitext.outline(text).templates:
+            template = self.__class__(self.snapshot, u'Template:%s' % use.name)
+            retval.append((template, [p.strip() for p in use.params(text)]))
+        return retval
+
+def _query(site, params):
+    """
+    Generator to return the results of an API query, one request at a time.
+
+    site -- Site to query.
+    params -- dict of query parameters.
+
+    Both the current (continue) and legacy (query-continue) ways of
+    asking for the next part of the results are followed.
+    """
+    params = dict(params)
+    params[u'continue'] = u''
+    while True:
+        data = api.Request(site=site, **params).submit()
+        yield data
+        if u'continue' in data:
+            params.update(data[u'continue'])
+        elif u'query-continue' in data:
+            for module in data[u'query-continue'].values():
+                params.update(module)
+        else:
+            return
+
+def namespace_numbers(site):
+    """
+    Return a sorted list of the numbers of the namespaces on a wiki.
+
+    site -- Site of interest.
+
+    Asks the wiki, rather than relying on how the installed pywikibot
+    represents namespaces.
+    """
+    data = api.Request(site=site,
+                       action=u'query',
+                       meta=u'siteinfo',
+                       siprop=u'namespaces').submit()
+    return sorted(int(ns) for ns in data[u'query'][u'namespaces'])
+
+class RedirectTable:
+
+    """Class to map the titles of redirect pages to the titles of their targets."""
+
+    def __init__(self, targets=None):
+        """
+        Instantiate the class.
+
+        targets -- dict, keyed by redirect title, of target titles.
+        """
+        self._targets = targets or {}
+
+    @classmethod
+    def from_wiki(cls, site):
+        """
+        Return a new table of every redirect on a wiki.
+
+        site -- Site to list the redirects of.
+
+        The redirects are listed, with their targets, 500 at a time.
+        """
+        targets = {}
+        params = {u'action': u'query',
+                  u'generator': u'allpages',
+                  u'gapfilterredir': u'redirects',
+                  u'gaplimit': u'max',
+                  u'redirects': u''}
+        for ns in namespace_numbers(site):
+            if ns < 0:
+                continue
+            params[u'gapnamespace'] = ns
+            for data in _query(site, params):
+                for r in data.get(u'query', {}).get(u'redirects', []):
+                    targets[r[u'from']] = r[u'to']
+        return cls(targets)
+
+    @classmethod
+    def build(cls, snap):
+        """
+        Return a new table of the redirects in a snapshot.
+
+        snap -- Snapshot to read.
+        """
+        targets = {}
+        for record in snap.records():
+            if record[u'redirect'] is not None:
+                targets[record[u'title']] = record[u'redirect']
+        return cls(targets)
+
+    @classmethod
+    def load(cls, name):
+        """
+        Return the table saved with a snapshot.
+
+        name -- name of the snapshot.
+
+        Raise IOError if there's no saved table.
+        """
+        with io.open(u'%s.redirects' % name, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def save(self, name):
+        """
+        Save the table with a snapshot.
+
+        name -- name of the snapshot.
+        """
+        with io.open(u'%s.redirects' % name, 'w', encoding='utf-8') as f:
+            f.write(u'%s' % json.dumps(self._targets, indent=0, sort_keys=True))
+
+    def __len__(self):
+        """Return the number of redirects."""
+        return len(self._targets)
+
+    def __contains__(self, title):
+        """Return whether the specified page is a redirect."""
+        return title in self._targets
+
+    def target(self, title):
+        """
+        Return the title of the page that a page redirects to, or None.
+
+        title -- page title, with namespace.
+        """
+        return self._targets.get(title)
+
+    def redirects_to(self, titles):
+        """
+        Return a dict, keyed by redirect title, of the redirects to some pages.
+
+        titles -- set of titles of the pages of interest.
+        """
+        return dict((r, t) for (r, t) in self._targets.items() if t in titles)
+
+def open_redirects(name):
+    """
+    Return the RedirectTable for a snapshot.
+
+    name -- name of the snapshot.
+
+    If no table was saved with the snapshot, one is built from the
+    redirects in the snapshot itself.
+    """
+    try:
+        return RedirectTable.load(name)
+    except IOError:
+        return RedirectTable.build(Snapshot(name))
+
+# Number of pages to read in each request when saving a snapshot
+SAVE_BATCH = 50
+
+def _save_batch(writer, site, titles):
+    """
+    Read some pages, with their categories, and add them to a snapshot.
+
+    writer -- SnapshotWriter to add the pages to.
+    site -- Site to read the pages from.
+    titles -- list of titles of the pages to read, at most SAVE_BATCH.
+
+    The text, revid, namespace, and categories of every page are read
+    together, rather than with a request for each page's categories.
+    """
+    params = {u'action': u'query',
+              u'prop': u'info|revisions|categories',
+              u'rvprop': u'ids|content',
+              u'cllimit': u'max',
+              u'titles': u'|'.join(titles)}
+    # Keyed by title, the parts of the page's record read so far
+    pages = {}
+    for data in _query(site, params):
+        for p in data.get(u'query', {}).get(u'pages', {}).values():
+            if u'missing' in p or u'invalid' in p:
+                continue
+            record = pages.setdefault(p[u'title'], {u'namespace': p[u'ns'],
+                                                    u'redirect': u'redirect' in p,
+                                                    u'categories': []})
+            if p.get(u'revisions'):
+                rev = p[u'revisions'][0]
+                record[u'revid'] = rev[u'revid']
+                record[u'text'] = rev.get(u'*', u'')
+            # Categories may be split across several responses
+            record[u'categories'] += [c[u'title'] for c in p.get(u'categories', [])]
+    for title in sorted(pages):
+        record = pages[title]
+        if u'text' not in record:
+            continue
+        redirect = None
+        if record[u'redirect']:
+            # The target is the first link in the redirect page
+            links = [l for l in wikitext.link_uses(record[u'text']) if l.title]
+            if links:
+                redirect = links[0].title
+        writer.add(title,
+                   record[u'revid'],
+                   record[u'text'],
+                   record[u'categories'],
+                   redirect,
+                   record[u'namespace'])
+
+def save_snapshot(name, generator):
+    """
+    Save a snapshot of the specified pages.
+
+    name -- name of the snapshot, without the file extension.
+    generator -- iterator of Pages to save.
+
+    The pages are read SAVE_BATCH at a time.
+    """
+    site = pywikibot.Site()
+    writer = SnapshotWriter(name)
+    try:
+        titles = []
+        for page in generator:
+            titles.append(page.title())
+            if len(titles) >= SAVE_BATCH:
+                _save_batch(writer, site, titles)
+                titles = []
+        if titles:
+            _save_batch(writer, site, titles)
+    finally:
+        writer.close()
+
+def main():
+    name = None
+    genFactory = pagegenerators.GeneratorFactory()
+
+    for arg in pywikibot.handleArgs():
+        if arg.startswith(u'-snapshot:'):
+            name = arg[len(u'-snapshot:'):]
+        else:
+            genFactory.handleArg(arg)
+
+    gen = genFactory.getCombinedGenerator()
+    if not name or not gen:
+        pywikibot.showHelp()
+    else:
+        save_snapshot(name, gen)
+        RedirectTable.from_wiki(pywikibot.Site()).save(name)
+
+if __name__ == "__main__":
+    try:
+        main()
+    finally:
+        pywikibot.stopme()
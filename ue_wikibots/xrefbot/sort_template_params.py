@@ -28,6 +28,7 @@ sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 import pywikibot
 import re
 import difflib
+import wikitext
 
 # Summary message when using this module as a stand-alone script
 summary = u'Robot: Sort Lab/Lt template parameters'
@@ -62,71 +63,14 @@ def lt_sort_key(param):
         # Sort all unnumbered ones before all numbered ones
         return (0, param)
 
-def next_template_end(text, start, end):
+def sort_lt_params(editor, use):
     """
-    Returns the index of the next u'{{' or u'}}' in text[start:end].
-    Raises ValueError if neither are present.
-    """
-    left = text.find(u'{{', start, end)
-    if left == -1:
-        return text.index(u'}}', start, end)
-    right = text.find(u'}}', start, end)
-    if left < right or right == -1:
-        return left
-    return right
-
-def template_bounds(text, template):
-    """
-    Finds the specified template in the text. Returns a 2-tuple of
-    (start_index, end_index) such that text[start_index:end_index]
-    starts and ends with the {{...}}.
-    """
-    # Find the start of the template of interest,
-    # and the end of the last template in text
-    start = text.index(u'{{%s' % template)
-    end = text.rindex(u'}}')
-
-    # Go through the text between start and end, finding
-    # all the start and end template markers.
-    start_2 = start
-    braces = []
-    while True:
-        try:
-            pos = next_template_end(text, start_2 + 2, end)
-        except ValueError:
-            # We've found all the starts and ends
-            break
-        # Add this one to the list
-        braces.append((text[pos:pos+2], pos))
-        # Continue checking after this one
-        start_2 = pos
-    # Now we can go through the list pairing up braces
-    # We know the list is sorted by position
-    # We started inside the template of interest
-    nesting = 1
-    for brace in braces:
-        if brace[0] == u'}}':
-            # This is the end of the current template
-            nesting -= 1
-            if nesting == 0:
-                # Current template is the template of interest
-                end = brace[1]
-                break
-        else:
-            # Start of a nested template
-            nesting += 1
+    Sort the parameters of a Lieutenant template into a more reasonable order.
 
-    # Include the start and end template markers
-    return (start, end+2)
-
-def sort_lt_params(text, template, params):
-    """
-    Return text with the specified parameters sorted into a more reasonable order
+    editor -- wikitext.TemplateEditor for the page text.
+    use -- wikitext.TemplateUse for the template.
     """
-    start, end = template_bounds(text, template)
-    new_text = u'{{%s\n|' % template + u'\n|'.join(sorted(params,
-                                                          key=lt_sort_key)) + u'\n}}'
-    return text[:start] + new_text + text[end:]
+    editor.reorder_params(use, lt_sort_key)
 
 def lab_sort_key(param):
     """
@@ -139,14 +83,14 @@ def lab_sort_key(param):
         # Sort all unnumbered ones before all numbered ones
         return (0, param)
 
-def sort_lab_params(text, template, params):
+def sort_lab_params(editor, use):
     """
-    Return text with the specified parameters sorted into a more reasonable order
+    Sort the parameters of a Lab template into a more reasonable order.
+
+    editor -- wikitext.TemplateEditor for the page text.
+    use -- wikitext.TemplateUse for the template.
     """
-    start, end = template_bounds(text, template)
-    new_text = u'{{%s\n|' % template + u'\n|'.join(sorted(params,
-                                                          key=lab_sort_key)) + u'\n}}'
-    return text[:start] + new_text + text[end:]
+    editor.reorder_params(use, lab_sort_key)
 
 class ItemBot:
     def __init__(self, acceptall = False):
@@ -196,15 +140,15 @@ class ItemBot:
         pages = set(cat1.articles(recurse=False)) | set(cat2.articles(recurse=False))
 
         for page in pages:
-            text = page.get()
-            for t,p in page.templatesWithParams():
-                title = t.title(withNamespace=False)
+            editor = wikitext.TemplateEditor(page.get())
+            for use in editor.templates():
                 # We only care about a few templates
                 # but some pages use more than one of them
-                if u'Lieutenant' in title:
-                    text = sort_lt_params(text, title, p);
-                if title.startswith(u'Lab'):
-                    text = sort_lab_params(text, title, p)
+                if u'Lieutenant' in use.name:
+                    sort_lt_params(editor, use)
+                if use.name.startswith(u'Lab'):
+                    sort_lab_params(editor, use)
+            text = editor.apply()
             # Update the page
             pywikibot.output(u"\n\n>>> \03{lightpurple}%s\03{default} <<<" % page.title())
             self.update_or_create_page(page, text);
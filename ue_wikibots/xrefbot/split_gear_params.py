@@ -22,96 +22,56 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 import sys
 import os
-import operator
-from six.moves import range
 sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 
 import pywikibot
-from pywikibot import pagegenerators
 import re
-import difflib
+import migrate
+import wikitext
 
 # Summary message when using this module as a stand-alone script
 summary = u'Robot: Split gear parameter into separate items and counts'
 
-# Set of REs to replace, from 4 items down to 1
-# TODO Can probably construct these in a similar way to replacement, below
+# RE to match one item in the value of the gear parameter
 # TODO This converts e.g. "gear=2 [[Condo]]s" to "gear_1_count=2|gear_1=Condos" with an extra "s"
-gearRe = [re.compile(r'\|\W*gear=.*$\n^\*\s*(?P<count_1>[<0-9]+)\s+\[\[(?P<item_1>[^|\]\n]*).*\]\]\W*$\n^\*\s*(?P<count_2>[<0-9]+)\s+\[\[(?P<item_2>[^|\]\n]*).*\]\]\W*$\n^\*\s*(?P<count_3>[<0-9]+)\s+\[\[(?P<item_3>[^|\]\n]*).*\]\]\W*$\n^\*\s*(?P<count_4>[<0-9]+)\s+\[\[(?P<item_4>[^|\]\n]*).*\]\]', re.MULTILINE),
-          re.compile(r'\|\W*gear=.*$\n^\*\s*(?P<count_1>[<0-9]+)\s+\[\[(?P<item_1>[^|\]\n]*).*\]\]\W*$\n^\*\s*(?P<count_2>[<0-9]+)\s+\[\[(?P<item_2>[^|\]\n]*).*\]\]\W*$\n^\*\s*(?P<count_3>[<0-9]+)\s+\[\[(?P<item_3>[^|\]\n]*).*\]\]', re.MULTILINE),
-          re.compile(r'\|\W*gear=.*$\n^\*\s*(?P<count_1>[<0-9]+)\s+\[\[(?P<item_1>[^|\]\n]*).*\]\]\W*$\n^\*\s*(?P<count_2>[<0-9]+)\s+\[\[(?P<item_2>[^|\]\n]*).*\]\]', re.MULTILINE),
-          re.compile(r'\|\W*gear=\s*(?P<count_1>[<0-9]+)\W+\[\[(?P<item_1>[^|\]\n]*)\]\]')]
+GEAR_RE = re.compile(r'(?P<count>[<0-9]+)\W+\[\[(?P<item>[^|\]\n]*)')
 
 # String to use to replace one item
-one_item = r'|gear_%d_count=\g<count_%d>\n|gear_%d=\g<item_%d>'
+one_item = u'gear_%d_count=%s\n|gear_%d=%s'
 
-class GearBot:
-    def __init__(self, generator, acceptall = False):
-        self.generator = generator
-        self.acceptall = acceptall
-        # Set of replacement strings, from 4 items down to 1
-        self.replacement = []
-        for n in range(1,5):
-            new_str = one_item % (n, n, n, n)
-            try:
-                new_str = self.replacement[n-2] + r'\n' + new_str
-            except IndexError:
-                pass
-            self.replacement.append(new_str)
-        self.replacement.reverse()
+def split_gear(editor, use):
+    """
+    Replace the gear parameter of a template with separate items and counts.
 
-    def update_or_create_page(self, old_page, new_text):
-        """
-        Reads the current text of page old_page,
-        compare it with new_text, prompts the user,
-        and uploads the page
-        """
-        # Read the original content
-        old_text = old_page.get()
-        # Give the user some context
-        if old_text != new_text:
-            pywikibot.output(new_text)
-        pywikibot.showDiff(old_text, new_text)
-        # Get a decision
-        prompt = u'Modify this page ?'
-        # Did anything change ?
-        if old_text == new_text:
-            pywikibot.output(u'No changes necessary to %s' % old_page.title());
-        else:
-            if not self.acceptall:
-                choice = pywikibot.input_choice(u'Do you want to accept these changes?',  [('Yes', 'Y'), ('No', 'n'), ('All', 'a')], 'N')
-                if choice == 'a':
-                    self.acceptall = True
-            if self.acceptall or choice == 'y':
-                # Write out the new version
-                old_page.put(new_text, summary)
+    editor -- wikitext.TemplateEditor for the page text.
+    use -- wikitext.TemplateUse for the template.
+    """
+    gear = editor.value(use, u'gear')
+    if gear is None:
+        return
+    items = []
+    for n, m in enumerate(GEAR_RE.finditer(gear), 1):
+        items.append(one_item % (n, m.group('count'), n, m.group('item')))
+    if items:
+        editor.replace_param(use, u'gear', u'\n|'.join(items))
 
-    def update_areas(self):
-        """
-        Creates or updates each page in the Areas category.
-        """
-        # Update every page in the Areas category
-        cat = pywikibot.Category(pywikibot.Site(), u'Areas')
+@migrate.register(u'split_gear_params', u'Areas', summary)
+def split_gear_params(text):
+    """
+    Return text with every gear parameter split into items and counts.
 
-        #for page in list(cat.articles(recurse=True)):
-        for page in list(cat.articles(recurse=False)):
-            text = page.get()
-            for n in range(len(gearRe)):
-                text = gearRe[n].sub(self.replacement[n], text)
-            # Update the page
-            pywikibot.output(u"\n\n>>> \03{lightpurple}%s\03{default} <<<" % page.title())
-            self.update_or_create_page(page, text);
-
-    def run(self):
-        self.update_areas()
+    text -- current page text.
+    """
+    editor = wikitext.TemplateEditor(text)
+    for use in editor.templates():
+        split_gear(editor, use)
+    return editor.apply()
 
 def main():
-    bot = GearBot(None)
-    bot.run()
+    migrate.main([u'split_gear_params'])
 
 if __name__ == "__main__":
     try:
         main()
     finally:
         pywikibot.stopme()
-
@@ -22,97 +22,55 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 import sys
 import os
-import operator
-from six.moves import range
 sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 
 import pywikibot
-from pywikibot import pagegenerators
 import re
-import difflib
+import migrate
+import wikitext
 
 # Summary message when using this module as a stand-alone script
 summary = u'Robot: Split item parameter into separate items and counts'
 
-# Set of REs to replace, from 3 items down to 1
-# TODO Can probably construct these in a similar way to replacement, below
-itemRe = [re.compile(r'\|\W*items=.*$\n^\*\s*\[\[(?P<item_1>[^|\]\n]*).*?\]\]\W+(?P<effect_1>.*)$\n^\*\s*\[\[(?P<item_2>[^|\]\n]*).*?\]\]\W+(?P<effect_2>.*)$\n^\*\s*\[\[(?P<item_3>[^|\]\n]*).*?\]\]\W+(?P<effect_3>.*)', re.MULTILINE),
-          re.compile(r'\|\W*items=.*$\n^\*\s*\[\[(?P<item_1>[^|\]\n]*).*?\]\]\W+(?P<effect_1>.*)$\n^\*\s*\[\[(?P<item_2>[^|\]\n]*).*?\]\]\W+(?P<effect_2>.*)', re.MULTILINE),
-          re.compile(r'\|\W*items=\s*\[\[(?P<item_1>[^|\]\n]*).*?\]\]\W+(?P<effect_1>.*)')]
+# RE to match one item in the value of the items parameter
+ITEM_RE = re.compile(r'\[\[(?P<item>[^|\]\n]*).*?\]\]\W+(?P<effect>.*)')
 
 # String to use to replace one item
-one_item = r'|item_%d=\g<item_%d>\n|item_%d_pwr=\g<effect_%d>'
+one_item = u'item_%d=%s\n|item_%d_pwr=%s'
 
-class ItemBot:
-    def __init__(self, generator, acceptall = False):
-        self.generator = generator
-        self.acceptall = acceptall
-        # Set of replacement strings, from 4 items down to 1
-        self.replacement = []
-        for n in range(1,4):
-            new_str = one_item % (n, n, n, n)
-            try:
-                new_str = self.replacement[n-2] + r'\n' + new_str
-            except IndexError:
-                pass
-            self.replacement.append(new_str)
-        self.replacement.reverse()
+def split_items(editor, use):
+    """
+    Replace the items parameter of a template with separate items and effects.
 
-    def update_or_create_page(self, old_page, new_text):
-        """
-        Reads the current text of page old_page,
-        compare it with new_text, prompts the user,
-        and uploads the page
-        """
-        # Read the original content
-        old_text = old_page.get()
-        # Give the user some context
-        if old_text != new_text:
-            pywikibot.output(new_text)
-        pywikibot.showDiff(old_text, new_text)
-        # Get a decision
-        prompt = u'Modify this page ?'
-        # Did anything change ?
-        if old_text == new_text:
-            pywikibot.output(u'No changes necessary to %s' % old_page.title());
-        else:
-            if not self.acceptall:
-                choice = pywikibot.input_choice(u'Do you want to accept these changes?',  [('Yes', 'Y'), ('No', 'n'), ('All', 'a')], 'N')
-                if choice == 'a':
-                    self.acceptall = True
-            if self.acceptall or choice == 'y':
-                # Write out the new version
-                old_page.put(new_text, summary)
+    editor -- wikitext.TemplateEditor for the page text.
+    use -- wikitext.TemplateUse for the template.
+    """
+    value = editor.value(use, u'items')
+    if value is None:
+        return
+    items = []
+    for n, m in enumerate(ITEM_RE.finditer(value), 1):
+        items.append(one_item % (n, m.group(u'item'), n, m.group(u'effect')))
+    if items:
+        editor.replace_param(use, u'items', u'\n|'.join(items))
 
-    def update_lts(self):
-        """
-        Creates or updates each page in the Lieutenants category.
-        """
-        # Update every page in the Lieutenants category
-        cat = pywikibot.Category(pywikibot.Site(), u'Lieutenants')
+@migrate.register(u'split_item_params', u'Lieutenants', summary)
+def split_item_params(text):
+    """
+    Return text with every items parameter split into items and effects.
 
-        for page in list(cat.articles(recurse=False)):
-            text = page.get()
-            for n in range(len(itemRe)):
-                pywikibot.output("Checking for %d item(s)\n" % (3-n))
-                m = itemRe[n].search(text)
-                if m is not None:
-                    pywikibot.output("Found a match. item_1=%s, effect_1=%s" % (m.group(u'item_1'), m.group(u'effect_1')))
-                text = itemRe[n].sub(self.replacement[n], text)
-            # Update the page
-            pywikibot.output(u"\n\n>>> \03{lightpurple}%s\03{default} <<<" % page.title())
-            self.update_or_create_page(page, text);
-
-    def run(self):
-        self.update_lts()
+    text -- current page text.
+    """
+    editor = wikitext.TemplateEditor(text)
+    for use in editor.templates():
+        split_items(editor, use)
+    return editor.apply()
 
 def main():
-    bot = ItemBot(None)
-    bot.run()
+    migrate.main([u'split_item_params'])
 
 if __name__ == "__main__":
     try:
         main()
     finally:
         pywikibot.stopme()
-
@@ -35,6 +35,9 @@ Generate the following tables:
 - Insignias Table
 - Bosses Table
 - Chem-Packs Table
+
+Each table is declared in TABLES, and all the requested tables are built
+in a single pass through the pages they need.
 """
 
 from __future__ import absolute_import
@@ -51,11 +54,19 @@ from pywikibot import pagegenerators
 import re
 import difflib
 import utils
+import wikitext
+import editqueue
+import pageindex
+import patterns
+import snapshot
 import argparse
 
 # Summary message when using this module as a stand-alone script
 summary = u'Robot: Create/update item summary tables'
 
+# Structural data kept between runs
+metadata = utils.metadata
+
 # Handy regular expressions
 ITEM_TEMPLATES = re.compile(u'.*\WItem')
 PROPERTY_TEMPLATES = re.compile(u'.*\WProperty')
@@ -569,7 +580,7 @@ def secret_job_dates(areas):
     Returns a dict, keyed by area name, of dates.
     """
     retval = {}
-    page = pywikibot.Page(pywikibot.Site(), u'History')
+    page = utils.get_page(u'History')
     text = page.get()
     # Split it at dates (some entries span multiple lines)
     #DATE_RE = re.compile(r'([-0-9]* [A-Z][a-z]{2} 20[1-9][0-9])', re.MULTILINE)
@@ -634,19 +645,23 @@ def page_to_areas_rows(page, template):
     # This will toggle to secrets when we get to the first secret job
     jobs = main
 
-    templatesWithParams = page.templatesWithParams()
-    for (t, params) in templatesWithParams:
-        template_name = t.title(withNamespace=False)
+    # Where each job appears on the page
+    job_starts = {}
+    for use in wikitext.outline(text).template_uses(u'Job'):
+        job_name = utils.param_from_params(use.params(text), u'name')
+        if job_name:
+            job_starts.setdefault(job_name.strip(), use.start)
+
+    templatesWithParams = utils.templates_with_params(page)
+    for (template_name, params) in templatesWithParams:
         # We're only interested in Jobs
         if template_name == u'Job':
             if not jobs == secrets:
                 # Check whether this is the first secret job
                 job_name = utils.param_from_params(params,
                                                    u'name')
-                m = re.search(r'name=%s' % job_name, text)
-                if m:
-                    if m.start() > secrets_start:
-                        jobs = secrets
+                if job_name and job_starts.get(job_name.strip(), -1) > secrets_start:
+                    jobs = secrets
 
             p = utils.param_from_params(params,
                                         u'total_energy')
@@ -704,7 +719,7 @@ def sort_lts(row, area):
     # First find the rarities of the 4 LTs
     rarities = {}
     for i in range(1,5):
-        m = re.search(r'\|lt_%d_rarity\s*=\s*(?P<rarity>[^|\s]*)' % i, row)
+        m = patterns.compiled(r'\|lt_%d_rarity\s*=\s*(?P<rarity>[^|\s]*)' % i).search(row)
         if m:
             rarities[i] = m.group('rarity')
         else:
@@ -837,7 +852,7 @@ def page_to_row(page, row_template):
         sidekick_stats = {}
         for r in [u'Common', u'Uncommon', u'Rare', u'Epic']:
             sidekick_stats[r] = u''
-            p = pywikibot.Page(pywikibot.Site(), u'Template:Sidekick %s' % r)
+            p = utils.get_page(u'Template:Sidekick %s' % r)
             templatesWithParams = p.templatesWithParams()
             for (template, params) in templatesWithParams:
                 if template.title(withNamespace=False) != u'Sidekick':
@@ -935,10 +950,7 @@ def rarities():
     """
     Return an ordered list of rarities.
     """
-    # TODO Dynamically create the list from the rarity page
-    rarities = []
-    page = pywikibot.Page(pywikibot.Site(), u'Rarity')
-    return [u'Common', u'Uncommon', u'Rare', u'Epic', u'Legendary']
+    return utils.rarities.ascending()
 
 def prop_row_key(text):
     """
@@ -956,32 +968,408 @@ def prop_row_key(text):
 
 def areas_in_order():
     """Return a list of Area pages in in=game order."""
-    # Utils provides a function that does most of the work
-    jobs_page = pywikibot.Page(pywikibot.Site(), u'Jobs')
-    return utils.areas_in_order(jobs_page.get())
+    def derive():
+        # Utils provides a function that does most of the work
+        jobs_page = pywikibot.Page(pywikibot.Site(), u'Jobs')
+        return utils.areas_in_order(jobs_page.get())
+    return metadata.get(u'areas',
+                        lambda: utils.page_revids([u'Jobs']),
+                        derive)
+
+def factions():
+    """Return a list of the factions Lts can belong to."""
+    def derive():
+        retval = []
+        cat = pywikibot.Category(pywikibot.Site(), u'Factions')
+        for faction in list(cat.articles()):
+            # There's now a "The Shadow" faction page, but all Lts are still "Unaffiliated"
+            if faction.title() == 'The Shadow':
+                continue
+            retval.append(faction.title())
+        return retval
+    return metadata.get(u'factions',
+                        lambda: utils.category_sizes([u'Category:Factions']),
+                        derive)
+
+
+def select_page_row(bot, table, page, categories):
+    """
+    Return the row for one page of a table with a row per page.
+
+    bot -- XrefBot building the table.
+    table -- Table being built.
+    page -- Page to parse.
+    categories -- set of names of the table's categories the page is in.
+    """
+    return [(page.title(), page_to_row(page, table.row_template))]
+
+def select_property_rows(bot, table, page, categories):
+    """
+    Return the rows for one page of the Properties Table.
+
+    Parameters as for select_page_row().
+    """
+    title = page.title()
+    rows = page_to_rows(page, table.row_template, bot.fortress_cost_ratios())
+    if not rows:
+        if title == u'Fortress':
+            rows = fortress_rows(title,
+                                 page.get(),
+                                 table.row_template,
+                                 bot.fortress_table())
+        elif title in [u'Safe House', u'The Cayman Islands']:
+            rows = safe_house_rows(title, page.get(), table.row_template)
+        else:
+            pywikibot.output("Unexpected non-template property page %s" % title)
+    return [(prop_row_key(row), row) for row in rows]
+
+def select_job_rows(bot, table, page, categories):
+    """
+    Return the rows for one page of the Jobs Table, in in-game order.
+
+    Parameters as for select_page_row().
+    """
+    key = bot.area_key(page.title())
+    return [((key, page.title(), i), row)
+            for i, row in enumerate(page_to_rows(page, table.row_template))]
+
+def select_area_row(bot, table, page, categories):
+    """
+    Return the row for one page of the Challenge Jobs Table, in in-game order.
+
+    Parameters as for select_page_row().
+    """
+    key = bot.area_key(page.title())
+    return [((key, page.title()), page_to_row(page, table.row_template))]
+
+def select_secret_row(bot, table, page, categories):
+    """
+    Return the row for one page of the Secret Jobs Table, in in-game order.
+
+    Parameters as for select_page_row().
+    """
+    key = bot.area_key(page.title())
+    row = page_to_secret_row(page, table.row_template, bot.secret_dates())
+    return [((key, page.title()), row)]
+
+def select_areas_rows(bot, table, page, categories):
+    """
+    Return the rows for one page of the Areas Table, in in-game order.
+
+    Parameters as for select_page_row().
+    """
+    key = bot.area_key(page.title())
+    return [((key, page.title(), i), row)
+            for i, row in enumerate(page_to_areas_rows(page, table.row_template))]
+
+def select_area_gear(bot, table, page, categories):
+    """
+    Return the gear needed for the jobs in one page of the Area Gear Table.
+
+    Parameters as for select_page_row().
+
+    The data is a 2-tuple of area name and a dict from gear_needed().
+    """
+    key = bot.area_key(page.title())
+    return [((key, page.title()), (page.title(), gear_needed(page)))]
+
+def select_lt_faction(bot, table, page, categories):
+    """
+    Return the faction of one page of the Lieutenants Faction Rarity Table.
+
+    Parameters as for select_page_row().
+
+    The data is a 3-tuple of rarity, faction, and Lt name.
+    """
+    name = page.title()
+    retval = []
+    for (template_name, params) in utils.templates_with_params(page):
+        if LIEUTENANT_TEMPLATES.search(template_name):
+            faction = utils.param_from_params(params, u'faction')
+            for i, rarity in enumerate(rarities()):
+                if u'%s Lieutenants' % rarity in categories:
+                    retval.append(((i, name),
+                                   (rarity, faction, name)))
+    return retval
+
+def select_chem_pack(bot, table, page, categories):
+    """
+    Return the data for one page of the Chem-Packs Table.
+
+    Parameters as for select_page_row().
+
+    The data for a Chem-Pack is a 4-tuple of u'pack', faction, pack name,
+    and list of source strings. The data for a boss is a 2-tuple of u'boss'
+    and boss name, once for each boss category it's in.
+    """
+    pack_to_faction = {u'Cartel':    u'The Cartel',
+                       u'Syndicate': u'Dragon Syndicate',
+                       u'Mafia':     u'The Mafia',
+                       u'Street':    u'Street',
+                       u'Shadow':    u'Unaffiliated'
+                      }
+    page_title = page.title()
+    retval = []
+    if u'Chem-Packs' in categories:
+        # Not interested in IV or V
+        if page_title[-1] != u'V':
+            sources = []
+            for (template_name, params) in utils.templates_with_params(page):
+                if template_name != u'Ingredient':
+                    continue
+                source_str = utils.param_from_params(params, u'from')
+                # Discard the initial u'<br/>'
+                sources = source_str.split(u'\n')[1:]
+            faction = pack_to_faction[page_title.split(None, 1)[0]]
+            retval.append(((0, page_title),
+                           (u'pack', faction, page_title, sources)))
+    # We want a row for each boss
+    for i, cat in enumerate(CHEM_PACK_BOSS_CATEGORIES):
+        if cat in categories:
+            retval.append(((1, i, page_title), (u'boss', page_title)))
+    return retval
+
+def render_rows(bot, table, rows):
+    """
+    Return the text of a table page with one row per entry.
+
+    bot -- XrefBot building the table.
+    table -- Table being built.
+    rows -- sorted list of row text.
+    """
+    # Start the new page text
+    new_text = summary_header(table.row_template)
+    for row in rows:
+        new_text += row + u'\n'
+    # Finish with a footer
+    new_text += summary_footer(table.row_template)
+    return new_text
+
+def render_area_gear(bot, table, gear):
+    """
+    Return the text of the Area Gear Table page.
+
+    bot -- XrefBot building the table.
+    table -- Table being built.
+    gear -- list, in in-game order, of 2-tuples of area name and a dict,
+            indexed by item/property name, of 2-tuples containing the
+            number of that item/property required and its image.
+    """
+    text = u'<!-- This page was generated/modified by software -->\n'
+    text += u'This page lists the gear required to complete all the jobs in each area (including secret jobs). Details are pulled from the individual [[:Category:Areas|Area]] pages, so any errors or omissions there will be reflected here.\n'
+    for (area, the_gear) in gear:
+        text += u'==[[%s]]==\n' % area
+        for g in sorted(the_gear.keys()):
+            (n, img) = the_gear[g]
+            # Check for special placeholder indicating "some number"
+            if n == -1:
+               num = u'?'
+            else:
+               num = str(n)
+            text += u'*%s [[File:%s||100px]] [[%s]]\n' % (num, img, g)
+    text += u'[[Category:Summary Tables]]'
+    return text
+
+def render_lt_faction_rarity(bot, table, lts):
+    """
+    Return the text of the Lieutenants Faction Rarity Table page.
+
+    bot -- XrefBot building the table.
+    table -- Table being built.
+    lts -- list, in rarity order, of 3-tuples of rarity, faction,
+           and Lt name.
+    """
+    counts = defaultdict(lambda: 0)
+    new_text = lt_faction_rarity_header(bot.factions)
+    for rarity in rarities():
+        lieutenants = defaultdict(list)
+        for (r, faction, name) in lts:
+            if r == rarity:
+                lieutenants[faction].append(name)
+                counts[faction] += 1
+        if lieutenants:
+            new_text += lt_faction_rarity_row(bot.factions, rarity, lieutenants)
+    # Add a "Totals" row
+    new_text += u'|-\n'
+    new_text += u'!scope=row | Total\n'
+    for f in bot.factions:
+        new_text += u'|%d\n' % counts[f]
+    new_text += summary_footer(None)
+    return new_text
+
+def render_chem_packs(bot, table, data):
+    """
+    Return the text of the Chem-Packs Table page.
+
+    bot -- XrefBot building the table.
+    table -- Table being built.
+    data -- sorted list of data from select_chem_pack().
+    """
+    # Keyed by faction
+    # Each element is a 2-tuple containing pack name and list of source bosses
+    packs_dict = {}
+    for d in data:
+        if d[0] == u'pack':
+            packs_dict.setdefault(d[1], []).append((d[2], d[3]))
+
+    # Start the new page text
+    new_text = chem_pack_header(bot.factions)
+
+    # We want a row for each boss
+    # with each column populated if it drops that pack
+    for d in data:
+        if d[0] != u'boss':
+            continue
+        page_title = d[1]
+        new_text += u'|-\n'
+        new_text += u'| [[%s]]\n' % page_title
+        for faction in bot.factions:
+            for item, sources in packs_dict.get(faction, []):
+                if u'*[[%s]]' % page_title in sources:
+                    new_text += u'| style="background-color:%s; color:black" | Y\n' % faction_to_colour[faction]
+                else:
+                    new_text += u'| style="background-color:%s" |\n' % faction_to_colour[faction]
+        new_text += u'\n'
+
+    # Finish with a footer
+    new_text += summary_footer(None)
+    return new_text
+
+class Table:
+
+    """
+    Declaration of a summary table page.
+
+    A table is built from the pages in a set of categories.
+    Each of those pages is passed to the table's select function,
+    which returns a list of 2-tuples of sort key and data, and all the
+    data, sorted by key, is passed to the table's render function,
+    which returns the text of the table page.
+    """
+
+    def __init__(self, page, categories, row_template, select,
+                 render=render_rows, recurse=False):
+        """
+        Instantiate the class.
+
+        page -- title of the table page.
+        categories -- list of names of the categories of pages to include,
+                      or a function that returns one.
+        row_template -- template to use for each row, or None.
+        select -- function taking the XrefBot, the Table, a Page, and the
+                  set of names of the table's categories that the page
+                  is in. May raise IrrelevantRowError to skip the page.
+        render -- function taking the XrefBot, the Table, and the sorted
+                  list of data.
+        recurse -- pass True to include pages in subcategories.
+        """
+        self.page = page
+        self.categories = categories
+        self.row_template = row_template
+        self.select = select
+        self.render = render
+        self.recurse = recurse
+
+    def category_names(self):
+        """Return the list of names of the categories of pages to include."""
+        if callable(self.categories):
+            return self.categories()
+        return self.categories
+
+# Categories with a table of items
+ITEM_CATEGORIES = [u'Rifles',
+                   u'Handguns',
+                   u'Melee Weapons',
+                   u'Heavy Weapons',
+                   u'Vehicles',
+                   u'Gear']
+
+# Categories of bosses
+BOSS_CATEGORIES = [u'Tech Lab Bosses',
+                   u'Legend Bosses',
+                   u'Job Bosses',
+                   u'Bosses'] # For War Hounds
+
+# Categories of bosses that may drop Chem-Packs, in table order
+CHEM_PACK_BOSS_CATEGORIES = [u'Legend Bosses',
+                             u'Tech Lab Bosses',
+                             u'Bosses', # for War Hounds
+                             u'Job Bosses']
+
+# Every summary table
+TABLES = [Table(u'%s Table' % c, [c], u'Item Row', select_page_row) for c in ITEM_CATEGORIES] + [
+    Table(u'Lieutenants Table', [u'Lieutenants'], u'Lieutenant Row', select_page_row),
+    Table(u'Sidekicks Table', [u'Sidekicks'], u'Sidekick Row', select_page_row),
+    Table(u'Insignias Table', [u'Insignias'], u'Insignia Row', select_page_row),
+    Table(u'Bosses Table', BOSS_CATEGORIES, u'Boss Row', select_page_row),
+    Table(u'Properties Table', [u'Properties'], u'Property Row', select_property_rows,
+          recurse=True),
+    Table(u'Jobs Table', [u'Areas'], u'Job Row', select_job_rows),
+    Table(u'Challenge Jobs Table', [u'Areas'], u'Challenge Job Row', select_area_row),
+    Table(u'Secret Jobs Table', [u'Areas'], u'Secret Job Row', select_secret_row),
+    Table(u'Areas Table', [u'Areas'], u'Area Row', select_areas_rows),
+    Table(u'Area Gear Table', [u'Areas'], None, select_area_gear, render_area_gear),
+    Table(u'Lieutenants Faction Rarity Table',
+          lambda: utils.rarities.categories(u'Lieutenants'),
+          None,
+          select_lt_faction,
+          render_lt_faction_rarity),
+    Table(u'Chem-Packs Table',
+          [u'Chem-Packs'] + CHEM_PACK_BOSS_CATEGORIES,
+          None,
+          select_chem_pack,
+          render_chem_packs),
+]
+
+def _category_members(index, category, recurse):
+    """
+    Return the set of titles of the pages in a category, from an index.
+
+    index -- pageindex.PageIndex to look in.
+    category -- name of the category, without namespace.
+    recurse -- pass True to include pages in subcategories.
+
+    Like Category.articles(), the result doesn't include subcategories.
+    """
+    retval = set()
+    todo = [category]
+    done = set()
+    while todo:
+        cat = todo.pop()
+        done.add(cat)
+        for title in index.pages_in_category(cat):
+            if not title.startswith(u'Category:'):
+                retval.add(title)
+            elif recurse and title[len(u'Category:'):] not in done:
+                todo.append(title[len(u'Category:'):])
+    return retval
 
 
 class XrefBot:
     """Class to create/update pages summarising sets of pages on the wiki."""
 
-    def __init__(self, pages, acceptall = False):
+    def __init__(self, pages, acceptall = False, snap=None, index=None, edits=None):
         """
         Instantiate the class.
 
         pages      -- list of pages to create/update
         accept_all -- Pass True to not ask the user whether to create/update
                       pages.
+        snap       -- snapshot.Snapshot to read pages from, rather than the wiki.
+        index      -- pageindex.PageIndex of snap.
+        edits      -- editqueue.EditQueue to upload pages with, or None to
+                      upload each page before building the next.
         """
         self.acceptall = acceptall
+        self.edits = edits
         self.pages = pages
+        self.snap = snap
+        self.index = index
         self.areas = areas_in_order()
-        self.factions = []
-        cat = pywikibot.Category(pywikibot.Site(), u'Factions')
-        for faction in list(cat.articles()):
-            # There's now a "The Shadow" faction page, but all Lts are still "Unaffiliated"
-            if faction.title() == 'The Shadow':
-                continue
-            self.factions.append(faction.title())
+        self.factions = factions()
+        # Data read from other pages, when first needed
+        self._secret_dates = None
+        self._fortress_table = None
 
     def _update_or_create_page(self, old_page, new_text):
         """
@@ -1019,368 +1407,125 @@ class XrefBot:
                                                 'N')
                 if choice == 'a':
                     self.acceptall = True
-            if self.acceptall or choice == 'y':
+            if not (self.acceptall or choice == 'y'):
+                pass
+            elif self.edits is not None:
+                # The table doesn't depend on the old text,
+                # so if someone else edits it first just replace it again
+                self.edits.submit(old_page, new_text, summary, lambda text, page: new_text)
+            else:
                 # Write out the new version
                 old_page.put(new_text, summary)
 
-    def update_properties_table(self):
-        """
-        Create or update page Properties Table.
-
-        Read every page in the Properties category and create/update the summary
-        page accordingly.
-        """
-        # Extract cost ratio table from the Fortress page
-        fortress_page = pywikibot.Page(pywikibot.Site(), u'Fortress')
-        fortress_text = fortress_page.get()
-        fortress_dict = parsed_fortress_table(fortress_text)
-        lvl_to_ratio = fortress_cost_ratios(fortress_dict)
-        # Categories we're interested in
-        the_cat = u'Properties'
-        # Template we're going to use
-        row_template = u'Property Row'
-
-        old_page = pywikibot.Page(pywikibot.Site(), u'Properties Table')
-
-        rows = []
-        cat = pywikibot.Category(pywikibot.Site(), the_cat)
-        for page in set(cat.articles(recurse=True)):
-            new_rows = page_to_rows(page, row_template, lvl_to_ratio)
-            title = page.title()
-            if new_rows:
-                rows += new_rows
-            elif title == u'Fortress':
-                # Use the cached page text
-                rows += fortress_rows(title,
-                                      fortress_text,
-                                      row_template,
-                                      fortress_dict)
-            elif title == u'Safe House':
-                rows += safe_house_rows(title, page.get(), row_template)
-            elif title == u'The Cayman Islands':
-                rows += safe_house_rows(title, page.get(), row_template)
-            else:
-                pywikibot.output("Unexpected non-template property page %s" % title)
-
-        # Start the new page text
-        new_text = summary_header(row_template)
-        # Sort rows into a sensible order
-        for row in sorted(rows, key=prop_row_key):
-            new_text += row + u'\n'
-        # Finish with a footer
-        new_text += summary_footer(row_template)
-        # Upload it
-        self._update_or_create_page(old_page, new_text);
-
-    def _area_key(self, page):
-        """Return the sort key for a Page for an Area."""
+    def area_key(self, title):
+        """Return the sort key for the title of an Area page."""
         try:
-            return self.areas.index(page.title())
+            return self.areas.index(title)
         except ValueError:
             # Put any we don't know about at the end
             return 10000
 
-    def _dict_to_gear_page(self, gear_dict):
-        """
-        Return the text of the Area Gear Table page.
+    def secret_dates(self):
+        """Return the secret job release dates from secret_job_dates()."""
+        if self._secret_dates is None:
+            self._secret_dates = secret_job_dates(self.areas)
+        return self._secret_dates
 
-        gear_dict -- a dict, indexed by area Page, of dicts,
-                     indexed by item/property name, of 2-tuples containing the
-                     number of that item/property required and its image.
-        """
-        text = u'<!-- This page was generated/modified by software -->\n'
-        text += u'This page lists the gear required to complete all the jobs in each area (including secret jobs). Details are pulled from the individual [[:Category:Areas|Area]] pages, so any errors or omissions there will be reflected here.\n'
-        for area in sorted(list(gear_dict.keys()), key=self._area_key):
-            text += u'==[[%s]]==\n' % area.title()
-            the_gear = gear_dict[area]
-            for gear in sorted(the_gear.keys()):
-                (n, img) = the_gear[gear]
-                # Check for special placeholder indicating "some number"
-                if n == -1:
-                   num = u'?'
-                else:
-                   num = str(n)
-                text += u'*%s [[File:%s||100px]] [[%s]]\n' % (num, img, gear)
-        text += u'[[Category:Summary Tables]]'
-        return text
+    def fortress_table(self):
+        """Return the table from the Fortress page, from parsed_fortress_table()."""
+        if self._fortress_table is None:
+            fortress_page = utils.get_page(u'Fortress')
+            self._fortress_table = parsed_fortress_table(fortress_page.get())
+        return self._fortress_table
 
-    def update_chem_packs_table(self):
-        """
-        Create or update the Chem-Packs summary page.
+    def fortress_cost_ratios(self):
+        """Return the cost ratios from the Fortress page."""
+        return fortress_cost_ratios(self.fortress_table())
 
-        Read every page in the Chem-Packs category and create/update page
-        Chem-Packs Table accordingly.
+    def _members(self, categories):
         """
-        if u'Chem-Packs Table' not in self.pages:
-            return
+        Generator to return the pages in a set of categories.
 
-        # Template to use
-        pack_to_faction = {u'Cartel':    u'The Cartel',
-                           u'Syndicate': u'Dragon Syndicate',
-                           u'Mafia':     u'The Mafia',
-                           u'Street':    u'Street',
-                           u'Shadow':    u'Unaffiliated'
-                          }
-        boss_cats = [u'Legend Bosses',
-                     u'Tech Lab Bosses',
-                     u'Bosses', # for War Hounds
-                     u'Job Bosses']
-
-        cat = pywikibot.Category(pywikibot.Site(), u'Chem-Packs')
-
-        packs_dict = {}
-
-        # Populate packs_dict
-        # Keyed by faction
-        # Each element is a 2-tuple containing pack name and list of source bosses
-        for page in cat.articles():
-            page_title = page.title()
-            # Not interested in IV or V
-            if page_title[-1] == u'V':
-                continue
-            # Add to the dict
-            templatesWithParams = page.templatesWithParams()
-            for (template, params) in templatesWithParams:
-                if template.title(withNamespace=False) != u'Ingredient':
-                    continue
-                source_str = utils.param_from_params(params, u'from')
-                # Discard the initial u'<br/>'
-                sources = source_str.split(u'\n')[1:]
-            faction = pack_to_faction[page_title.split(None, 1)[0]]
-            packs_dict.setdefault(faction, []).append((page_title, sources))
-
-        # Start the new page text
-        new_text = chem_pack_header(self.factions)
-
-        # We want a row for each boss
-        # with each column populated if it drops that pack
-        for cat in boss_cats:
-            c = pywikibot.Category(pywikibot.Site(),
-                                   u'Category:%s' % cat)
-            for page in c.articles():
-                page_title = page.title()
-                new_text += u'|-\n'
-                new_text += u'| [[%s]]\n' % page_title
-                for faction in self.factions:
-                    for item, sources in packs_dict[faction]:
-                        if u'*[[%s]]' % page_title in sources:
-                            new_text += u'| style="background-color:%s; color:black" | Y\n' % faction_to_colour[faction]
-                        else:
-                            new_text += u'| style="background-color:%s" |\n' % faction_to_colour[faction]
-                new_text += u'\n'
-
-        # Finish with a footer
-        new_text += summary_footer(None)
-
-        # Upload the new pages
-        page = pywikibot.Page(pywikibot.Site(), u'Chem-Packs Table')
-        self._update_or_create_page(page, new_text);
-
-    def update_jobs_tables(self):
-        """
-        Create or update the job summary pages.
+        categories -- set of 2-tuples of category name and recurse flag.
 
-        Read every page in the Areas category and create/update pages
-        Jobs Table, Challenge Jobs Table, Secret Jobs Table, Areas Table, and
-        Area Gear Table accordingly.
+        Yields 2-tuples of Page and the set of the 2-tuples in categories
+        that the page is in. Each page is read once, however many
+        categories it's in.
         """
-        # Templates to use
-        job_row_template = u'Job Row'
-        dice_row_template = u'Challenge Job Row'
-        secret_row_template = u'Secret Job Row'
-        area_row_template = u'Area Row'
-
-        job_rows = []
-        dice_rows = []
-        secret_rows = []
-        areas_rows = []
-        gear_dict = {}
-
-        cat = pywikibot.Category(pywikibot.Site(), u'Areas')
-
-        secret_dates = secret_job_dates(self.areas)
-
-        # Go through the area pages in in-game order
-        for page in sorted(cat.articles(), key=self._area_key):
-            # One row per use of the template on a page in category
-            job_rows += page_to_rows(page, job_row_template)
-            dice_rows.append(page_to_row(page, dice_row_template))
-            secret_rows.append(page_to_secret_row(page,
-                                                  secret_row_template,
-                                                  secret_dates))
-            areas_rows += page_to_areas_rows(page, area_row_template)
-            # Add an entry to gear_dict for this page
-            gear_dict.update({page: gear_needed(page)})
-
-        # Start the new page text
-        new_job_text = summary_header(job_row_template)
-        new_dice_text = summary_header(dice_row_template)
-        new_areas_text = summary_header(area_row_template)
-        new_secret_text = summary_header(secret_row_template)
-
-        for row in job_rows:
-            new_job_text += row + u'\n'
-        for row in dice_rows:
-            new_dice_text += row + u'\n'
-        for row in areas_rows:
-            new_areas_text += row + u'\n'
-        for row in secret_rows:
-            new_secret_text += row + u'\n'
-
-        # Finish with a footer
-        new_job_text += summary_footer(job_row_template)
-        new_dice_text += summary_footer(dice_row_template)
-        new_areas_text += summary_footer(area_row_template)
-        new_secret_text += summary_footer(secret_row_template)
-
-        # Generate the area gear page from the dict
-        if u'Area Gear Table' in self.pages:
-            new_gear_text = self._dict_to_gear_page(gear_dict)
-
-        # Upload the new pages
-        if u'Jobs Table' in self.pages:
-            job_page = pywikibot.Page(pywikibot.Site(), u'Jobs Table')
-            self._update_or_create_page(job_page, new_job_text);
-        if u'Challenge Jobs Table' in self.pages:
-            dice_job_page = pywikibot.Page(pywikibot.Site(),
-                                           u'Challenge Jobs Table')
-            self._update_or_create_page(dice_job_page, new_dice_text);
-        if u'Secret Jobs Table' in self.pages:
-            secret_job_page = pywikibot.Page(pywikibot.Site(),
-                                             u'Secret Jobs Table')
-            self._update_or_create_page(secret_job_page, new_secret_text);
-        if u'Areas Table' in self.pages:
-            areas_page = pywikibot.Page(pywikibot.Site(),
-                                        u'Areas Table')
-            self._update_or_create_page(areas_page, new_areas_text);
-        if u'Area Gear Table' in self.pages:
-            area_gear_page = pywikibot.Page(pywikibot.Site(),
-                                            u'Area Gear Table')
-            self._update_or_create_page(area_gear_page, new_gear_text);
-
-    def update_lt_rarity_table(self):
+        members = {}
+        if self.index is not None:
+            for (cat, recurse) in categories:
+                for title in _category_members(self.index, cat, recurse):
+                    members.setdefault(title, set()).add((cat, recurse))
+            # One pass through the snapshot, in the order it's stored
+            for record in self.snap.records():
+                if record[u'title'] in members:
+                    page = snapshot.SnapshotPage(self.snap, record[u'title'], record)
+                    yield (page, members[record[u'title']])
+            return
+        pages = []
+        for (cat, recurse) in categories:
+            c = pywikibot.Category(pywikibot.Site(), u'Category:%s' % cat)
+            for page in c.articles(recurse=recurse):
+                if page.title() not in members:
+                    pages.append(page)
+                members.setdefault(page.title(), set()).add((cat, recurse))
+        # Fetch the text of all the pages in bulk
+        for page in pagegenerators.PreloadingGenerator(pages):
+            yield (page, members[page.title()])
+
+    def update_tables(self, tables):
         """
-        Create or update page Lieutenants Faction Rarity Table.
+        Create or update a set of summary pages.
 
-        Read every page in the Lieutenants category and create/update the
-        summary page accordingly.
-        """
-        old_page = pywikibot.Page(pywikibot.Site(),
-                                  u'Lieutenants Faction Rarity Table')
-        counts = defaultdict(lambda: 0)
-        new_text = lt_faction_rarity_header(self.factions)
-        for rarity in rarities():
-            lieutenants = {}
-            lt_cat = pywikibot.Category(pywikibot.Site(),
-                                        u'%s Lieutenants' % rarity)
-            for lt in list(lt_cat.articles()):
-                name = lt.title()
-                templatesWithParams = lt.templatesWithParams()
-                for (template, params) in templatesWithParams:
-                    template_name = template.title(withNamespace=False)
-                    match = LIEUTENANT_TEMPLATES.search(template_name)
-                    if match:
-                        faction = utils.param_from_params(params,
-                                                          u'faction')
-                        lieutenants.setdefault(faction, []).append(name)
-                        counts[faction] += 1
-            if lieutenants:
-                new_text += lt_faction_rarity_row(self.factions, rarity, lieutenants)
-        # Add a "Totals" row
-        new_text += u'|-\n'
-        new_text += u'!scope=row | Total\n'
-        for f in self.factions:
-            new_text += u'|%d\n' % counts[f]
-        new_text += summary_footer(None)
-        # Upload it
-        self._update_or_create_page(old_page, new_text);
-
-    def update_most_tables(self):
-        """
-        Create or update most summary pages.
-
-        Read every page in the categories listed below and create/update the
-        corresponding summary page:
-        Rifles - Rifles Table
-        Handguns - Handguns Table
-        Melee Weapons - Melee Weapons Tale
-        Heavy Weapons - Heavy Weapons Table
-        Vehicles - Vehicles Table
-        Gear - Gear Table
-        Lieutenants - Lieutenants Table
-        Sidekicks - Sidekicks Table
-        Insignias - Insignias Table
-        Job Bosses, Tech Lab Bosses, Legend Bosses - Bosses Table
+        tables -- list of Tables to create/update.
+
+        All the tables are built in one pass through the pages they use.
         """
-        # Categories we're interested in and row template to use for each category
-        cat_to_templ = {u'Rifles': ('Item Row', []),
-                        u'Handguns': ('Item Row', []),
-                        u'Melee Weapons': ('Item Row', []),
-                        u'Heavy Weapons': ('Item Row', []),
-                        u'Vehicles': ('Item Row', []),
-                        u'Gear': ('Item Row', []),
-                        u'Lieutenants': ('Lieutenant Row', []),
-                        u'Sidekicks': ('Sidekick Row', []),
-                        u'Insignias' : (u'Insignia Row', []),
-                        u'Bosses' : (u'Boss Row', [u'Tech Lab Bosses',
-                                                   u'Legend Bosses',
-                                                   u'Job Bosses',
-                                                   u'Bosses'])} # For War Hounds
-
-        # Go through cat_to_templ, and create/update summary page for each one
-        for name, (template, cat_list) in cat_to_templ.items():
-            # The current summary table page for this category
-            page_name = u'%s Table' % name
-            # Skip pages the user isn't interested in
-            if page_name not in self.pages:
-                continue
-            old_page = pywikibot.Page(pywikibot.Site(), page_name)
-            # The category of interest
-            if len(cat_list) > 0:
-                articles = []
-                for name in cat_list:
-                    cat = pywikibot.Category(pywikibot.Site(),
-                                             u'Category:%s' % name)
-                    articles.extend(list(cat.articles()))
-            else:
-                cat = pywikibot.Category(pywikibot.Site(),
-                                         u'Category:%s' % name)
-                articles = list(cat.articles())
-            # Create one row for each page in the category
-            rows = {}
-            for page in articles:
+        # Keyed by table page, list of category names
+        table_cats = dict((table.page, table.category_names()) for table in tables)
+        categories = set()
+        for table in tables:
+            for cat in table_cats[table.page]:
+                categories.add((cat, table.recurse))
+        # Keyed by table page, list of 2-tuples of sort key and data
+        data = dict((table.page, []) for table in tables)
+        for (page, in_cats) in self._members(categories):
+            for table in tables:
+                cats = set(cat for cat in table_cats[table.page] if (cat, table.recurse) in in_cats)
+                if not cats:
+                    continue
                 try:
-                    rows[page.title()] = page_to_row(page, template)
+                    data[table.page] += table.select(self, table, page, cats)
                 except IrrelevantRowError:
                     pass
-            # Start the new page text
-            new_text = summary_header(template)
-            # Sort rows by item (page) name, and append each one
-            for key in sorted(rows.keys()):
-                new_text += rows[key] + u'\n'
-            # Finish with a footer
-            new_text += summary_footer(template)
+        for table in tables:
+            rows = sorted(data[table.page], key=operator.itemgetter(0))
+            new_text = table.render(self, table, [d for (key, d) in rows])
             # Upload it
+            old_page = pywikibot.Page(pywikibot.Site(), table.page)
             self._update_or_create_page(old_page, new_text);
 
     def run(self):
         """Create/update all the summary pages."""
-        self.update_most_tables()
-        if u'Properties Table' in self.pages:
-            self.update_properties_table()
-        if ((u'Jobs Table' in self.pages) or
-            (u'Challenge Jobs Table' in self.pages) or
-            (u'Secret Jobs Table' in self.pages) or
-            (u'Areas Table' in self.pages) or
-            (u'Area Gear Table' in self.pages)):
-            self.update_jobs_tables()
-        if u'Lieutenants Faction Rarity Table' in self.pages:
-            self.update_lt_rarity_table()
-        if u'Chem-Packs Table' in self.pages:
-            self.update_chem_packs_table()
-
-def main(pages):
-    bot = XrefBot(pages)
+        try:
+            self.update_tables([t for t in TABLES if t.page in self.pages])
+        finally:
+            if self.edits is not None:
+                self.edits.close()
+                self.edits.report()
+
+def main(pages, snapshot_name=None, queue=False):
+    snap = None
+    index = None
+    if snapshot_name:
+        (snap, index) = pageindex.open_snapshot(snapshot_name)
+        # Read any other pages from the snapshot, too
+        utils.use_snapshot(snap)
+    edits = None
+    if queue:
+        edits = editqueue.EditQueue()
+    bot = XrefBot(pages, snap=snap, index=index, edits=edits)
     bot.run()
 
 if __name__ == "__main__":
@@ -1407,6 +1552,8 @@ if __name__ == "__main__":
     for a in sorted(arguments.keys()):
         s = arguments[a]
         parser.add_argument(a, help="Create/update the %s page" % s, dest='pages', action='append_const', const=s)
+    parser.add_argument('--snapshot', metavar='NAME', help="Read pages from snapshot NAME (see snapshot.py), rather than the wiki")
+    parser.add_argument('--queue', action='store_true', help="Upload the pages from a background queue, rather than saving each one before building the next")
     args = parser.parse_args()
 
     # Default to "all" if no specific pages listed
@@ -1414,7 +1561,7 @@ if __name__ == "__main__":
     if not pages:
         pages = list(arguments.values())
     try:
-        main(pages)
+        main(pages, args.snapshot, args.queue)
     finally:
         pywikibot.stopme()
 
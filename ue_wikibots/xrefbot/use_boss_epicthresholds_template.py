@@ -22,96 +22,36 @@ from __future__ import absolute_import
 from __future__ import print_function
 import sys
 import os
-import operator
 sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 
 import pywikibot
-import difflib
-import utils
+import migrate
 
 # Summary message when using this module as a stand-alone script
-summary = u'Robot: Use BossSpeedkill template'
-
-class DropBot:
-
-    """Class to insert the BossSpeedkill template on every page."""
-
-    def __init__(self, acceptall = False):
-        """
-        Class constructor.
-
-        acceptall -- pass True to not ask for user confirmation before
-                     updating pages.
-        """
-        self.acceptall = acceptall
-
-    def treat(self, page):
-        """
-        Check the page, and update if necessary.
-
-        page -- Page to check.
-        """
-        try:
-            # Show the title of the page we're working on.
-            # Highlight the title in purple.
-            pywikibot.output(u"\n\n>>> \03{lightpurple}%s\03{default} <<<" % page.title())
-            text = page.get()
-            old_text = text
-            text = text.replace(u'#', u'{{BossEpicThresholds|1 Epic:=', 1)
-            text = text.replace(u'#', u'|2 Epics:=', 1)
-            text = text.replace(u'#', u'|3 Epics:=', 1)
-            tmp_text = text
-	    text = text.replace(u'\n==={{Legendary}} Rewards', u'}}\n==={{Legendary}} Rewards')
-            if tmp_text == text:
-	        text = text.replace(u'\n==={{Epic}} Rewards', u'}}\n==={{Epic}} Rewards')
-            text = text.replace(u' points',u'')
-            # Give the user some context
-            pywikibot.showDiff(old_text, text)
-            # TODO Modify to treat just whitespace as unchanged
-            # Just comparing text with page.get() wasn't sufficient
-            changes = False
-            for diffline in difflib.ndiff(page.get().splitlines(),
-                                          text.splitlines()):
-                if not diffline.startswith(u'  '):
-                    changes = True
-                    break
-            if changes:
-                if not self.acceptall:
-                    choice = pywikibot.input_choice(u'Do you want to accept these changes?',
-                                                    [('Yes', 'Y'),
-                                                     ('No', 'n'),
-                                                     ('All', 'a')],
-                                                    'N')
-                    if choice == 'a':
-                        self.acceptall = True
-                if self.acceptall or choice == 'y':
-                    page.put(text, summary)
-            else:
-                pywikibot.output('No changes were necessary in %s' % page.title())
-        except pywikibot.NoPage:
-            pywikibot.output("Page %s does not exist?!" % page.title(asLink=True))
-        except pywikibot.IsRedirectPage:
-            pywikibot.output("Page %s is a redirect; skipping." % page.title(asLink=True))
-        except pywikibot.LockedPage:
-            pywikibot.output("Page %s is locked?!" % page.title(asLink=True))
-
-    def run(self):
-        """Call treat() for every Boss page."""
-        cat = pywikibot.Category(pywikibot.Site(),
-                                 u'Category:Bosses')
-        #all_cats = set(c.title(withNamespace=False) for c in cat.subcategories(recurse=True))
-        #all_cats.append(cat)
-        pages = cat.articles(recurse=True)
-        for page in pages:
-            self.treat(page)
+summary = u'Robot: Use BossEpicThresholds template'
+
+@migrate.register(u'use_boss_epicthresholds_template', u'Bosses', summary, recurse=True)
+def use_epic_thresholds_template(text):
+    """
+    Return text with the epic thresholds list replaced by the template.
+
+    text -- current page text.
+    """
+    text = text.replace(u'#', u'{{BossEpicThresholds|1 Epic:=', 1)
+    text = text.replace(u'#', u'|2 Epics:=', 1)
+    text = text.replace(u'#', u'|3 Epics:=', 1)
+    tmp_text = text
+    text = text.replace(u'\n==={{Legendary}} Rewards', u'}}\n==={{Legendary}} Rewards')
+    if tmp_text == text:
+        text = text.replace(u'\n==={{Epic}} Rewards', u'}}\n==={{Epic}} Rewards')
+    text = text.replace(u' points',u'')
+    return text
 
 def main():
-    bot = DropBot()
-    bot.run()
+    migrate.main([u'use_boss_epicthresholds_template'])
 
 if __name__ == "__main__":
     try:
         main()
     finally:
         pywikibot.stopme()
-
@@ -23,15 +23,28 @@ from __future__ import print_function
 import sys
 import os
 import operator
+import io
+import json
+import time
 sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
 
 import pywikibot
+from pywikibot import pagegenerators
+from pywikibot.data import api
 import re
+import pageindex
+import wikitext
 
 # Separate the name and value for a template parameter
 _PARAM_RE = re.compile(r'\s*(?P<name>[^=]+)\s*=\s*(?P<value>.*)', re.DOTALL)
 # Find the colour and name of a rarity
 _RARITY_RE = re.compile(r'\*.*color:(?P<colour>[^"]*)">(?P<rarity>[^<]*)')
+# Lt rewards in events always specify how many of the Lt you get
+_EVENT_LT_RE = re.compile(r'\d\s*x?\s*\[\[\s*(?P<lt>[^]|]*)')
+# Line listing the main prizes of an event
+_EVENT_TOP_RE = re.compile(r'Top (10|25) - (?P<rewards>.*)')
+# Any list item in an event page (where all the rewards are)
+_EVENT_BULLET_RE = re.compile(r'\*(?P<entry>.*)')
 
 def escape_str(string):
     """
@@ -48,6 +61,247 @@ def escape_str(string):
     string = re.sub(r'\+', u'\+', string)
     return re.sub(r'\]', u'\]', string)
 
+class TemplateParams(list):
+    """
+    The parameters to one use of a template.
+
+    This is the list of parameter strings, exactly as returned by
+    Page.templatesWithParams(), so it can be used anywhere such a list
+    is used. It also provides dict-style access to the parameter values,
+    keyed by name. Each parameter string is only parsed once.
+    """
+
+    def __init__(self, params=()):
+        """
+        Instantiate the class.
+
+        params -- list of template parameter strings.
+        """
+        list.__init__(self, params)
+        self._reset()
+
+    def _reset(self):
+        """Forget the parsed parameters."""
+        self._names = None
+        self._values = None
+
+    def _parse(self):
+        """Parse the parameter strings, if not already done."""
+        if self._values is not None:
+            return
+        names = []
+        values = {}
+        for p in self:
+            m = _PARAM_RE.match(p)
+            if m is not None:
+                name = m.group('name')
+                if name not in values:
+                    names.append(name)
+                values.setdefault(name, []).append(m.group('value'))
+        self._names = names
+        self._values = values
+
+    def value(self, name, verbatim=False):
+        """
+        Return the value of the named parameter, or None if it isn't present.
+
+        name -- parameter to find the value for.
+        verbatim -- return empty string or '?' rather than None
+        """
+        self._parse()
+        for val in self._values.get(name, []):
+            # People sometimes provide the parameters,
+            # even though we don't know the value
+            if verbatim or (val != u'' and val != u'?'):
+                return val
+        return None
+
+    def __getitem__(self, key):
+        """
+        Return the parameter string at an index, or the value for a name.
+
+        key -- an index or slice into the list of parameter strings, or
+               the name of a parameter.
+
+        Raise KeyError if there is no parameter with the specified name.
+        If a parameter is repeated, the last value is returned.
+        """
+        if isinstance(key, (int, slice)):
+            return list.__getitem__(self, key)
+        self._parse()
+        return self._values[key][-1]
+
+    def get(self, name, default=None):
+        """Return the value for the named parameter, or default."""
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def has_param(self, name):
+        """Return whether there is a parameter with the specified name."""
+        self._parse()
+        return name in self._values
+
+    def keys(self):
+        """Return a list of the parameter names, in the order they appear."""
+        self._parse()
+        return list(self._names)
+
+    def items(self):
+        """Return a list of (name, value) 2-tuples, in the order they appear."""
+        return [(n, self[n]) for n in self.keys()]
+
+    def as_dict(self):
+        """Return a new dict, indexed by parameter name, of parameter values."""
+        return dict(self.items())
+
+    # Anything that changes the list invalidates the parsed parameters
+    def __setitem__(self, key, value):
+        list.__setitem__(self, key, value)
+        self._reset()
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        self._reset()
+
+    def __iadd__(self, other):
+        result = list.__iadd__(self, other)
+        self._reset()
+        return result
+
+    def append(self, p):
+        list.append(self, p)
+        self._reset()
+
+    def extend(self, params):
+        list.extend(self, params)
+        self._reset()
+
+    def insert(self, index, p):
+        list.insert(self, index, p)
+        self._reset()
+
+    def remove(self, p):
+        list.remove(self, p)
+        self._reset()
+
+    def pop(self, *args):
+        result = list.pop(self, *args)
+        self._reset()
+        return result
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._reset()
+
+    def reverse(self):
+        list.reverse(self)
+        self._reset()
+
+# Snapshot or FactTable to read pages from in get_page(), if any
+_snapshot = None
+
+def use_snapshot(snap):
+    """
+    Read pages from a snapshot, rather than the wiki, in get_page().
+
+    snap -- snapshot.Snapshot or facts.FactTable to read pages from,
+            or None to use the wiki.
+    """
+    global _snapshot
+    _snapshot = snap
+
+# snapshot.RedirectTable to resolve redirects with, if any
+_redirects = None
+
+def use_redirects(table):
+    """
+    Resolve redirects with a table, rather than by reading the redirect pages.
+
+    table -- snapshot.RedirectTable, or None to read the pages.
+    """
+    global _redirects
+    _redirects = table
+
+def is_redirect(page):
+    """
+    Return whether a page is a redirect.
+
+    page -- Page of interest.
+    """
+    if _redirects is not None:
+        return page.title() in _redirects
+    return page.isRedirectPage()
+
+def get_page(title):
+    """
+    Return the page with the specified title, for reading.
+
+    title -- page title, with namespace.
+
+    Return a snapshot.SnapshotPage if use_snapshot() was called,
+    otherwise a pywikibot Page.
+    """
+    if _snapshot is not None:
+        return _snapshot.page(title)
+    return pywikibot.Page(pywikibot.Site(), title)
+
+def get_pages(titles):
+    """
+    Return a dict, keyed by title, of pages for reading, fetched together.
+
+    titles -- titles of the pages of interest, with namespace.
+
+    The text of all the pages is read from the wiki in as few requests
+    as possible, unless use_snapshot() was called.
+    """
+    if _snapshot is not None:
+        return dict((title, _snapshot.page(title)) for title in titles)
+    pages = [pywikibot.Page(pywikibot.Site(), title) for title in titles]
+    # Preloading fills in the text of the Pages we pass it
+    for page in pagegenerators.PreloadingGenerator(pages):
+        pass
+    return dict(zip(titles, pages))
+
+def category_articles(category, recurse=False):
+    """
+    Return the pages in a category, for reading.
+
+    category -- title of the category, with namespace.
+    recurse -- pass True to include pages in subcategories.
+
+    If use_snapshot() was passed a facts.FactTable, the pages come from
+    that. Otherwise they're read from the wiki, in bulk.
+    """
+    articles = getattr(_snapshot, 'articles', None)
+    if articles is not None:
+        return [_snapshot.page(title) for title in articles(category, recurse)]
+    cat = pywikibot.Category(pywikibot.Site(), category)
+    return pagegenerators.PreloadingGenerator(cat.articles(recurse=recurse))
+
+def templates_with_params(page):
+    """
+    Return the templates used on a page, with their parameters.
+
+    page -- Page of interest.
+
+    Return a list of 2-tuples containing the template title (without the
+    namespace) and a TemplateParams.
+    """
+    return [(t.title(withNamespace=False), TemplateParams(p))
+            for (t, p) in page.templatesWithParams()]
+
+def param_names(params):
+    """
+    Return a list of the names of the parameters in params.
+
+    params -- list of template parameters.
+    """
+    if isinstance(params, TemplateParams):
+        return params.keys()
+    return list(params_to_dict(params).keys())
+
 def param_from_params(params, param, verbatim=False):
     """
     Return the value for 'param' in 'params', or None if it isn't present.
@@ -56,6 +310,8 @@ def param_from_params(params, param, verbatim=False):
     param -- parameter to find the value for.
     verbatim -- return empty string or '?' rather than None
     """
+    if isinstance(params, TemplateParams):
+        return params.value(param, verbatim)
     for p in params:
         m = _PARAM_RE.match(p)
         if m is not None and m.group('name') == param:
@@ -74,6 +330,8 @@ def params_to_dict(params):
 
     Return a dict, indexed by parameter name, of parameter values.
     """
+    if isinstance(params, TemplateParams):
+        return params.as_dict()
     result = {}
     for param in params:
         m = _PARAM_RE.match(param)
@@ -109,22 +367,7 @@ def find_specific_section(text, section):
     Return a 2-tuple containing the start and end indices of the seciion,
     or (-1, -1) if the section isn't found.
     """
-    # Does the page have a section header ?
-    header = re.search(r'===*\s*%s\s*=*==' % section, text)
-    if header:
-        list_start = header.end()
-        # List ends at a header or category
-        # Skip the header for the section of interest itself
-        match = re.search(r'==.*==|\[\[Category', text[list_start:])
-        if match:
-            list_end = list_start+match.start()
-        else:
-            list_end = len(text)
-        # Shift list_end back to exactly the end of the list
-        while text[list_end] in u'\n\r':
-            list_end -= 1
-        return (list_start, list_end)
-    return (-1, -1)
+    return wikitext.outline(text).specific_section(section)
 
 def areas_in_order(jobs_page_text):
     """
@@ -144,24 +387,104 @@ def areas_in_order(jobs_page_text):
 
     return areas
 
-def rarities_in_order():
+def _read_rarities():
     """
-    Return a list of rarities in descending in-game order.
+    Return a list of 2-tuples of rarity and colour, from the Rarity page.
     """
-    rarities = []
-    pg = pywikibot.Page(pywikibot.Site(), u'Rarity')
+    retval = []
+    pg = get_page(u'Rarity')
     for m in _RARITY_RE.finditer(pg.get()):
         # Note that we assume that we find them in descending order
-        rarities.append(m.group('rarity'))
-    return rarities
+        retval.append((m.group('rarity'), m.group('colour')))
+    return retval
 
-class Achievements:
+class Rarities:
     """
-    Class to facilitate identifying relevant achievements.
+    Class to hold the rarities from the Rarity page, read once per run.
     """
 
     def __init__(self):
         """Instantiate the class."""
+        # MetadataCache to keep the rarities in between runs, or None
+        self._metadata = None
+        # List, in descending order, of 2-tuples of rarity and colour
+        self._rarities = None
+
+    def persist_in(self, metadata):
+        """
+        Keep the rarities between runs.
+
+        metadata -- MetadataCache to keep them in.
+        """
+        self._metadata = metadata
+        self._rarities = None
+
+    def _load(self):
+        """Return the list of 2-tuples of rarity and colour, reading them if necessary."""
+        if self._rarities is None:
+            if self._metadata is None:
+                self._rarities = _read_rarities()
+            else:
+                self._rarities = self._metadata.get(u'rarity_colours',
+                                                    lambda: page_revids([u'Rarity']),
+                                                    _read_rarities)
+        return self._rarities
+
+    def in_order(self):
+        """Return a list of rarities in descending in-game order."""
+        return [r for (r, c) in self._load()]
+
+    def ascending(self):
+        """Return a list of rarities in ascending in-game order."""
+        return list(reversed(self.in_order()))
+
+    def colour(self, rarity):
+        """
+        Return the colour used for a rarity, or None.
+
+        rarity -- name of the rarity of interest.
+        """
+        return dict(self._load()).get(rarity)
+
+    def categories(self, kind):
+        """
+        Return a list of the per-rarity categories of something, in ascending order.
+
+        kind -- what is categorised by rarity, like u'Items' or u'Lieutenants'.
+        """
+        return [u'%s %s' % (r, kind) for r in self.ascending()]
+
+    def invalidate(self, title):
+        """
+        Discard the rarities if the specified page may have changed them.
+
+        title -- title of the page that may have changed.
+        """
+        if title == u'Rarity':
+            self._rarities = None
+
+# Rarities shared by all the scripts
+rarities = Rarities()
+
+def rarities_in_order():
+    """
+    Return a list of rarities in descending in-game order.
+    """
+    return rarities.in_order()
+
+class Achievements:
+    """
+    Class to facilitate identifying relevant achievements.
+    """
+
+    def __init__(self, dependencies=None):
+        """
+        Instantiate the class.
+
+        dependencies -- DependencyGraph to record the pages the
+                        returned data comes from in, or None.
+        """
+        self._dependencies = dependencies
         self._parsed_page = False
         self._daily_rewards = []
         self._achievements = []
@@ -169,7 +492,7 @@ class Achievements:
     def _any_to_items(self, item_name):
         """Return a list of items included in an 'Any' item"""
         retval = []
-        pg = pywikibot.Page(pywikibot.Site(), item_name)
+        pg = get_page(item_name)
         if u'Aggregations' not in [c.title(withNamespace=False) for c in pg.categories()]:
             pywikibot.output("%s not in category Aggregations" % item_name)
             return [item_name]
@@ -181,9 +504,11 @@ class Achievements:
 
     def _parse_page(self):
         """Parse the Achievements page."""
+        if self._dependencies is not None:
+            self._dependencies.add(u'Achievements')
         if self._parsed_page:
             return
-        pg = pywikibot.Page(pywikibot.Site(), u'Achievements')
+        pg = get_page(u'Achievements')
         # Parse out the possible daily rewards
         text = pg.get(get_redirect=True)
         (start, end) = find_specific_section(text, u'Daily Rewards')
@@ -196,13 +521,12 @@ class Achievements:
         # Insignia Parts aren't listed with most Daily Rewards
         self._daily_rewards.append(u'Insignia Parts')
         # Parse out individual achievements
-        for template, params in pg.templatesWithParams():
-            if template.title(withNamespace=False) == u'Achievement Row':
-                pd = params_to_dict(params)
+        for template, params in templates_with_params(pg):
+            if template == u'Achievement Row':
                 # Ignore daily achievements
-                if pd[u'group'] != u'Daily':
-                    self._achievements.append((pd[u'description'],
-                                               pd[u'group']))
+                if params[u'group'] != u'Daily':
+                    self._achievements.append((params[u'description'],
+                                               params[u'group']))
         self._parsed_page = True
 
     def is_daily_reward(self, item_name):
@@ -233,6 +557,143 @@ class Achievements:
                 retval.append(a)
         return retval
 
+    def invalidate(self, title):
+        """
+        Discard the cached data if it came from the specified page.
+
+        title -- title of the page that may have changed.
+        """
+        if title == u'Achievements' or title in self._daily_rewards:
+            self._parsed_page = False
+            self._daily_rewards = []
+            self._achievements = []
+
+
+class EventRewards:
+    """
+    Cache class for the rewards listed on the pages in the Events category.
+    """
+
+    def __init__(self, dependencies=None):
+        """
+        Instantiate the class.
+
+        dependencies -- DependencyGraph to record the pages the
+                        returned data comes from in, or None.
+        """
+        self._dependencies = dependencies
+        # pageindex.PageIndex to answer questions from, if any
+        self._index = None
+        # Note that we defer actually reading the wiki until we know
+        # that we need to.
+        self._initialised = False
+
+    def use_index(self, index):
+        """
+        Answer is_event() and listed_in_bullet() from an index.
+
+        index -- pageindex.PageIndex of a snapshot that includes the
+                 event pages.
+
+        Avoids reading the event pages for those questions, at the cost
+        of only seeing the event pages as they were in the snapshot.
+        """
+        self._index = index
+        self._events = index.pages_in_category(u'Events')
+
+    def _read_pages(self):
+        """Read and parse all the event pages."""
+        # Keyed by Lt name, dict of event name -> whether it was a top prize
+        self._lt_rewards = {}
+        # Keyed by event name, list of strings
+        self._top_prizes = {}
+        self._bullets = {}
+        for page in category_articles(u'Category:Events'):
+            event = page.title()
+            try:
+                text = page.get()
+            except (pywikibot.NoPage, pywikibot.IsRedirectPage):
+                continue
+            self._top_prizes[event] = [m.group('rewards') for m in _EVENT_TOP_RE.finditer(text)]
+            self._bullets[event] = [m.group('entry') for m in _EVENT_BULLET_RE.finditer(text)]
+            for m in _EVENT_LT_RE.finditer(text):
+                lt = m.group('lt').strip()
+                # Was it the main prize ?
+                top = any(lt in r for r in self._top_prizes[event])
+                self._lt_rewards.setdefault(lt, {})[event] = top
+
+    def _init_if_needed(self):
+        """Initialise instance attributes if necessary."""
+        if not self._initialised:
+            self._read_pages()
+            self._initialised = True
+
+    def is_event(self, page_name):
+        """
+        Return whether the specified page is in the Events category.
+
+        page_name -- the page of interest.
+        """
+        if self._index is not None:
+            return page_name in self._events
+        self._init_if_needed()
+        return page_name in self._bullets
+
+    def lt_rewards_for(self, lt_name):
+        """
+        Return the events where the specified Lt was a reward.
+
+        lt_name -- title of the Lt page.
+
+        Return a dict, keyed by event page title, of whether the Lt was
+        one of the top prizes for that event.
+        """
+        self._init_if_needed()
+        rewards = self._lt_rewards.get(lt_name, {})
+        if self._dependencies is not None:
+            for event in rewards:
+                self._dependencies.add(event)
+        return rewards
+
+    def listed_in_bullet(self, name, event):
+        """
+        Return whether the specified event page lists name in a list item.
+
+        name -- name of the item or Lt of interest.
+        event -- title of the event page.
+
+        All rewards are in lists, although the converse may not be true.
+        With or without an index, a list item has to link to name or
+        include its words, as in pageindex.mentions().
+        """
+        if self._dependencies is not None:
+            self._dependencies.add(event)
+        if self._index is not None:
+            return self._index.listed_in_bullet(name, event)
+        self._init_if_needed()
+        for entry in self._bullets.get(event, []):
+            if pageindex.mentions(entry, name):
+                return True
+        return False
+
+    def invalidate(self, title):
+        """
+        Discard the cached data if it may depend on the specified page.
+
+        title -- title of the page that may have changed.
+        """
+        if not self._initialised:
+            return
+        if title == u'Category:Events' or title in self._bullets:
+            self._initialised = False
+
+
+# Categories of the pages that ImageMap is used for
+IMAGE_CATEGORIES = [u'Category:Items',
+                    u'Category:Lieutenants',
+                    u'Category:Properties',
+                    u'Category:Ingredients',
+                    u'Category:Skins']
 
 # TODO Rename this class
 class ImageMap:
@@ -245,8 +706,14 @@ class ImageMap:
     _IMG_FILE_RE = re.compile(r'\[\[File:(?P<image>.*\.png)\|.*\]\]')
     _RARITY_RE = re.compile(r'\|\W*rarity\W*=\W*(?P<rarity>.*)')
 
-    def __init__(self):
-        """Instantiate the class."""
+    def __init__(self, dependencies=None):
+        """
+        Instantiate the class.
+
+        dependencies -- DependencyGraph to record the pages the
+                        returned data comes from in, or None.
+        """
+        self._dependencies = dependencies
         # Populate image_map
         self.image_mapping = {}
         self.rarity_mapping = {}
@@ -259,8 +726,8 @@ class ImageMap:
         text = page.get()
         lt = None
         # find the image parameter to the Skin template
-        for template, params in page.templatesWithParams():
-            if template.title(withNamespace=False) == u'Skin':
+        for template, params in templates_with_params(page):
+            if template == u'Skin':
                 self.image_mapping[name] = param_from_params(params, u'image')
                 lt = param_from_params(params, u'lt')
         if lt:
@@ -273,17 +740,32 @@ class ImageMap:
         """
         Read the specified page and populate the caches.
         """
-        pg = pywikibot.Page(pywikibot.Site(), name)
-        # Retrieve the text of the specified page
+        target = None
+        if _redirects is not None and name in _redirects:
+            # No need to read the redirect itself
+            target = get_page(_redirects.target(name))
+        self._parse_page(name, get_page(name), target)
+
+    def _parse_page(self, name, pg, target=None):
+        """
+        Populate the caches from the specified page.
+
+        name -- name of the item, property, or ingredient.
+        pg -- Page for name.
+        target -- Page that pg redirects to, if known, or None.
+        """
         m = None
         img_re = self._IMG_RE
-        try:
-            text = pg.get()
-        except pywikibot.NoPage:
-            text = ''
-        except pywikibot.IsRedirectPage:
+        if target is None:
+            try:
+                text = pg.get()
+            except pywikibot.NoPage:
+                text = ''
+            except pywikibot.IsRedirectPage:
+                target = pg.getRedirectTarget()
+        if target is not None:
             # This is probably a skinned Lt
-            pg = pg.getRedirectTarget()
+            pg = target
             if self._read_skin_page(name, pg):
                 return
             # If not, try working from the text of the page we were redirected to
@@ -314,12 +796,54 @@ class ImageMap:
         else:
             self.rarity_mapping[name] = m.group('rarity')
 
+    def warm_up(self, categories=IMAGE_CATEGORIES):
+        """
+        Populate the caches for every page in the specified categories.
+
+        categories -- titles of the categories of interest, with namespace.
+
+        The pages are read in bulk, as are the targets of any redirects
+        among them, so later lookups of those pages don't read the wiki.
+        If use_redirects() was called, the pages that redirect to them
+        (like skinned Lts) are filled in too.
+        """
+        pages = {}
+        for cat in categories:
+            for pg in category_articles(cat, recurse=True):
+                pages.setdefault(pg.title(), pg)
+        redirects = {}
+        if _redirects is not None:
+            for title in pages:
+                if title in _redirects:
+                    redirects[title] = _redirects.target(title)
+            # The redirects themselves never need reading
+            for title, target in _redirects.redirects_to(set(pages)).items():
+                pages.setdefault(title, None)
+                redirects[title] = target
+        else:
+            for title, pg in pages.items():
+                if pg.isRedirectPage():
+                    redirects[title] = pg.getRedirectTarget().title()
+        # Read all the redirect targets we don't already have together
+        targets = get_pages(set(t for t in redirects.values() if t not in pages))
+        for target in set(redirects.values()):
+            if target in pages:
+                targets[target] = pages[target]
+        # Skin pages take the rarity of the Lt, so do them last
+        for title in sorted(pages, key=lambda t: t in redirects):
+            if title not in self.image_mapping:
+                self._parse_page(title,
+                                 pages[title],
+                                 targets.get(redirects.get(title)))
+
     def image_for(self, name):
         """
         Return the image for the specified item, property, or ingredient.
 
         name -- name of the item, property, or ingredient.
         """
+        if self._dependencies is not None:
+            self._dependencies.add(name)
         if name not in self.image_mapping:
             self._read_page(name)
         return self.image_mapping[name]
@@ -330,18 +854,35 @@ class ImageMap:
 
         name -- name of the item, property, or ingredient.
         """
+        if self._dependencies is not None:
+            self._dependencies.add(name)
         if name not in self.rarity_mapping:
             self._read_page(name)
         return self.rarity_mapping[name]
 
+    def invalidate(self, title):
+        """
+        Discard the cached data for the specified page.
+
+        title -- title of the page that may have changed.
+        """
+        self.image_mapping.pop(title, None)
+        self.rarity_mapping.pop(title, None)
+
 
 class CategoryRefs:
     """
     Cache class for pages that reference category pages.
     """
 
-    def __init__(self):
-        """Instantiate the class."""
+    def __init__(self, dependencies=None):
+        """
+        Instantiate the class.
+
+        dependencies -- DependencyGraph to record the pages the
+                        returned data comes from in, or None.
+        """
+        self._dependencies = dependencies
         self.mapping = {}
 
     def refs_for(self, category):
@@ -351,47 +892,156 @@ class CategoryRefs:
         category -- name of the category of interest.
         """
         try:
-            return self.mapping[category]
+            refs = self.mapping[category]
         except KeyError:
-            pass
-        page = pywikibot.Page(pywikibot.Site(), u'Category:%s' % category)
-        refs = list(page.getReferences())
-        self.mapping[category] = refs
+            page = get_page(u'Category:%s' % category)
+            refs = list(page.getReferences())
+            self.mapping[category] = refs
+        if self._dependencies is not None:
+            self._dependencies.add(u'Category:%s' % category)
+            for r in refs:
+                self._dependencies.add(r.title())
         return refs
 
+    def invalidate(self, title):
+        """
+        Discard any cached refs that may have been changed by the specified page.
+
+        title -- title of the page that may have changed.
+        """
+        for category, refs in list(self.mapping.items()):
+            if (title == u'Category:%s' % category or
+                    title in [r.title() for r in refs]):
+                del self.mapping[category]
+
+
+class HubPageCache:
+    """
+    Cache class for data parsed from pages that many other pages refer to.
+
+    Each page is fetched and parsed at most once, and the result is kept
+    along with the revision it was parsed from.
+    """
+
+    def __init__(self, dependencies=None):
+        """
+        Instantiate the class.
+
+        dependencies -- DependencyGraph to record the pages the
+                        returned data comes from in, or None.
+        """
+        self._dependencies = dependencies
+        # Keyed by page title, 2-tuple of (revid, parsed data)
+        self._entries = {}
+
+    def data_for(self, title, parser):
+        """
+        Return the parsed content of the specified page.
+
+        title -- title of the page of interest.
+        parser -- function that takes a Page and returns the parsed data.
+        """
+        if self._dependencies is not None:
+            self._dependencies.add(title)
+        try:
+            return self._entries[title][1]
+        except KeyError:
+            pass
+        self.prefetch([title], parser)
+        return self._entries[title][1]
+
+    def prefetch(self, titles, parser):
+        """
+        Fetch and parse any of the specified pages that aren't cached, together.
+
+        titles -- titles of the pages of interest.
+        parser -- function that takes a Page and returns the parsed data.
+        """
+        titles = [t for t in set(titles) if t not in self._entries]
+        if not titles:
+            return
+        for title, page in get_pages(titles).items():
+            data = parser(page)
+            try:
+                revid = page.latestRevision()
+            except pywikibot.NoPage:
+                revid = None
+            self._entries[title] = (revid, data)
+
+    def invalidate(self, title, revid=None):
+        """
+        Discard the cached data for the specified page.
+
+        title -- title of the page that may have changed.
+        revid -- latest revision of the page, if known.
+                 The cache is only discarded if it was parsed from
+                 a different revision.
+        """
+        try:
+            old_revid = self._entries[title][0]
+        except KeyError:
+            return
+        if revid is None or revid != old_revid:
+            del self._entries[title]
+
 
 class RecipeCache:
     """
     Cache class for Tech Lab recipes.
     """
 
-    def __init__(self):
-        """Instantiate the class."""
+    # Pages that list recipes
+    _PAGE_NAMES = [u'Tech Lab', u'Tech Lab - Historic']
+
+    def __init__(self, dependencies=None):
+        """
+        Instantiate the class.
+
+        dependencies -- DependencyGraph to record the pages the
+                        returned data comes from in, or None.
+        """
+        self._dependencies = dependencies
         # Note that we defer actually reading the wiki until we know
         # that we need to.
         self._initialised = False
 
     def _read_pages(self):
         """Read and parse all Tech Lab pages."""
-        page_names = [u'Tech Lab', u'Tech Lab - Historic']
+        # Keyed by title key of item name, Recipe template parameters
         self._recipes = {}
-        for p in page_names:
-            page = pywikibot.Page(pywikibot.Site(), p)
-            for template, params in page.templatesWithParams():
-                if template.title(withNamespace=False).startswith(u'Recipe'):
+        # Keyed by title key of item name, item name as in the Recipe template
+        self._names = {}
+        for p in self._PAGE_NAMES:
+            page = get_page(p)
+            for template, params in templates_with_params(page):
+                if template.startswith(u'Recipe'):
                     item = param_from_params(params, u'name')
-                    self._recipes[item] = params
+                    key = wikitext.title_key(item)
+                    self._recipes[key] = params
+                    self._names[key] = item
 
     def _init_if_needed(self):
         """Initialise instance attributes if necessary."""
+        if self._dependencies is not None:
+            for p in self._PAGE_NAMES:
+                self._dependencies.add(p)
         if not self._initialised:
             self._read_pages()
             self._initialised = True
 
     def recipes(self):
-        """Return a list of items that have recipes."""
+        """Return a list of the names of the items that have recipes."""
         self._init_if_needed()
-        return list(self._recipes.keys())
+        return list(self._names.values())
+
+    def has_recipe(self, item):
+        """
+        Return whether the specified item has a recipe.
+
+        item -- item of interest.
+        """
+        self._init_if_needed()
+        return wikitext.title_key(item) in self._recipes
 
     def recipe_for(self, item):
         """
@@ -401,4 +1051,432 @@ class RecipeCache:
         item -- item of interest.
         """
         self._init_if_needed()
-        return self._recipes[item]
+        return self._recipes[wikitext.title_key(item)]
+
+    def invalidate(self, title):
+        """
+        Discard the cached recipes if they came from the specified page.
+
+        title -- title of the page that may have changed.
+        """
+        if title in self._PAGE_NAMES:
+            self._initialised = False
+
+
+class RunJournal:
+    """
+    Record of the pages processed by a run, written as the run goes.
+
+    Each line of the journal file is a JSON object with the title and
+    revid of one page and the outcome of processing it, so that a run
+    that is interrupted can be resumed without repeating work.
+    """
+
+    # Outcomes that mean the page doesn't need to be processed again
+    FINISHED = frozenset([u'saved', u'unchanged', u'no page', u'redirect'])
+
+    def __init__(self, filename, resume=False):
+        """
+        Instantiate the class.
+
+        filename -- name of the journal file.
+        resume -- pass True to keep the entries from an earlier run,
+                  rather than starting a new journal.
+        """
+        self.filename = filename
+        # Keyed by page title, revid when the page was processed
+        self._done = {}
+        complete = True
+        if resume:
+            complete = self._read()
+            mode = 'a'
+        else:
+            mode = 'w'
+        self._file = io.open(filename, mode, encoding='utf-8')
+        if not complete:
+            # Don't append to a partly-written entry
+            self._file.write(u'\n')
+
+    def _read(self):
+        """
+        Read the entries from an existing journal file.
+
+        Return False if the last line of the file is incomplete.
+        """
+        try:
+            f = io.open(self.filename, 'r', encoding='utf-8')
+        except IOError:
+            # Nothing to resume
+            return True
+        line = u'\n'
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line may be incomplete if the run was killed
+                    continue
+                self._note(entry[u'title'], entry[u'revid'], entry.get(u'outcome'))
+        return line.endswith(u'\n')
+
+    def _note(self, title, revid, outcome):
+        """Remember whether the page has been finished with at revid."""
+        if outcome is None or outcome in self.FINISHED:
+            self._done[title] = revid
+        else:
+            # Declined, locked or failed, so offer it again
+            self._done.pop(title, None)
+
+    def is_done(self, title, revid):
+        """
+        Return whether the page has been finished with at the specified revision.
+
+        Pages that were declined, locked or failed to save are not finished.
+
+        title -- title of the page.
+        revid -- current revision of the page.
+        """
+        try:
+            return self._done[title] == revid
+        except KeyError:
+            return False
+
+    def record(self, title, revid, outcome):
+        """
+        Add an entry to the journal.
+
+        title -- title of the page.
+        revid -- revision of the page after processing it.
+        outcome -- short description of what was done to the page.
+        """
+        self._note(title, revid, outcome)
+        entry = {u'title': title, u'revid': revid, u'outcome': outcome}
+        self._file.write(u'%s\n' % json.dumps(entry))
+        # Make sure the entry survives the run being killed
+        self._file.flush()
+
+    def close(self):
+        """Close the journal file."""
+        self._file.close()
+
+
+class DependencyGraph:
+    """
+    Record of the pages that the processing of each page depended on.
+
+    Pages are recorded by title. A category is recorded as u'Category:<name>'
+    when the result depends on which pages are in it or link to it.
+    A reverse index is kept, so that the pages affected by a change to any
+    page can be found quickly.
+    """
+
+    def __init__(self):
+        """Instantiate the class."""
+        # Time of the run the graph was saved by, as an ISO format string
+        self.timestamp = None
+        # Keyed by page title, set of titles of the pages it depends on
+        self._depends = {}
+        # Keyed by page title, set of titles of the pages that depend on it
+        self._dependents = {}
+        self._current = None
+
+    def load(self, filename):
+        """
+        Add the graph saved in a file, if it exists.
+
+        filename -- name of the file.
+        """
+        try:
+            f = io.open(filename, 'r', encoding='utf-8')
+        except IOError:
+            return
+        with f:
+            data = json.load(f)
+        self.timestamp = data[u'timestamp']
+        for title, deps in data[u'depends'].items():
+            self._depends[title] = set(deps)
+            for dep in deps:
+                self._dependents.setdefault(dep, set()).add(title)
+
+    def save(self, filename, timestamp):
+        """
+        Write the graph to a file.
+
+        filename -- name of the file.
+        timestamp -- time the run started, as an ISO format string.
+                     Pages changed after that will need processing again.
+        """
+        self.timestamp = timestamp
+        data = {u'timestamp': timestamp,
+                u'depends': dict((t, sorted(d)) for t, d in self._depends.items())}
+        with io.open(filename, 'w', encoding='utf-8') as f:
+            f.write(u'%s' % json.dumps(data, indent=0, sort_keys=True))
+
+    def start(self, title):
+        """
+        Start recording the dependencies of a page.
+
+        title -- title of the page about to be processed.
+
+        Any dependencies recorded for the page previously are discarded.
+        """
+        for dep in self._depends.pop(title, set()):
+            self._dependents[dep].discard(title)
+        self._depends[title] = set()
+        self._current = title
+
+    def finish(self):
+        """Stop recording the dependencies of the current page."""
+        self._current = None
+
+    def add(self, title):
+        """
+        Record that the current page depends on another page.
+
+        title -- title of the page depended on.
+
+        Does nothing if no page is being processed.
+        """
+        if self._current is None or title == self._current:
+            return
+        self._depends[self._current].add(title)
+        self._dependents.setdefault(title, set()).add(self._current)
+
+    def is_known(self, title):
+        """Return whether the dependencies of the page have been recorded."""
+        return title in self._depends
+
+    def dependents_of(self, title):
+        """
+        Return the set of titles of pages that depend on the specified page.
+
+        title -- title of the page of interest.
+        """
+        return set(self._dependents.get(title, set()))
+
+
+class RecentChanges:
+    """
+    Class to find the pages that have been changed since a given time.
+    """
+
+    def __init__(self, site, since):
+        """
+        Instantiate the class.
+
+        site -- Site to look for changes on.
+        since -- ISO format timestamp to look for changes after.
+        """
+        self.site = site
+        self.since = since
+        # rcids of the changes already returned at the since timestamp
+        self._seen = set()
+
+    def changes(self):
+        """
+        Return the changes since the last call.
+
+        Return a list of recent change dicts, oldest first.
+        The first call returns the changes since the time the
+        class was instantiated with.
+        """
+        retval = []
+        for change in self.site.recentchanges(start=self.since, reverse=True):
+            if change[u'rcid'] in self._seen:
+                continue
+            retval.append(change)
+            if change[u'timestamp'] != self.since:
+                self.since = change[u'timestamp']
+                self._seen = set()
+            self._seen.add(change[u'rcid'])
+        return retval
+
+    def changed_titles(self):
+        """
+        Return the titles of the pages changed since the last call.
+
+        Each title appears once, in the order of its first change.
+        """
+        titles = []
+        found = set()
+        for change in self.changes():
+            title = change.get(u'title')
+            if title is not None and title not in found:
+                found.add(title)
+                titles.append(title)
+        return titles
+
+
+class MetadataCache:
+    """
+    Cache of slowly-changing data about the structure of the wiki.
+
+    Entries are kept in a file between runs. Each one is stored with a
+    fingerprint of the pages it was derived from (like their revids),
+    and is derived again if the fingerprint changes or it gets too old.
+
+    Scripts should share the one instance, metadata, below. Runs of
+    different scripts at the same time can share the file, because each
+    save only writes the entries that run changed into what's in the
+    file, and the file is replaced in one step.
+    """
+
+    def __init__(self, filename, max_age=24*60*60):
+        """
+        Instantiate the class.
+
+        filename -- name of the file to keep the entries in.
+        max_age -- seconds after which an entry is always derived again.
+                   This catches changes that the fingerprint misses.
+        """
+        self.filename = filename
+        self.max_age = max_age
+        # Keyed by entry name, dict with time, fingerprint, and value
+        self._entries = {}
+        # Entries already checked during this run
+        self._checked = set()
+        # Entries changed or discarded during this run, and not yet saved
+        self._changed = set()
+        self._entries = self._read()
+
+    def _read(self):
+        """Return the entries in the file, or an empty dict."""
+        try:
+            f = io.open(self.filename, 'r', encoding='utf-8')
+        except IOError:
+            return {}
+        with f:
+            try:
+                return json.load(f)
+            except ValueError:
+                # Corrupt file - just start again
+                return {}
+
+    def _save(self):
+        """
+        Write the entries changed by this run to the file.
+
+        Entries written by other runs since the file was read are kept.
+        """
+        entries = self._read()
+        for key in self._changed:
+            if key in self._entries:
+                entries[key] = self._entries[key]
+            else:
+                entries.pop(key, None)
+        # Pick up other runs' entries too, but not as checked
+        for key, entry in entries.items():
+            if key not in self._checked:
+                self._entries[key] = entry
+        tmp = u'%s.%d.tmp' % (self.filename, os.getpid())
+        with io.open(tmp, 'w', encoding='utf-8') as f:
+            f.write(u'%s' % json.dumps(entries, indent=0, sort_keys=True))
+        # So that a crash while writing can't leave a truncated file
+        os.replace(tmp, self.filename)
+        self._changed = set()
+
+    def value(self, key, default=None):
+        """
+        Return the stored value of an entry, without checking it.
+
+        key -- name of the entry.
+        default -- value to return if there's no such entry.
+        """
+        try:
+            return self._entries[key][u'value']
+        except KeyError:
+            return default
+
+    def get(self, key, fingerprint, derive):
+        """
+        Return the value of an entry, deriving it again if necessary.
+
+        key -- name of the entry.
+        fingerprint -- function that returns a dict, keyed by page title,
+                       (that can be stored as JSON) that changes when
+                       the entry may have changed.
+        derive -- function that returns the value of the entry. The value
+                  must be something that can be stored as JSON, so sets
+                  should be returned as lists.
+
+        Each entry is only checked once per run.
+        """
+        if key in self._checked:
+            return self._entries[key][u'value']
+        fp = fingerprint()
+        try:
+            entry = self._entries[key]
+            if (entry[u'fingerprint'] == fp and
+                    time.time() - entry[u'time'] < self.max_age):
+                self._checked.add(key)
+                return entry[u'value']
+        except KeyError:
+            pass
+        value = derive()
+        self._entries[key] = {u'time': time.time(),
+                              u'fingerprint': fp,
+                              u'value': value}
+        self._changed.add(key)
+        # Only now is the entry known to be good for the rest of the run
+        self._checked.add(key)
+        self._save()
+        return value
+
+    def invalidate(self, title):
+        """
+        Discard any entries derived from the specified page.
+
+        title -- title of the page that may have changed.
+        """
+        for key, entry in list(self._entries.items()):
+            if title in entry[u'fingerprint']:
+                del self._entries[key]
+                self._checked.discard(key)
+                # Not saved now - the next entry stored will save it
+                self._changed.add(key)
+
+# File to keep structural data about the wiki in between runs
+METADATA_FILE = u'metadata_cache.json'
+
+# Structural data kept between runs, shared by all the scripts
+metadata = MetadataCache(METADATA_FILE)
+
+
+def page_revids(titles):
+    """
+    Return a fingerprint for MetadataCache from the latest revisions of some pages.
+
+    titles -- titles of the pages of interest.
+
+    Return a dict, keyed by title, of revid (or None for a missing page).
+    """
+    retval = {}
+    for title in titles:
+        try:
+            retval[title] = pywikibot.Page(pywikibot.Site(), title).latestRevision()
+        except pywikibot.NoPage:
+            retval[title] = None
+    return retval
+
+def category_sizes(titles):
+    """
+    Return a fingerprint for MetadataCache from the sizes of some categories.
+
+    titles -- titles of the categories of interest, including the namespace.
+
+    Return a dict, keyed by title, of the numbers of pages, subcategories,
+    and files in each category.
+
+    The categories are looked up 50 at a time.
+    """
+    titles = list(titles)
+    retval = dict((title, [None, None, None]) for title in titles)
+    for i in range(0, len(titles), 50):
+        data = api.Request(site=pywikibot.Site(),
+                           action=u'query',
+                           prop=u'categoryinfo',
+                           titles=u'|'.join(titles[i:i + 50])).submit()
+        for page in data.get(u'query', {}).get(u'pages', {}).values():
+            info = page.get(u'categoryinfo', {})
+            retval[page[u'title']] = [info.get(u'pages'), info.get(u'subcats'), info.get(u'files')]
+    return retval
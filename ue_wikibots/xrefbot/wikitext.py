@@ -0,0 +1,759 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Functions and classes to find the structure of wiki page text.
+
+Nothing here talks to the wiki itself.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import re
+from bisect import bisect_right
+from collections import namedtuple
+
+# Markup tokens. Each alternative is a fixed string, so this can't
+# backtrack, and pairs are taken from the left (so '{{{' is '{{' and '{')
+_TOKEN_RE = re.compile(r'\{\{|\}\}|\[\[|\]\]|[]|#\n]')
+# Namespaces where [[...]] without a leading colon isn't a link
+_NON_LINK_NAMESPACES = (u'Category:', u'File:', u'Image:')
+# Tokens that end the target of a link
+_TARGET_ENDS = (u']', u']]', u'|', u'\n')
+
+# Number of page texts to keep outlines for
+_MAX_OUTLINES = 8
+
+Header = namedtuple('Header', ['level', 'title', 'start', 'end'])
+
+class Link(namedtuple('Link', ['title', 'colon', 'target', 'start', 'end'])):
+    """
+    One use of [[...]] in page text - a link, category, or embedded file.
+
+    title -- canonical title of the page, as from page_title(),
+             or u'' if there isn't a valid one.
+    colon -- whether the target has a leading colon.
+    target -- the target as written (stripped), including any leading
+              colon and any section.
+    start, end -- text[start:end] is the whole link, brackets included.
+                  If the link isn't closed, it ends with the target.
+    """
+
+    __slots__ = ()
+
+    def is_category(self):
+        """Return whether this puts the page in a category."""
+        return not self.colon and self.title.startswith(u'Category:')
+
+    def is_link(self):
+        """Return whether this is a link, rather than a category or file."""
+        return bool(self.title) and (self.colon or not self.title.startswith(_NON_LINK_NAMESPACES))
+
+class TemplateUse(namedtuple('TemplateUse', ['name', 'start', 'end', 'param_spans'])):
+    """
+    One use of a template in page text.
+
+    name -- template name, without namespace and with the first letter
+            capitalised.
+    start, end -- text[start:end] is the whole template, braces included.
+    param_spans -- list of 2-tuples of the start and end indices of the
+                   text of each parameter (excluding the leading '|').
+    """
+
+    __slots__ = ()
+
+    def params(self, text):
+        """
+        Return the list of parameter strings for this template.
+
+        text -- the page text the template was found in.
+        """
+        return [text[s:e] for (s, e) in self.param_spans]
+
+def template_name(name):
+    """
+    Return the canonical form of a template name, as written in page text.
+
+    name -- text between the '{{' and the first '|' or '}}'.
+    """
+    name = name.strip().replace(u'_', u' ')
+    if name.startswith(u'Template:'):
+        name = name[len(u'Template:'):].lstrip()
+    return name[:1].upper() + name[1:]
+
+def page_title(title):
+    """
+    Return the canonical form of a page title, as written in a link.
+
+    title -- text between the '[[' and any '|', '#', or ']]'.
+    """
+    title = title.strip().replace(u'_', u' ')
+    return title[:1].upper() + title[1:]
+
+def title_key(text):
+    """
+    Return the key for the page that a name, link, or parameter value refers to.
+
+    text -- page title, link, or template parameter value, or None.
+
+    Keys ignore the case of the first character, don't distinguish
+    underscores from spaces, and ignore surrounding link brackets, so
+    two strings refer to the same page if their keys are equal.
+    """
+    if text is None:
+        return None
+    key = text.strip()
+    if key.startswith(u'[['):
+        key = key[2:-2]
+    return page_title(key)
+
+def link_uses(text):
+    """
+    Return the list of Links in text, including category tags and
+    embedded images.
+
+    text -- page text, or any part of it.
+
+    Unlike outline(), this doesn't cache the result, so it's the one to
+    use for short pieces of text that won't be looked at again.
+    """
+    o = _outlines.get(text)
+    if o is not None:
+        return o.links
+    return _scan(text)[1]
+
+def links(text):
+    """
+    Return the list of titles of the pages that text links to.
+
+    Category tags and embedded images are not links.
+    """
+    return [l.title for l in link_uses(text) if l.is_link()]
+
+def _header(text, start, end):
+    """
+    Return the Header on the line text[start:end], or None.
+
+    Like MediaWiki, headers must start at the start of a line.
+    Level 1 headers aren't found, but they're rare...
+    """
+    if not text.startswith(u'==', start, end):
+        return None
+    line = text[start:end].rstrip()
+    lead = len(line) - len(line.lstrip(u'='))
+    title_end = line.find(u'=', lead)
+    if title_end <= lead:
+        return None
+    trail = len(line[title_end:]) - len(line[title_end:].lstrip(u'='))
+    level = min(lead, trail)
+    if level < 2:
+        return None
+    return Header(level,
+                  line[lead:title_end].strip(),
+                  start + lead - level,
+                  start + title_end + level)
+
+def _link(text, pending, end):
+    """
+    Return a link, as a list of the fields of a Link.
+
+    text -- page text.
+    pending -- list of link start, target start, whether there's a
+               leading colon, and the end of the title (or None).
+    end -- end of the target.
+    """
+    start, target_start, colon, title_end = pending
+    if title_end is None:
+        title_end = end
+    target = text[target_start:end].strip()
+    if colon:
+        target = u':' + target
+    return [page_title(text[target_start:title_end]), colon, target, start, end]
+
+def _scan(text):
+    """
+    Find the structure of some page text in a single pass.
+
+    text -- page text to scan.
+
+    Each token ('{{', '}}', '[[', ']]', '|', '#', ']', or newline) is
+    looked at once, so this takes time proportional to the length of
+    the text, however the text is written.
+
+    Return a 4-tuple of the list of Headers, the list of Links, the list
+    of TemplateUses, and the list of the indices where each line starts.
+    Links and TemplateUses include nested ones, and each list is in order
+    of start index.
+    """
+    headers = []
+    line_starts = [0]
+    # Each entry is [title, colon, target, start, end], once the target is known
+    links = []
+    # Link waiting for the end of its target, as
+    # [start, target start, colon, title end], or None
+    pending = None
+    # Indices into links (or None for an invalid link) of unclosed links
+    open_links = []
+    templates = []
+    # Each entry is a list of [start, pipes, link depth]
+    stack = []
+    for m in _TOKEN_RE.finditer(text):
+        token = m.group()
+        pos = m.start()
+        if pending is not None:
+            if token == u'#' and pending[3] is None:
+                pending[3] = pos
+            elif token in _TARGET_ENDS:
+                open_links[-1] = len(links)
+                links.append(_link(text, pending, pos))
+                pending = None
+            elif token == u'[[':
+                # Titles can't include '[', so the outer one isn't a link
+                pending = None
+        if token == u'\n':
+            if text.startswith(u'==', line_starts[-1], pos):
+                h = _header(text, line_starts[-1], pos)
+                if h:
+                    headers.append(h)
+            line_starts.append(pos + 1)
+        elif token == u'[[':
+            # Skip any whitespace and leading colon
+            i = pos + 2
+            while i < len(text) and text[i] in u' \t':
+                i += 1
+            colon = text.startswith(u':', i)
+            if colon:
+                i += 1
+                while i < len(text) and text[i] in u' \t':
+                    i += 1
+            pending = [pos, i, colon, None]
+            open_links.append(None)
+            if stack:
+                stack[-1][2] += 1
+        elif token == u']]':
+            if open_links:
+                i = open_links.pop()
+                if i is not None:
+                    links[i][4] = pos + 2
+            if stack and stack[-1][2] > 0:
+                stack[-1][2] -= 1
+        elif token == u'{{':
+            stack.append([pos, [], 0])
+        elif token == u'|':
+            # Pipes within links don't separate template parameters
+            if stack and stack[-1][2] == 0:
+                stack[-1][1].append(pos)
+        elif token == u'}}' and stack:
+            # End of the innermost template
+            start, pipes, depth = stack.pop()
+            if pipes:
+                name_end = pipes[0]
+            else:
+                name_end = pos
+            bounds = pipes + [pos]
+            spans = [(bounds[i] + 1, bounds[i + 1]) for i in range(len(pipes))]
+            templates.append(TemplateUse(template_name(text[start + 2:name_end]),
+                                         start,
+                                         pos + 2,
+                                         spans))
+    if pending is not None:
+        links.append(_link(text, pending, len(text)))
+    h = _header(text, line_starts[-1], len(text))
+    if h:
+        headers.append(h)
+    templates.sort(key=lambda t: t.start)
+    return (headers, [Link(*l) for l in links], templates, line_starts)
+
+class SectionOutline:
+    """
+    The headers, categories, and template uses in some page text.
+
+    Everything is found in one pass when the class is instantiated,
+    so that finding sections and templates later is just a lookup.
+    """
+
+    def __init__(self, text):
+        """
+        Instantiate the class.
+
+        text -- page text to outline.
+        """
+        self.text = text
+        (self.headers, self.links, self.templates, self.line_starts) = _scan(text)
+        self.category_starts = [l.start for l in self.links if l.is_category()]
+
+    def _next_category(self, start, end=None):
+        """
+        Return the start of the first category at or after start, or -1.
+
+        start -- index to search from.
+        end -- index to stop searching at, or None for the end of the text.
+        """
+        for c in self.category_starts:
+            if c >= start and (end is None or c < end):
+                return c
+        return -1
+
+    def specific_section(self, section):
+        """
+        Find the specified section.
+
+        section -- name of the section to locate.
+
+        The section ends at the next header or category.
+
+        Return a 2-tuple containing the start and end indices of the seciion,
+        or (-1, -1) if the section isn't found.
+        """
+        for i, hdr in enumerate(self.headers):
+            if hdr.title == section:
+                list_start = hdr.end
+                # List ends at a header or category
+                # Skip the header for the section of interest itself
+                list_end = len(self.text)
+                if i + 1 < len(self.headers):
+                    list_end = self.headers[i + 1].start
+                c = self._next_category(list_start, list_end)
+                if c != -1:
+                    list_end = c
+                # Shift list_end back to exactly the end of the list
+                while list_end < len(self.text) and self.text[list_end] in u'\n\r':
+                    list_end -= 1
+                return (list_start, list_end)
+        return (-1, -1)
+
+    def section(self, title):
+        """
+        Find a specific section.
+
+        title -- name of the section to look for.
+
+        Return a 2-tuple containing the start and end indices.
+
+        End point is a header at the same level, or a category.
+        """
+        start = -1
+        end = -1
+        level = -1
+        for hdr in self.headers:
+            if (level == -1) or (hdr.level == level):
+                if start == -1:
+                    if hdr.title == title:
+                        # This is our start point
+                        start = hdr.end + 1
+                        # The end will be the start of the next section at this level
+                        level = hdr.level
+                else:
+                    # This is our end point
+                    end = hdr.start - 1
+                    break
+        if end == -1 and start != -1:
+            # Exclude any categories
+            c = self._next_category(start, len(self.text) - 1)
+            if c != -1:
+                end = c - 1
+        return (start, end)
+
+    def line_bounds(self, index):
+        """
+        Return a 2-tuple of the start and end indices of a line.
+
+        index -- index of any character in the line.
+
+        The end index is that of the newline, or the end of the text.
+        """
+        i = bisect_right(self.line_starts, index) - 1
+        if i + 1 < len(self.line_starts):
+            return (self.line_starts[i], self.line_starts[i + 1] - 1)
+        return (self.line_starts[i], len(self.text))
+
+    def first_links(self, start=0, end=None, outside_templates=False):
+        """
+        Return a list of the first Link on each line, in order.
+
+        start, end -- only include links that start within text[start:end].
+                      An end of None or less than zero (as section()
+                      returns for a section at the end of the page)
+                      means the end of the text.
+        outside_templates -- pass True to ignore links within templates.
+
+        Category tags and embedded images are included.
+        """
+        if end is None or end < 0:
+            end = len(self.text)
+        spans = []
+        if outside_templates:
+            spans = [(t.start, t.end) for t in self.outermost_templates()]
+        # Both links and spans are in order, so we just move through the spans
+        i = 0
+        retval = []
+        line = -1
+        for l in self.links:
+            if l.start < start or l.start >= end:
+                continue
+            while i < len(spans) and spans[i][1] <= l.start:
+                i += 1
+            if i < len(spans) and spans[i][0] <= l.start:
+                continue
+            line_start = self.line_bounds(l.start)[0]
+            if line_start != line:
+                line = line_start
+                retval.append(l)
+        return retval
+
+    def outermost_templates(self):
+        """Return a list of the TemplateUses that aren't within another template."""
+        retval = []
+        end = -1
+        for t in self.templates:
+            if t.start >= end:
+                retval.append(t)
+                end = t.end
+        return retval
+
+    def header_at(self, index):
+        """
+        Return the last Header before the specified index, or None.
+
+        index -- index into the text.
+        """
+        result = None
+        for hdr in self.headers:
+            if hdr.start >= index:
+                break
+            result = hdr
+        return result
+
+    def template_uses(self, name=None):
+        """
+        Return a list of the TemplateUses, in the order they appear.
+
+        name -- only return uses of this template, if specified.
+        """
+        if name is None:
+            return list(self.templates)
+        name = template_name(name)
+        return [t for t in self.templates if t.name == name]
+
+_outlines = {}
+
+def outline(text):
+    """
+    Return the SectionOutline for the specified text.
+
+    text -- page text.
+
+    Outlines of the last few texts are remembered, so asking
+    repeatedly about the same text doesn't parse it repeatedly.
+    """
+    try:
+        return _outlines[text]
+    except KeyError:
+        pass
+    if len(_outlines) >= _MAX_OUTLINES:
+        _outlines.clear()
+    result = _outlines[text] = SectionOutline(text)
+    return result
+
+def replace_templates(text, match, replacement):
+    """
+    Return text with some of its templates replaced.
+
+    text -- page text.
+    match -- function taking a template name and returning whether to
+             replace that template.
+    replacement -- text to put in place of each of those templates.
+
+    Any templates within a replaced template go with it.
+    """
+    parts = []
+    last = 0
+    for use in outline(text).templates:
+        if use.start >= last and match(use.name):
+            parts.append(text[last:use.start])
+            parts.append(replacement)
+            last = use.end
+    parts.append(text[last:])
+    return u''.join(parts)
+
+class _Edit:
+    """
+    One change to be made by a TemplateEditor.
+
+    start, end -- the span of the original text to be replaced.
+    render -- function that returns the replacement text. It is passed a
+              function that takes a start and end index and returns that
+              part of the original text with any nested edits applied.
+    """
+
+    def __init__(self, start, end, render, seq):
+        self.start = start
+        self.end = end
+        self.render = render
+        self.seq = seq
+
+class TemplateEditor:
+    """
+    Class to make a batch of changes to the templates in some page text.
+
+    Each change is recorded against where things were in the original
+    text, so changes don't affect each other's positions, and each one
+    lands in the template it was made to. apply() makes all the changes
+    in one pass through the text.
+    """
+
+    def __init__(self, text):
+        """
+        Instantiate the class.
+
+        text -- page text to edit.
+        """
+        self.text = text
+        self._outline = outline(text)
+        self._edits = []
+
+    def templates(self, name=None):
+        """
+        Return a list of the TemplateUses in the original text.
+
+        name -- only return uses of this template, if specified.
+        """
+        return self._outline.template_uses(name)
+
+    def find_template(self, params, name=None):
+        """
+        Return the use of a template with the specified parameters, or None.
+
+        params -- list of parameters, as from Page.templatesWithParams().
+        name -- name of the template, if known.
+
+        Whitespace around each parameter is ignored.
+        """
+        wanted = [p.strip() for p in params]
+        for use in self.templates(name):
+            if [p.strip() for p in use.params(self.text)] == wanted:
+                return use
+        return None
+
+    def _param_index(self, use, name):
+        """
+        Return the index into use.param_spans of the named parameter, or -1.
+
+        use -- TemplateUse of interest.
+        name -- name of the parameter. If a parameter is repeated,
+                the first one is found.
+        """
+        for i, (s, e) in enumerate(use.param_spans):
+            param = self.text[s:e]
+            eq = param.find(u'=')
+            if eq != -1 and param[:eq].strip() == name:
+                return i
+        return -1
+
+    def has_param(self, use, name):
+        """Return whether the template use has the named parameter."""
+        return self._param_index(use, name) != -1
+
+    def value(self, use, name):
+        """
+        Return the value of a parameter, or None if it isn't present.
+
+        use -- TemplateUse of interest.
+        name -- name of the parameter.
+
+        Whitespace around the value is stripped.
+        """
+        i = self._param_index(use, name)
+        if i == -1:
+            return None
+        s, e = use.param_spans[i]
+        return self.text[s:e].split(u'=', 1)[1].strip()
+
+    def _add(self, start, end, render):
+        """Record an edit."""
+        self._edits.append(_Edit(start, end, render, len(self._edits)))
+
+    def replace_span(self, start, end, new_text):
+        """
+        Replace text[start:end] with new_text.
+
+        start, end -- indices into the original text.
+        new_text -- replacement text.
+        """
+        self._add(start, end, lambda sub: new_text)
+
+    def set_value(self, use, name, value):
+        """
+        Change the value of a parameter, adding the parameter if needed.
+
+        use -- TemplateUse to change.
+        name -- name of the parameter.
+        value -- new value. Whitespace around the old value is kept.
+        """
+        i = self._param_index(use, name)
+        if i == -1:
+            self.add_param(use, u'%s=%s' % (name, value))
+            return
+        s, e = use.param_spans[i]
+        s = self.text.index(u'=', s, e) + 1
+        old = self.text[s:e]
+        s += len(old) - len(old.lstrip())
+        e -= len(old) - len(old.rstrip())
+        if e < s:
+            e = s
+        self.replace_span(s, e, value)
+
+    def replace_param(self, use, name, new_param):
+        """
+        Replace a whole parameter (name and value).
+
+        use -- TemplateUse to change.
+        name -- name of the parameter to replace.
+        new_param -- replacement text, without the leading '|'.
+                     It may contain several parameters separated by '|'.
+
+        Whitespace after the old value is kept.
+        Raise KeyError if the template doesn't have the named parameter.
+        """
+        i = self._param_index(use, name)
+        if i == -1:
+            raise KeyError(name)
+        s, e = use.param_spans[i]
+        old = self.text[s:e]
+        self.replace_span(s, s + len(old.rstrip()), new_param)
+
+    def remove_param(self, use, name):
+        """
+        Remove a parameter, including its leading '|'.
+
+        use -- TemplateUse to change.
+        name -- name of the parameter to remove.
+
+        Raise KeyError if the template doesn't have the named parameter.
+        """
+        i = self._param_index(use, name)
+        if i == -1:
+            raise KeyError(name)
+        s, e = use.param_spans[i]
+        self.replace_span(s - 1, e, u'')
+
+    def add_param(self, use, param, before=None):
+        """
+        Add a parameter to a template.
+
+        use -- TemplateUse to change.
+        param -- text of the new parameter(s), without the leading '|'.
+        before -- name of the parameter to add the new one before.
+                  If None, or not present, the new one is added at the end.
+        """
+        i = -1
+        if before is not None:
+            i = self._param_index(use, before)
+        if i != -1:
+            pos = use.param_spans[i][0] - 1
+            new_text = u'|' + param
+        else:
+            pos = use.end - 2
+            new_text = u'|' + param
+            # Keep templates with one parameter per line that way
+            if self.text[pos - 1] == u'\n':
+                new_text += u'\n'
+        self.replace_span(pos, pos, new_text)
+
+    def rename_template(self, use, new_name):
+        """
+        Change which template is used, leaving the parameters alone.
+
+        use -- TemplateUse to change.
+        new_name -- name of the template to use instead.
+        """
+        if use.param_spans:
+            name_end = use.param_spans[0][0] - 1
+        else:
+            name_end = use.end - 2
+        name = self.text[use.start + 2:name_end]
+        s = use.start + 2 + len(name) - len(name.lstrip())
+        e = name_end - (len(name) - len(name.rstrip()))
+        self.replace_span(s, e, new_name)
+
+    def reorder_params(self, use, key):
+        """
+        Rewrite a template with its parameters sorted, one per line.
+
+        use -- TemplateUse to change.
+        key -- function of one argument that is used to extract a comparison
+               key from each parameter string.
+
+        Changes to templates nested within the parameters are kept.
+        """
+        def render(sub):
+            params = [sub(s, e).strip() for (s, e) in use.param_spans]
+            return (u'{{%s\n|' % use.name +
+                    u'\n|'.join(sorted(params, key=key)) +
+                    u'\n}}')
+        self._add(use.start, use.end, render)
+
+    def _render(self, start, end, edits, used):
+        """
+        Return text[start:end] with the specified edits applied.
+
+        start, end -- the span of the original text to render.
+        edits -- list of _Edits within the span, in order.
+        used -- set to add the seq of each edit applied to.
+        """
+        result = []
+        pos = start
+        i = 0
+        while i < len(edits):
+            edit = edits[i]
+            if edit.start < pos:
+                raise ValueError(u'Overlapping edits at %d' % edit.start)
+            # Find the edits nested within this one
+            j = i + 1
+            while j < len(edits) and edits[j].start < edit.end:
+                if edits[j].end > edit.end:
+                    raise ValueError(u'Overlapping edits at %d' % edits[j].start)
+                if (edits[j].start, edits[j].end) == (edit.start, edit.end):
+                    raise ValueError(u'Conflicting edits at %d' % edit.start)
+                j += 1
+            nested = edits[i + 1:j]
+            def sub(s, e, nested=nested):
+                return self._render(s, e,
+                                    [n for n in nested if s <= n.start and n.end <= e],
+                                    used)
+            result.append(self.text[pos:edit.start])
+            result.append(edit.render(sub))
+            used.add(edit.seq)
+            pos = edit.end
+            i = j
+        result.append(self.text[pos:end])
+        return u''.join(result)
+
+    def apply(self):
+        """
+        Return the text with all the edits made.
+
+        Raise ValueError if edits overlap, or if an edit would discard
+        the result of another edit.
+        """
+        # Insertions go before any replacement starting at the same place
+        edits = sorted(self._edits, key=lambda e: (e.start, e.start != e.end, -e.end, e.seq))
+        used = set()
+        text = self._render(0, len(self.text), edits, used)
+        if len(used) != len(edits):
+            raise ValueError(u'Edits nested within replaced text')
+        return text
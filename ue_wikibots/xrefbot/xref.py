@@ -19,6 +19,48 @@ Script to fix up categories and cross-references between pages on UE Wiki.
 
 Arguments:
 &params;
+
+-journal:<file>   Record each page processed in <file>, starting afresh.
+                  Without this or -resume, no journal is kept, so a
+                  one-off run doesn't overwrite the journal of an
+                  interrupted one.
+-resume           Skip pages that the journal (<file> from -journal, or
+                  the default journal file) records as processed at
+                  their current revision, and carry on recording in it.
+-dependencies:<file>
+                  Record which pages each page's result depends on in
+                  <file>, rather than in the default file.
+-incremental      Only process the pages affected by edits made since the
+                  last run.
+-watch            Keep running, processing the pages affected by edits
+                  as they are made. Changes are saved without asking.
+-interval:<n>     With -watch, check for edits every n seconds.
+-debounce:<n>     With -watch, wait until a page hasn't been edited for
+                  n seconds before processing it.
+-daemon[:<file>]  Keep running, listening on a Unix socket for page titles
+                  or page generator arguments to check, and replying with
+                  the changes that would be made. Use xref_client.py to
+                  make requests.
+-global:<name>    Process every page in snapshot <name> (see snapshot.py).
+                  All the pages are parsed once, up front, and every
+                  check is made against what the snapshot says, so no
+                  pages are read from the wiki. Changes are still
+                  uploaded to the wiki, and are worked out again for
+                  any page that has changed since the snapshot.
+-index:<name>     Find which event pages list each item from the index of
+                  snapshot <name> (see snapshot.py and pageindex.py),
+                  rather than by reading all the event pages.
+-redirects[:<name>]
+                  Resolve redirects from a table of every redirect on
+                  the wiki, listed in bulk at the start (or the one
+                  saved with snapshot <name>), rather than by reading
+                  each redirect page. -global always does this.
+-warmimages       Read the images and rarities of every item, Lt,
+                  property, ingredient, and skin in bulk before starting,
+                  rather than reading each page when it is first needed.
+-queue            Upload changes from a background queue, re-working out
+                  any change that conflicts with another edit, rather
+                  than saving each page before moving on to the next.
 """
 
 from __future__ import absolute_import
@@ -29,14 +71,23 @@ import os
 import operator
 import six
 from six.moves import range
+from six.moves import queue
+from six.moves import socketserver
 sys.path.append(os.environ['HOME'] + '/ue/ue_wikibots/core')
-from itertools import chain
 
 import pywikibot
 from pywikibot import pagegenerators
 import re
 import difflib
+import time
+import dropgraph
+import editqueue
+import facts
+import pageindex
+import patterns
+import snapshot
 import utils
+import wikitext
 
 # Stuff for the pywikibot help system
 docuReplacements = {
@@ -46,44 +97,141 @@ docuReplacements = {
 # Summary message when using this module as a stand-alone script
 summary = u'Robot: Fix cross-references and/or categories'
 
-# Headers
-# This doesn't match level 1 headers, but they're rare...
-HEADER_RE = re.compile(r'(={2,})\s*(?P<title>[^=]+)\s*\1')
+# Default file to record the progress of a run in
+JOURNAL_FILE = u'xref_journal.json'
 
-# List items on gift page
-GIFT_RE = re.compile(r'<li value=(?P<level>.*)>\[\[(?P<item>.*)\]\]</li>')
+# Default file to record which pages depend on which others in
+DEPENDENCY_FILE = u'xref_dependencies.json'
 
-# List items on faction page
-FACTION_RE = re.compile(r'\*\s*(?P<points>\S*)>\s*points - \[\[(?P<item>.*)\]\]')
+# Default socket for -daemon (xref_client.py uses the same default)
+SOCKET_FILE = u'xref.sock'
 
-# Any link
-LINK_RE = re.compile(r'\[\[\s*(?P<page>[^\|\]]*)\s*.*\]\]')
+# Which other pages the result for each page depends on
+dependencies = utils.DependencyGraph()
 
-# String used for category REs
-CATEGORY_RE_STR = r'\[\[\s*Category:\s*%s\s*\]\]'
-CATEGORY_RE = re.compile(r'\[\[\s*Category:[^]]*\]\]')
+# Structural data kept between runs
+metadata = utils.metadata
 
-# Regexes used for item powers
-NO_STACK_RE = re.compile(r'\[no \[\[stack\]\]\]')
-NO_STACK_RE_2 = re.compile(r'{{No Stack}}')
-# Separators are with, for, and to
-SEP_RE = re.compile(r' with | for | to ')
-# Some follow completely different patterns
-# Note that here we deliberately avoid matching the powers of the four Medallions
-ALL_RE = re.compile(r'[Aa]ll (.*) (count as \d.*)')
-WHEN_RE = re.compile(r'(.*) when (.*)')
+# The Rarity page only changes when a new rarity is added
+utils.rarities.persist_in(metadata)
 
 # Cache to speed up _fix_lieutenant()
-cat_refs_map = utils.CategoryRefs()
+cat_refs_map = utils.CategoryRefs(dependencies)
 
 # Cache to speed up finding recipes
-recipe_cache = utils.RecipeCache()
+recipe_cache = utils.RecipeCache(dependencies)
 
 # Image cache
-image_map = utils.ImageMap()
+image_map = utils.ImageMap(dependencies)
 
 # Parsed Achievements page
-ach = utils.Achievements()
+ach = utils.Achievements(dependencies)
+
+# Parsed event pages
+event_rewards = utils.EventRewards(dependencies)
+
+# Parsed Gift, faction, Battle Rank, and ingredient pages
+hub_pages = utils.HubPageCache(dependencies)
+
+def needs_subcategories():
+    """
+    Return the set of sub-categories of Needs Information, without namespace.
+    """
+    def derive():
+        cat = pywikibot.Category(pywikibot.Site(),
+                                 u'Category:Needs Information')
+        return sorted(c.title(withNamespace=False) for c in cat.subcategories(recurse=True))
+    def fingerprint():
+        # The sizes of every category in the tree, as last seen, catch
+        # subcategories added or removed anywhere in it
+        titles = [u'Category:%s' % c for c in metadata.value(u'needs_subcategories', [])]
+        return utils.category_sizes([u'Category:Needs Information'] + titles)
+    return set(metadata.get(u'needs_subcategories', fingerprint, derive))
+
+def recombinators():
+    """
+    Return the set of titles of the pages in the Recombinators category.
+    """
+    def derive():
+        cat = pywikibot.Category(pywikibot.Site(),
+                                 u'Category:Recombinators')
+        return sorted(p.title() for p in cat.articles())
+    return set(metadata.get(u'recombinators',
+                            lambda: utils.category_sizes([u'Category:Recombinators']),
+                            derive))
+
+def gift_levels(page):
+    """
+    Return a dict, keyed by item name, of the minimum level for each gift.
+
+    page -- the Gift Page.
+    """
+    levels = {}
+    text = page.get()
+    o = wikitext.outline(text)
+    # Each gift is listed as <li value=level>[[item]]</li>
+    for link in o.links:
+        (start, end) = o.line_bounds(link.start)
+        before = text[start:link.start]
+        i = before.rfind(u'<li value=')
+        if i == -1 or not before.endswith(u'>') or not text.startswith(u'</li>', link.end, end):
+            continue
+        levels.setdefault(link.title, before[i + len(u'<li value='):-1])
+    return levels
+
+def faction_points(page):
+    """
+    Return a dict, keyed by item name, of the points needed for each item.
+
+    page -- the Page for one faction.
+    """
+    points = {}
+    text = page.get()
+    o = wikitext.outline(text)
+    # Each item is listed as *points> points - [[item]]
+    for link in o.links:
+        (start, end) = o.line_bounds(link.start)
+        before = text[start:link.start]
+        if not before.endswith(u'points - '):
+            continue
+        before = before[:-len(u'points - ')].rstrip()
+        star = before.rfind(u'*')
+        if star == -1 or not before.endswith(u'>'):
+            continue
+        value = before[star + 1:-1].strip()
+        if len(value.split()) > 1:
+            continue
+        points.setdefault(link.title, value)
+    return points
+
+def battle_ranks(page):
+    """
+    Return a dict, keyed by reward, of the battle rank that gives it.
+
+    page -- the Battle Rank Page.
+
+    Note that the keys are the reward parameters verbatim (usually links).
+    """
+    ranks = {}
+    for t,p in utils.templates_with_params(page):
+        if t == u'Battle Rank List':
+            ranks[p[u'reward']] = p[u'number']
+    return ranks
+
+def ingredient_source(page):
+    """
+    Return the from parameter of an ingredient page, or None.
+
+    page -- the Page for the ingredient.
+    """
+    src_param = None
+    try:
+        templatesWithParams = utils.templates_with_params(page)
+    except pywikibot.NoPage:
+        return None
+    for t,p in templatesWithParams:
+        src_param = utils.param_from_params(p, u'from')
+    return src_param
 
 def drop_params_match(param1, param2):
     """
@@ -96,25 +244,7 @@ def drop_params_match(param1, param2):
 
     Return True if they match, False otherwise.
     """
-    # Direct match first
-    if param1 == param2:
-        return True
-    if not param1:
-        return False
-    if not param2:
-        return False
-    # Convert spaces to underscores in both
-    param1 = param1.replace(' ', '_')
-    param2 = param2.replace(' ', '_')
-    # Match link with non-link equivalent
-    if param1[0:2] == u'[[':
-        param1 = param1[2:-2]
-    if param2[0:2] == u'[[':
-        param2 = param2[2:-2]
-    # Match with mismatched case of first character
-    if param1[1:] == param2[1:]:
-        return param1[0].lower() == param2[0].lower()
-    return False
+    return wikitext.title_key(param1) == wikitext.title_key(param2)
 
 def time_params_match(param1, param2):
     """
@@ -130,9 +260,8 @@ def time_params_match(param1, param2):
     if param1 == param2:
         return True
     # Split into number and units
-    Rvalue = re.compile(r'(?P<value>\d*)\s*(?P<unit>\w*)')
-    g1 = Rvalue.match(param1)
-    g2 = Rvalue.match(param2)
+    g1 = patterns.TIME_VALUE_RE.match(param1)
+    g2 = patterns.TIME_VALUE_RE.match(param2)
     #pywikibot.output("%s %s" % (g1.group('value'), g1.group('unit')))
     #pywikibot.output("%s %s" % (g2.group('value'), g2.group('unit')))
     if g1.group('value') != g2.group('value'):
@@ -157,9 +286,7 @@ def missing_params(all_params, mandatory_list):
     Return a set of parameter names.
     """
     ret = set(mandatory_list)
-    param_dict = utils.params_to_dict(all_params)
-    for k in param_dict.keys():
-        ret.discard(k)
+    ret.difference_update(utils.param_names(all_params))
     return ret
 
 def one_cap(string):
@@ -222,14 +349,15 @@ class XrefToolkit:
         # Note that this only gets explicit categories written into the page text,
         # not those added by templates.
         categories = page.categories()
-        tmp = page.templatesWithParams()
-        templatesWithParams = [(t.title(withNamespace=False),p) for (t,p) in tmp]
+        templatesWithParams = utils.templates_with_params(page)
         # Don't do anything to stub pages
         for template,params in templatesWithParams:
             if template == u'Stub':
                 pywikibot.output("Not touching stub page %s" % titleWithoutNamespace)
                 return text
         refs = list(page.getReferences())
+        for r in refs:
+            dependencies.add(r.title())
         oldText = text
         #pywikibot.output("******\nIn text:\n%s" % text)
         text = self._fix_page(titleWithoutNamespace,
@@ -420,9 +548,8 @@ class XrefToolkit:
 
         Return the new page text.
         """
-        Rcat = re.compile(CATEGORY_RE_STR % category)
         # Remove the category
-        return Rcat.sub('', text)
+        return patterns.category(category).sub('', text)
 
     def _fix_needs_description(self, text):
         """
@@ -431,8 +558,8 @@ class XrefToolkit:
 
         text -- current page text.
         """
-        Rcat1 = re.compile(CATEGORY_RE_STR % 'Needs Description')
-        Rcat2 = re.compile(CATEGORY_RE_STR % 'No In-game Description')
+        Rcat1 = patterns.category('Needs Description')
+        Rcat2 = patterns.category('No In-game Description')
         m1 = Rcat1.search(text)
         m2 = Rcat2.search(text)
         if m1 and m2:
@@ -490,38 +617,7 @@ class XrefToolkit:
 
         End point is a header at the same level, a template, or category.
         """
-        # TODO Merge into utils.find_specific_section()
-        headers = []
-        iterator = HEADER_RE.finditer(text)
-        for m in iterator:
-            hdr_lvl = len(m.group(1))
-            headers.append({'level':hdr_lvl,
-                            'title':m.group(u'title').strip(),
-                            'from':m.start(),
-                            'to':m.end()})
-
-        start = -1
-        end = -1
-        level = -1
-        for hdr in headers:
-            if (level == -1) or (hdr['level'] == level):
-                if start == -1:
-                    if hdr['title'] == title:
-                        # This is our start point
-                        section_name = hdr['title']
-                        start = hdr['to'] + 1
-                        # The end will be the start of the next section at this level
-                        level = hdr['level']
-                else:
-                    # This is our end point
-                    end = hdr['from'] - 1
-                    break
-        if end == -1:
-            # Exclude any categories
-            m = CATEGORY_RE.search(text[start:end])
-            if m:
-                end = start + m.start() - 1
-        return (start, end)
+        return wikitext.outline(text).section(title)
 
     def _cat_in_categories(self, category, categories):
         """
@@ -534,8 +630,7 @@ class XrefToolkit:
         """
         # Is it in the specified category ?
         for this_category in categories:
-            if re.search(CATEGORY_RE_STR % category,
-                         this_category.title(asLink=True)):
+            if patterns.category(category).search(this_category.title(asLink=True)):
                 return True
         return False
 
@@ -545,12 +640,13 @@ class XrefToolkit:
 
         src_list -- text string to convert.
         """
-        labre = re.compile(r'{{Lab[^}]*}}', re.MULTILINE | re.DOTALL)
         text = src_list.replace(u'<br/>\n', u'')
         text = text.replace(u'<br />\n', u'')
         text = text.replace(r'*', u'')
         # Convert any use of a Lab template to a link to the Tech Lab page
-        text = labre.sub(u'made in [[Tech Lab]]', text)
+        text = wikitext.replace_templates(text,
+                                          lambda name: name.startswith(u'Lab'),
+                                          u'made in [[Tech Lab]]')
         text = text.replace(u'\n', u', ')
         return text
 
@@ -577,8 +673,7 @@ class XrefToolkit:
         level_items = {}
         rank_items = {}
         for r in refs:
-            for temp,params in r.templatesWithParams():
-                template = temp.title(withNamespace=False)
+            for template,params in utils.templates_with_params(r):
                 if template == 'Battle Rank Item':
                     p = utils.param_from_params(params, u'rank')
                     if p:
@@ -603,10 +698,10 @@ class XrefToolkit:
                 print('Missing or mismatched rank item "%s" - expected %s' % (k,v))
         # Are any items listed that shouldn't be?
         start, end = self._find_section(text, 'Basic Item Availability')
-        iterator = LINK_RE.finditer(text[start:end])
         all_items = {**area_items, **level_items, **rank_items}
-        for m in iterator:
-            item = m.group('page')
+        # Each row starts with the item
+        for link in wikitext.outline(text).first_links(start, end):
+            item = link.target
             # Check that the thing we're looking for is actually in a table
             if '|[[%s' % item not in text:
                 continue
@@ -677,12 +772,12 @@ class XrefToolkit:
                 if image is not None:
                     if part_img is None:
                         # Insert an appropriate part_img parameter
-                        new_part = re.sub(r'(\|\W*%s\W*=\W*%s)' % (part_str,
-                                                                    utils.escape_str(part)),
-                                          r'\1\n|%s=%s' % (part_img_str,
-                                                            image),
-                                          text[recipe_start:],
-                                          1)
+                        part_re = patterns.named_param_value(part_str,
+                                                             utils.escape_str(part))
+                        new_part = part_re.sub(r'\1\n|%s=%s' % (part_img_str,
+                                                                image),
+                                               text[recipe_start:],
+                                               1)
                         text = text[:recipe_start] + new_part
                     elif image != part_img:
                         # TODO Replace the image with the one from the ingredient page
@@ -871,9 +966,9 @@ class XrefToolkit:
 
     def _lt_rarity(self, name):
         """Return the rarity of the specified Lt."""
-        page = pywikibot.Page(pywikibot.Site(), name)
-        for template,params in page.templatesWithParams():
-            title = template.title(withNamespace=False)
+        dependencies.add(name)
+        page = utils.get_page(name)
+        for title,params in utils.templates_with_params(page):
             if title.startswith(u'Lieutenant '):
                 return title.split()[1]
 
@@ -901,10 +996,10 @@ class XrefToolkit:
         # First figure out what sections we have
         sections = []
         rarities = utils.rarities_in_order()
-        for m in HEADER_RE.finditer(text):
+        for hdr in wikitext.outline(text).headers:
             for r in rarities:
-                if r in m.group(u'title'):
-                    sections.append((r, m.start(), [], m.end()))
+                if r in hdr.title:
+                    sections.append((r, hdr.start, [], hdr.end))
 
         # Check each template
         for template, params in templatesWithParams:
@@ -1086,13 +1181,15 @@ class XrefToolkit:
 
     # The next few methods are only used on Boss pages
 
-    def _check_item_params(self, text, source, drop_params):
+    def _check_item_params(self, text, source, drop_params, items=None):
         """
         Return text with corrected parameters for the drop.
 
         text -- Current page text.
         source -- the title of the page listing the drop.
         drop_params -- a dictionary of the Drop template's parameters.
+        items -- dict of already-fetched item Pages, keyed by item name,
+                 from utils.get_pages(), or None.
 
         Return modified text with missing parameters added.
 
@@ -1121,10 +1218,13 @@ class XrefToolkit:
             item_name = drop_params[u'name']
         except KeyError:
             return text
-        item = pywikibot.Page(pywikibot.Site(), item_name)
-        templatesWithParams = item.templatesWithParams()
-        for (temp, params) in templatesWithParams:
-            template = temp.title(withNamespace=False)
+        dependencies.add(item_name)
+        if items and item_name in items:
+            item = items[item_name]
+        else:
+            item = utils.get_page(item_name)
+        templatesWithParams = utils.templates_with_params(item)
+        for (template, params) in templatesWithParams:
             #pywikibot.output("Template %s" % template)
             # TODO Clean this code up
             if (u'Item' in template) or (template == u'Ingredient') or (template == u'Insignia'):
@@ -1163,13 +1263,12 @@ class XrefToolkit:
                 if key not in drop_params and key in item_params:
                     # "for" parameter only needed where the item is a Tech Lab ingredient
                     # TODO There should be a better way to do this...
-                    if item_name not in paramless_items and not self._cat_in_categories(u'Recombinators', item.categories()):
+                    if item_name not in paramless_items and item.title() not in recombinators():
                         # TODO Need to also remove type=Ingredients
-                        text = re.sub(r'name\s*=\s*%s\s*\|' % item_name,
-                                      u'name=%s|%s=%s|' % (item_name,
-                                                           key,
-                                                           item_params[key]),
-                                      text)
+                        text = patterns.name_param(item_name).sub(u'name=%s|%s=%s|' % (item_name,
+                                                                                       key,
+                                                                                       item_params[key]),
+                                                                  text)
                 if source not in item_params['from']:
                     pywikibot.output("Boss claims to drop %s, but is not listed on that page" % item_name)
             elif u'Lieutenant' in template:
@@ -1238,14 +1337,17 @@ class XrefToolkit:
         text = self._prepend_NOWYSIWYG_if_needed(text)
 
         # Check each drop
+        drops = []
         for (template, params) in templatesWithParams:
             if template == u'Drop':
                 print("*** %s still uses 'Drop' template rather than 'BossDrop'" % name)
-                drop_params = utils.params_to_dict(params)
-                text = self._check_item_params(text, name, drop_params)
+                drops.append(utils.params_to_dict(params))
             elif template == u'BossDrop':
-                drop_params = utils.params_to_dict(params)
-                text = self._check_item_params(text, name, drop_params)
+                drops.append(utils.params_to_dict(params))
+        # Fetch all the dropped items' pages together
+        items = utils.get_pages([d[u'name'] for d in drops if u'name' in d])
+        for drop_params in drops:
+            text = self._check_item_params(text, name, drop_params, items)
 
         # Event Bosses are structured very differently
         if u'Event Bosses' in the_cats:
@@ -1277,7 +1379,7 @@ class XrefToolkit:
         if (start == -1):
             (start, end) = self._find_section(text, sect)
             # Replace the header
-            text = re.sub(r'=\s*%s\s*=' % sect, u'=%s=' % sect_str, text)
+            text = patterns.header(sect).sub(u'=%s=' % sect_str, text)
 
         text = self._check_needs_section(text,
                                          categories,
@@ -1400,19 +1502,17 @@ class XrefToolkit:
         """
         # TODO implement the rest of this function
         # First, retrieve the expected cost ratios from the template
-        Rrow = re.compile(r'\|\s*(?P<level>\d+).*cost}}}\*(?P<ratio>[\d.]+)')
-        table_page = pywikibot.Page(pywikibot.Site(),
-                                    u'Template:Property Cost Table')
+        dependencies.add(u'Template:Property Cost Table')
+        table_page = utils.get_page(u'Template:Property Cost Table')
         table_text = table_page.get()
-        iterator = Rrow.finditer(table_text)
+        iterator = patterns.COST_RATIO_RE.finditer(table_text)
         ratios = {1:1.0}
         for m in iterator:
             level = m.group('level')
             ratio = m.group('ratio')
             ratios[int(level)] = float(ratio)
         # Now we can check the cost table
-        Rrow2 = re.compile(r'\|\s*(?P<level>\d+).*formatnum:\s*(?P<cost>\d+)')
-        iterator = Rrow2.finditer(text)
+        iterator = patterns.COST_ROW_RE.finditer(text)
         costs = {}
         for m in iterator:
             level = int(m.group('level'))
@@ -1546,7 +1646,7 @@ class XrefToolkit:
         # Does the page use a sidekick template ?
         the_params = None
         ingredients = None
-        is_tech_lab_item = name in recipe_cache.recipes()
+        is_tech_lab_item = recipe_cache.has_recipe(name)
         for template,params in templatesWithParams:
             # Find the templates we're interested in
             if template == u'Sidekick':
@@ -1602,21 +1702,6 @@ class XrefToolkit:
 
     # The next few methods are only used on Lieutenant pages
 
-    def _lt_was_event_reward(self, lt_name, event_name):
-        """
-        Check whether a Lieutenant was a reward in the specified event.
-
-        lt_name -- title of the Lt page
-        event_name -- Title of the event page
-
-        Return True or False
-        """
-        page = pywikibot.Page(pywikibot.Site(), event_name)
-        # Lt rewards in events always specify how many of the Lt you get
-        if re.search(r'\d\s*x?\s*\[\[\s*%s' % lt_name, page.get()):
-            return True
-        return False
-
     def _fix_lt_sources(self, name, text, the_params, refs):
         """
         Fix the list of sources on a Lieutenant page.
@@ -1632,29 +1717,27 @@ class XrefToolkit:
         # Check where the Lt can be obtained from
         # TODO Ones that can be bought are listed on [[Category:Lieutenants]]
         sources = []
-        REWARD_RE = re.compile(r'Top (10|25) - (?P<rewards>.*)')
+        event_prizes = event_rewards.lt_rewards_for(name)
         for r in refs:
-            if self._cat_in_categories(u'Crates', r.categories()):
+            r_categories = list(r.categories())
+            if self._cat_in_categories(u'Crates', r_categories):
                 sources.append(u'[[%s]]' % r.title())
                 # Ensure that it's in Crate Lieutenants
                 c = u'Crate Lieutenants'
                 text = self._append_category(text, c)
-            elif self._cat_in_categories(u'Giveaways', r.categories()):
+            elif self._cat_in_categories(u'Giveaways', r_categories):
                 sources.append(u'[[%s]]' % r.title())
-            elif self._cat_in_categories(u'Events', r.categories()):
+            elif event_rewards.is_event(r.title()):
                 # ensure that the Lt was a reward rather than an opponent
-                if not self._lt_was_event_reward(name, r.title()):
+                if r.title() not in event_prizes:
                     continue
                 sources.append(u'[[%s]]' % r.title())
                 # Was it the main prize?
-                r_text = r.get()
-                m = REWARD_RE.search(r_text)
-                if m and name in m.group('rewards'):
+                if event_prizes[r.title()]:
                     # Ensure that it's in Event Lieutenants
                     c = u'Event Lieutenants'
                     text = self._append_category(text, c)
-            for temp,params in r.templatesWithParams():
-                template = temp.title(withNamespace=False)
+            for template,params in utils.templates_with_params(r):
                 if template == u'Challenge Job':
                     area = r.title()
                     job = utils.param_from_params(params, u'name')
@@ -1693,8 +1776,7 @@ class XrefToolkit:
         """
         refItems = {}
         for r in refs:
-            for temp,params in r.templatesWithParams():
-                template = temp.title(withNamespace=False)
+            for template,params in utils.templates_with_params(r):
                 if u'Item' in template and not template == u'FP Item Row':
                     param_dict = utils.params_to_dict(params)
                     try:
@@ -1739,10 +1821,9 @@ class XrefToolkit:
         if lt in beneficiary:
             return True
 
-        parseRe = re.compile(r'\[\[\s*:(Category:[^]\|]*)(|[^]]*)\]\]')
-
         # What categories of Lt does the item help ?
-        cats = parseRe.findall(beneficiary)
+        cats = [l.title for l in wikitext.link_uses(beneficiary)
+                if l.colon and l.title.startswith(u'Category:')]
 
         if not cats:
             return False
@@ -1754,7 +1835,7 @@ class XrefToolkit:
 
         # For this Lt to benefit, it must be in all the listed categories
         for c in cats:
-            if lCat != c[0] and rCat != c[0] and fCat != c[0]:
+            if lCat != c and rCat != c and fCat != c:
                 return False
         return True
 
@@ -1771,16 +1852,16 @@ class XrefToolkit:
             stack (True/False)
         """
         # Does the power stack ?
-        stack = (NO_STACK_RE.search(power) is None)
+        stack = (patterns.NO_STACK_RE.search(power) is None)
         # Remove any "no stack" string
-        power = NO_STACK_RE.sub('', power)
+        power = patterns.NO_STACK_RE.sub('', power)
         if stack:
-            stack = (NO_STACK_RE_2.search(power) is None)
+            stack = (patterns.NO_STACK_RE_2.search(power) is None)
             # Remove any "no stack" string
-            power = NO_STACK_RE_2.sub('', power)
+            power = patterns.NO_STACK_RE_2.sub('', power)
 
         # Try the "all" pattern
-        res = ALL_RE.match(power)
+        res = patterns.ALL_RE.match(power)
         if res is not None:
             return (res.group(2), res.group(1), None, stack)
 
@@ -1789,12 +1870,12 @@ class XrefToolkit:
             return (power, None, None, stack)
 
         # And the "when" pattern
-        res = WHEN_RE.match(power)
+        res = patterns.WHEN_RE.match(power)
         if res is not None:
             return (res.group(1), res.group(2), None, stack)
 
         # Split at our separators
-        res = SEP_RE.split(power)
+        res = patterns.SEP_RE.split(power)
         if len(res) == 2:
             return (res[0], res[1], None, stack)
         elif len(res) == 3:
@@ -1872,32 +1953,32 @@ class XrefToolkit:
                                                                               items[key][0]))
                     if items[key][0]:
                         # This regex assumes that the parameter has a line to itself
-                        text = re.sub(r'item_%d_pwr\s*=\s*.*' % items[key][2],
-                                      u'item_%d_pwr=%s\n' % (items[key][2],
-                                                             refItems[key][0]),
-                                      text)
+                        pwr_re = patterns.param_line(u'item_%d_pwr' % items[key][2])
+                        text = pwr_re.sub(u'item_%d_pwr=%s\n' % (items[key][2],
+                                                                 refItems[key][0]),
+                                          text)
                     else:
-                        text = re.sub(r'item_%d\s*=' % items[key][2],
-                                      u'item_%d_pwr=%s\n|item_%d=' % (items[key][2],
-                                                                      refItems[key][0],
-                                                                      items[key][2]),
-                                      text)
+                        item_re = patterns.param(u'item_%d' % items[key][2])
+                        text = item_re.sub(u'item_%d_pwr=%s\n|item_%d=' % (items[key][2],
+                                                                           refItems[key][0],
+                                                                           items[key][2]),
+                                           text)
                 if refItems[key][1] != items[key][1]:
                     pywikibot.output("Mismatch in image for %s - %s vs %s" % (key,
                                                                               refItems[key][1],
                                                                               items[key][1]))
                     if items[key][1]:
                         # This regex assumes that the parameter has a line to itself
-                        text = re.sub(r'item_%d_img\s*=\s*.*' % items[key][2],
-                                      u'item_%d_img=%s\n' % (items[key][2],
-                                                             refItems[key][1]),
-                                      text)
+                        img_re = patterns.param_line(u'item_%d_img' % items[key][2])
+                        text = img_re.sub(u'item_%d_img=%s\n' % (items[key][2],
+                                                                 refItems[key][1]),
+                                          text)
                     else:
-                        text = re.sub(r'item_%d\s*=' % items[key][2],
-                                      u'item_%d_img=%s\n|item_%d=' % (items[key][2],
-                                                                      refItems[key][1],
-                                                                      items[key][2]),
-                                      text)
+                        item_re = patterns.param(u'item_%d' % items[key][2])
+                        text = item_re.sub(u'item_%d_img=%s\n|item_%d=' % (items[key][2],
+                                                                           refItems[key][1],
+                                                                           items[key][2]),
+                                           text)
             else:
                 pywikibot.output("Missing item %s which gives %s" % (key,
                                                                      refItems[key][0]))
@@ -2023,7 +2104,7 @@ class XrefToolkit:
         # Does the page use a lieutenant template ?
         the_params = None
         ingredients = None
-        is_tech_lab_item = name in recipe_cache.recipes()
+        is_tech_lab_item = recipe_cache.has_recipe(name)
         for template,params in templatesWithParams:
             # Find the templates we're interested in
             if template == u'Lieutenant':
@@ -2120,7 +2201,7 @@ class XrefToolkit:
         # Does the page use an item template ?
         the_params = None
         ingredients = None
-        is_tech_lab_item = name in recipe_cache.recipes()
+        is_tech_lab_item = recipe_cache.has_recipe(name)
         for template,params in templatesWithParams:
             # Find the templates we're interested in
             if template == u'Item':
@@ -2221,84 +2302,37 @@ class XrefToolkit:
         # Starting with the list of pages that link here
         source_set = set()
         for r in refs:
-            for temp,params in r.templatesWithParams():
-                template = temp.title(withNamespace=False)
-                if (template == u'Drop') or (template == u'BossDrop'):
-                    if utils.param_from_params(params, u'name') == name:
-                        # TODO If it has creator=true, need to ensure that's reflected on this page
-                        source_set.add(r.title())
-                elif template == u'Mystery Gift Item':
-                    gift_params = utils.params_to_dict(params)
-                    if name in list(gift_params.values()):
-                        source_set.add(r.title())
-                elif template == u'Execution Method':
-                    if name in utils.param_from_params(params, u'bonus'):
-                        source_set.add(r.title())
-                elif template == u'Challenge Job' and u'Recombinator' in name:
-                    # Challenge Jobs drop Recombinators
-                    if utils.param_from_params(params, u'recombinator') in name:
-                        source_set.add(u'{{Job Link|district=%s|job=%s}}' %
-                                           (r.title(),
-                                            utils.param_from_params(params, u'name')))
-            # TODO Pages referenced from HQ can either be requirements
-            # to build improvements, or drops after Wars with Shadow Broker.
-            # Assume any page linked to from the Favor Point page is available from the Black Market
-            if r.title() == u'Favor Point':
-                source_set.add(u'Black Market')
-            # Don't call r.categories() for redirects
-            elif r.isRedirectPage():
-                pass
-            # If it's linked to from a giveaways page, assume it was given away
-            elif self._cat_in_categories(u'Giveaways', r.categories()):
-                source_set.add(r.title())
-            # If it's linked from an event page, check whether it's in a list
-            # All rewards are in lists, although the converse may not be true
-            elif self._cat_in_categories(u'Events', r.categories()):
-                m = re.search(u'\*.*%s' % name, r.get())
-                if m:
-                    source_set.add(r.title())
-        # Check whether it's a daily achievement reward
-        if ach.is_daily_reward(name):
-            source_set.add(u'Achievements#Daily')
+            for drop in dropgraph.page_drops(r.title(), utils.templates_with_params(r)):
+                if drop.is_for(name):
+                    source_set.add(drop.source)
+        # Then those implied by the pages that link here
+        # Don't call r.categories() for redirects
+        referrers = ((r.title(), [c.title(withNamespace=False) for c in r.categories()])
+                     for r in refs if not utils.is_redirect(r))
+        source_set |= dropgraph.implied_sources(name, referrers, ach, event_rewards)
         # Then, find the places listed as sources in this page
         # Remove any that match from the source list, leaving missing sources
         # Count the number of sources already in the list as we go
-        src_count = 0
-        if from_param:
-            m = re.search(r'{{Lab.*}}', from_param, re.MULTILINE | re.DOTALL)
-            if m:
-                src_count += 1
-                # Need to avoid matches within the Lab template part
-                from_str = from_param[:m.start()] + from_param[m.end():]
-            else:
-                from_str = from_param
-            iterator = chain(LINK_RE.finditer(from_str),
-                             re.finditer(r'(?P<page>{{.*}})', from_str))
-        else:
-            iterator = []
-        for m in iterator:
+        (lab, sources) = dropgraph.listed_sources(from_param)
+        src_count = len(sources)
+        if lab:
             src_count += 1
-            src = m.group('page')
-            # Find the end of that line
-            start = m.end('page')
-            eol = from_param.find('\n', start)
-            if src in source_set:
-                source_set.remove(src)
-            elif u'before' in from_param[start:eol]:
+        # Keyed by title key, sources not yet found in the list
+        missing = dict((wikitext.title_key(s), s) for s in source_set)
+        for (src, before) in sources:
+            key = wikitext.title_key(src)
+            if key in missing:
+                del missing[key]
+            elif before:
                 # We don't expect the item to be present on that page any more
                 pass
-            elif src == u':Category:Crates':
-                # Ignore items that list the original crate as a source
-                pass
-            elif src == u'Bosses':
-                # "all bosses" is a valid source, even if item is not listed there
-                pass
-            elif src == u'Jobs':
-                # "all jobs" is a valid source, even if item is not listed there
+            elif key in dropgraph.GENERIC_SOURCE_KEYS:
+                # Valid sources, even if the item is not listed there
                 pass
             else:
                 # Note that this is not necessarily an error, but is worth investigating
                 pywikibot.output("Page lists %s as a source, but that page doesn't list it as a drop" % src)
+        source_set = set(missing.values())
         # Are any changes needed ?
         if source_set:
             # Add a from parameter if necessary
@@ -2383,12 +2417,9 @@ class XrefToolkit:
             text = self._append_category(text, u'Needs Minimum Level')
         else:
             text = self._remove_category(text, u'Needs Minimum Level')
-            gift_page = pywikibot.Page(pywikibot.Site(), u'Gift')
-            iterator = GIFT_RE.finditer(gift_page.get())
-            for m in iterator:
-                if m.group('item') == name:
-                    if m.group('level') != from_param:
-                        pywikibot.output("Minimum level mismatch - Gift page says %s, this page says %s" % (m.group('level'), from_param))
+            level = hub_pages.data_for(u'Gift', gift_levels).get(name)
+            if level is not None and level != from_param:
+                pywikibot.output("Minimum level mismatch - Gift page says %s, this page says %s" % (level, from_param))
         return text
 
     def _fix_gift_item(self, name, text, params):
@@ -2494,14 +2525,12 @@ class XrefToolkit:
                 text = self._append_category(text,
                                              u'Needs Unlock Criterion')
             else:
-                faction_page = pywikibot.Page(pywikibot.Site(), faction_param)
-                iterator = FACTION_RE.finditer(faction_page.get())
-                for m in iterator:
-                    if m.group('item') == name:
-                        if points_param != m.group('points'):
-                            # Change the value
-                            # Note that this replaces every instance of the text in points_param...
-                            text = text.replace(points_param, m.group('points'))
+                points = hub_pages.data_for(faction_param,
+                                            faction_points).get(name)
+                if points is not None and points_param != points:
+                    # Change the value
+                    # Note that this replaces every instance of the text in points_param...
+                    text = text.replace(points_param, points)
         except KeyError:
             text = self._append_category(text,
                                          u'Needs Information') # u'Needs Faction'
@@ -2538,14 +2567,19 @@ class XrefToolkit:
 
         Return the modified page text.
         """
-        # Note that this just finds the first instance of params[0]...
-        start = text.find(params[0])
-        if start != -1:
-            text = text[0:start] + new_param + u'|' + text[start:]
+        editor = wikitext.TemplateEditor(text)
+        use = editor.find_template(params)
+        if use is not None and use.param_spans:
+            # Add it as the first parameter
+            start = use.param_spans[0][0]
         else:
-            assert 0, "Failed to find params %s" % params
-
-        return text
+            # Params have been changed since they were read,
+            # so fall back to the first instance of params[0]
+            start = text.find(params[0])
+            if start == -1:
+                assert 0, "Failed to find params %s" % params
+        editor.replace_span(start, start, new_param + u'|')
+        return editor.apply()
 
     def _fix_possible_ingredient(self,
                                  name,
@@ -2727,16 +2761,10 @@ class XrefToolkit:
         if rank_param is None:
             text = self._append_category(text, u'Needs Unlock Criterion')
         else:
-            rank_page = pywikibot.Page(pywikibot.Site(), u'Battle Rank')
-            templatesWithParams = rank_page.templatesWithParams()
-            for tmp,p in templatesWithParams:
-                t = tmp.title(withNamespace=False)
-                if t == u'Battle Rank List':
-                    param_dict = utils.params_to_dict(p)
-                    rank = param_dict[u'number']
-                    item = param_dict[u'reward']
-                    if item == u'[[%s]]' % name and rank != rank_param:
-                        pywikibot.output("Minimum battle rank mismatch - Battle Rank page says %s, this page says %s" % (rank, rank_param))
+            ranks = hub_pages.data_for(u'Battle Rank', battle_ranks)
+            rank = ranks.get(u'[[%s]]' % name)
+            if rank is not None and rank != rank_param:
+                pywikibot.output("Minimum battle rank mismatch - Battle Rank page says %s, this page says %s" % (rank, rank_param))
 
         # Check type param
         text = self._fix_item_type(text, params)
@@ -2884,10 +2912,8 @@ class XrefToolkit:
             if key in lab_keys:
                 if recipe_dict[key] != lab_dict[key]:
                     # Fix up this page to match Tech Lab, because recipes are found there
-                    text = re.sub(r'(\|\W*%s\W*=\W*)%s' % (key,
-                                                            utils.escape_str(lab_dict[key])),
-                                  r'\g<1>%s' % recipe_dict[key],
-                                  text)
+                    value_re = patterns.param_value(key, utils.escape_str(lab_dict[key]))
+                    text = value_re.sub(r'\g<1>%s' % recipe_dict[key], text)
             else:
                 # Insert the missing parameter
                 pywikibot.output("Missing param - %s" % recipe_dict[key])
@@ -2910,25 +2936,15 @@ class XrefToolkit:
 
         Return updated text.
         """
-        i = 0
-        while True:
-            i += 1
+        parts = []
+        while u'part_%d' % (len(parts) + 1) in lab_dict:
+            parts.append(lab_dict[u'part_%d' % (len(parts) + 1)])
+        # Fetch all the ingredient pages we don't already know about together
+        hub_pages.prefetch(parts, ingredient_source)
+        for i, part in enumerate(parts, 1):
             part_str = u'part_%d' % i
-            try:
-                part = lab_dict[part_str]
-            except KeyError:
-                break
             from_str = part_str + u'_from'
-            try:
-                part_pg = pywikibot.Page(pywikibot.Site(), part)
-            except pywikibot.NoPage:
-                # No idea where it's from, so that's fine
-                continue
-            tmp = part_pg.templatesWithParams()
-            templatesWithParams = [(t.title(withNamespace=False),p) for (t,p) in tmp]
-            src_param = None
-            for t,p in templatesWithParams:
-                src_param = utils.param_from_params(p, u'from')
+            src_param = hub_pages.data_for(part, ingredient_source)
             if not src_param:
                 # Ingredient page doesn't say where to get it
                 continue
@@ -2982,20 +2998,26 @@ class XrefBot:
 
     """Main Xref WikiBot class."""
 
-    def __init__(self, generator, acceptall = False):
+    def __init__(self, generator, acceptall = False, journal = None, edits = None):
         """
         Class constructor.
 
         generator -- iterator to generate Pages to process.
         acceptall -- pass True to not prompt the user whether to accept
                      changes, but to go ahead and apply all changes.
+        journal -- utils.RunJournal to record processed pages in.
+                   Pages already recorded at their current revision
+                   are skipped.
+        edits -- editqueue.EditQueue to upload changes with, or None to
+                 upload each change before moving on to the next page.
         """
         self.generator = generator
         self.acceptall = acceptall
-        # Find all the sub-categories of Needs Information
-        cat = pywikibot.Category(pywikibot.Site(),
-                                 u'Category:Needs Information')
-        self.specific_needs = set(c.title(withNamespace=False) for c in cat.subcategories(recurse=True))
+        self.journal = journal
+        self.edits = edits
+        if edits is not None:
+            edits.callback = self._edit_done
+        self.specific_needs = needs_subcategories()
 
     def treat(self, page):
         """
@@ -3009,9 +3031,14 @@ class XrefBot:
             if ns == "File" or ns == "Talk" or ns == "User" or ns == "Thread":
                 pywikibot.output(u"Skipping %s because it's in the %s namespace" % (page.title(), ns))
                 return
+            if self.journal and self.journal.is_done(page.title(),
+                                                     page.latestRevision()):
+                pywikibot.output(u"Skipping %s because it was already processed" % page.title())
+                return
             # Show the title of the page we're working on.
             # Highlight the title in purple.
             pywikibot.output(u"\n\n>>> \03{lightpurple}%s\03{default} <<<" % page.title())
+            dependencies.start(page.title())
             xrToolkit = XrefToolkit(self.specific_needs, debug = True)
             changedText = xrToolkit.change(page.get(), page)
             # TODO Modify to treat just whitespace as unchanged
@@ -3031,47 +3058,504 @@ class XrefBot:
                                                     'N')
                     if choice == 'a':
                         self.acceptall = True
-                if self.acceptall or choice == 'y':
+                if not (self.acceptall or choice == 'y'):
+                    self._record(page, u'declined')
+                elif self.edits is not None:
+                    # The journal is updated when the edit is uploaded
+                    self.edits.submit(page, changedText, summary, self._transform())
+                else:
                     page.put(changedText, summary)
+                    self._record(page, u'saved')
             else:
                 pywikibot.output('No changes were necessary in %s' % page.title())
+                self._record(page, u'unchanged')
         except pywikibot.NoPage:
             pywikibot.output("Page %s does not exist?!" % page.title(asLink=True))
+            self._record(page, u'no page')
         except pywikibot.IsRedirectPage:
             pywikibot.output("Page %s is a redirect; skipping." % page.title(asLink=True))
+            self._record(page, u'redirect')
         except pywikibot.LockedPage:
             pywikibot.output("Page %s is locked?!" % page.title(asLink=True))
+            self._record(page, u'locked')
+        finally:
+            dependencies.finish()
+
+    def _transform(self):
+        """
+        Return a function to work out the changes to a page again.
+
+        The function is passed the current text and a fresh Page with
+        that text, so the templates and categories it reads match the
+        text rather than the Page from the first attempt.
+        """
+        def transform(text, page):
+            dependencies.start(page.title())
+            try:
+                xrToolkit = XrefToolkit(self.specific_needs, debug = True)
+                return xrToolkit.change(text, page)
+            finally:
+                dependencies.finish()
+        return transform
+
+    def _edit_done(self, result):
+        """
+        Record the result of an upload from the EditQueue.
+
+        result -- editqueue.EditResult.
+        """
+        if result.outcome != editqueue.SAVED:
+            pywikibot.output(u'Failed to save %s: %s %s' % (result.title,
+                                                            result.outcome,
+                                                            result.error or u''))
+        if self.journal:
+            self.journal.record(result.title, result.revid, result.outcome)
+
+    def _record(self, page, outcome):
+        """
+        Record that a page has been processed, if there's a journal.
+
+        page -- Page that was processed.
+        outcome -- short description of what was done to the page.
+        """
+        if not self.journal:
+            return
+        try:
+            # After a put, this is the revision we created
+            revid = page.latestRevision()
+        except pywikibot.NoPage:
+            revid = None
+        self.journal.record(page.title(), revid, outcome)
 
     def run(self):
         """Process each Page in turn."""
-        for page in self.generator:
-            self.treat(page)
+        try:
+            for page in self.generator:
+                self.treat(page)
+        finally:
+            if self.edits is not None:
+                self.edits.close()
+                self.edits.report()
+            if self.journal:
+                self.journal.close()
+
+def pages_affected_by(titles):
+    """
+    Return the titles of the pages whose results may be changed by some edits.
+
+    titles -- titles of the pages that have been edited.
+
+    Return a set of page titles.
+    """
+    affected = set()
+    for title in titles:
+        affected |= dependencies.dependents_of(title)
+        page = pywikibot.Page(pywikibot.Site(), title)
+        if page.namespace() == 0:
+            affected.add(title)
+        # The edit may have changed which categories the page is in,
+        # or which pages it links to (and so their refs)
+        others = [c.title() for c in page.categories()]
+        others += [p.title() for p in page.linkedPages()]
+        for other in others:
+            affected |= dependencies.dependents_of(other)
+            if dependencies.is_known(other):
+                affected.add(other)
+    return affected
+
+def invalidate_caches(title, old_revid=None, linked=True):
+    """
+    Discard any cached data that may have been changed by an edit.
+
+    title -- title of the page that was edited.
+    old_revid -- revid of the page before the edit, or None (or 0)
+                 for a new page.
+    linked -- pass False to skip the categories and pages that the page
+              links to, which needs the page reading.
+    """
+    titles = set([title])
+    if linked:
+        page = pywikibot.Page(pywikibot.Site(), title)
+        # Changes to categories and links affect category membership and refs.
+        # Those the edit added are in the current version of the page
+        titles.update(c.title() for c in page.categories())
+        titles.update(p.title() for p in page.linkedPages())
+        # and those it removed are in the version before the edit
+        if old_revid:
+            try:
+                old_text = page.getOldVersion(old_revid)
+            except pywikibot.Error:
+                # e.g. the old revision has been deleted
+                old_text = u''
+            titles.update(l.title for l in wikitext.link_uses(old_text) if l.title)
+    for t in titles:
+        for cache in [cat_refs_map, recipe_cache, image_map, ach, event_rewards, hub_pages, metadata,
+                      utils.rarities]:
+            cache.invalidate(t)
+
+class ChangeWatcher:
+
+    """Class to keep running XrefBot over pages as they are edited."""
+
+    # Number of passes to try a page on before giving up on it
+    MAX_TRIES = 3
+
+    def __init__(self, bot, since, dependency_file, interval=60, debounce=300):
+        """
+        Class constructor.
+
+        bot -- XrefBot to process pages with.
+        since -- ISO format timestamp to look for changes after.
+        dependency_file -- name of the file to save the dependency graph to.
+        interval -- seconds to wait between checks for changes.
+        debounce -- seconds to wait after an edit to a page before
+                    processing it, in case it is edited again.
+        """
+        self.bot = bot
+        self.changes = utils.RecentChanges(pywikibot.Site(), since)
+        # Edits made by this bot don't need the affected pages checked again
+        self.user = pywikibot.Site().user()
+        self.dependency_file = dependency_file
+        self.interval = interval
+        self.debounce = debounce
+        # Keyed by title, 2-tuple of (time the latest edit was seen,
+        # timestamp of the earliest edit not yet processed)
+        self._pending = {}
+        # Pages to process, in order, with a set to avoid duplicates
+        self._queue = queue.Queue()
+        self._queued = set()
+        # Keyed by title, number of passes the page has failed on
+        self._failures = {}
+
+    def poll(self):
+        """
+        Check for new edits, and queue the pages affected by settled ones.
+        """
+        now = time.time()
+        for change in self.changes.changes():
+            title = change.get(u'title')
+            if title is None:
+                continue
+            if self.user and change.get(u'user') == self.user:
+                # Don't spend requests on this bot's own edits.
+                # Just drop anything cached from the page itself
+                invalidate_caches(title, linked=False)
+                continue
+            invalidate_caches(title, change.get(u'old_revid'))
+            try:
+                first = self._pending[title][1]
+            except KeyError:
+                first = change[u'timestamp']
+            self._pending[title] = (now, first)
+        ready = [t for t, (seen, first) in self._pending.items() if now - seen >= self.debounce]
+        if not ready:
+            return
+        for title in sorted(pages_affected_by(ready)):
+            if title not in self._queued:
+                self._queued.add(title)
+                self._queue.put(title)
+        for title in ready:
+            del self._pending[title]
+
+    def process_queue(self):
+        """
+        Process every queued page, and save the dependency graph.
+
+        A page that fails is tried again on the next pass, up to
+        MAX_TRIES passes, and then given up on.
+        """
+        failed = []
+        try:
+            while not self._queue.empty():
+                title = self._queue.get()
+                try:
+                    self.bot.treat(pywikibot.Page(pywikibot.Site(), title))
+                except pywikibot.Error as e:
+                    tries = self._failures.get(title, 0) + 1
+                    if tries < self.MAX_TRIES:
+                        pywikibot.output(u'Failed to process %s (%s). Will try again.' % (title, e))
+                        self._failures[title] = tries
+                        failed.append(title)
+                        continue
+                    pywikibot.output(u'Failed to process %s (%s). Giving up.' % (title, e))
+                self._failures.pop(title, None)
+                self._queued.discard(title)
+        finally:
+            for title in failed:
+                self._queue.put(title)
+            # Restart from the earliest edit that hasn't been dealt with
+            timestamps = [first for (seen, first) in self._pending.values()]
+            timestamps.append(self.changes.since)
+            dependencies.save(self.dependency_file, min(timestamps))
+
+    def run(self):
+        """
+        Keep processing edited pages until interrupted.
+
+        Errors talking to the wiki (like timeouts when the servers are
+        lagged) are reported, and the work is tried again on the next pass.
+        """
+        while True:
+            try:
+                self.poll()
+                self.process_queue()
+            except pywikibot.Error as e:
+                pywikibot.output(u'Error while watching for changes: %s' % e)
+            time.sleep(self.interval)
+
+class XrefRequestHandler(socketserver.StreamRequestHandler):
+
+    """Class to handle one connection to an XrefDaemon."""
+
+    def handle(self):
+        """
+        Reply to each request on the connection.
+
+        Each request is one line, either a page title or a page generator
+        argument (like -cat:Lieutenants). The reply is the proposed diff
+        for each page, followed by an empty line.
+        """
+        for line in self.rfile:
+            request = line.decode('utf-8').strip()
+            if not request:
+                break
+            for reply in self.server.xref_daemon.diffs_for(request):
+                self.wfile.write((u'%s\n' % reply).encode('utf-8'))
+            self.wfile.write(b'\n')
+            self.wfile.flush()
+
+class XrefDaemon:
+
+    """
+    Class to check pages on request, keeping caches warm between requests.
+
+    Nothing is ever saved - the changes that would be made are returned
+    as unified diffs.
+    """
+
+    def __init__(self, since):
+        """
+        Class constructor.
+
+        since -- ISO format timestamp. Cached data from pages edited after
+                 this is discarded before each request.
+        """
+        self.specific_needs = needs_subcategories()
+        self.changes = utils.RecentChanges(pywikibot.Site(), since)
+
+    def _pages(self, request):
+        """
+        Return an iterator of the Pages for a request.
+
+        request -- page title or page generator argument.
+        """
+        if not request.startswith(u'-'):
+            return iter([pywikibot.Page(pywikibot.Site(), request)])
+        genFactory = pagegenerators.GeneratorFactory()
+        if not genFactory.handleArg(request):
+            return iter([])
+        return pagegenerators.PreloadingGenerator(genFactory.getCombinedGenerator())
+
+    def diffs_for(self, request):
+        """
+        Generator to return the lines of the proposed diffs for a request.
+
+        request -- page title or page generator argument.
+
+        Lines that aren't part of a diff start with u'#'.
+        """
+        for change in self.changes.changes():
+            title = change.get(u'title')
+            if title is not None:
+                invalidate_caches(title, change.get(u'old_revid'))
+        for page in self._pages(request):
+            try:
+                text = page.get()
+            except pywikibot.NoPage:
+                yield u'# Page %s does not exist' % page.title()
+                continue
+            except pywikibot.IsRedirectPage:
+                yield u'# Page %s is a redirect' % page.title()
+                continue
+            xrToolkit = XrefToolkit(self.specific_needs)
+            new_text = xrToolkit.change(text, page)
+            diff = list(difflib.unified_diff(text.splitlines(),
+                                             new_text.splitlines(),
+                                             page.title(),
+                                             u'%s (proposed)' % page.title(),
+                                             lineterm=u''))
+            if not diff:
+                yield u'# No changes necessary to %s' % page.title()
+            for line in diff:
+                yield line
+
+    def serve(self, socket_file):
+        """
+        Handle requests until interrupted.
+
+        socket_file -- path of the Unix socket to listen on.
+        """
+        # Remove any socket left behind by an earlier daemon
+        if os.path.exists(socket_file):
+            os.remove(socket_file)
+        server = socketserver.UnixStreamServer(socket_file, XrefRequestHandler)
+        server.xref_daemon = self
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(socket_file)
 
 def main():
     #page generator
     gen = None
     pageTitle = []
+    journal_file = None
+    resume = False
+    dependency_file = DEPENDENCY_FILE
+    incremental = False
+    watch = False
+    socket_file = None
+    interval = 60
+    debounce = 300
+    index_name = None
+    global_name = None
+    redirects = None
+    warm_images = False
+    use_queue = False
     # This factory is responsible for processing command line arguments
     # that are also used by other scripts and that determine on which pages
     # to work on.
     genFactory = pagegenerators.GeneratorFactory()
 
     for arg in pywikibot.handleArgs():
-        if not genFactory.handleArg(arg):
+        if arg == u'-resume':
+            resume = True
+        elif arg == u'-incremental':
+            incremental = True
+        elif arg == u'-watch':
+            watch = True
+        elif arg == u'-daemon':
+            socket_file = SOCKET_FILE
+        elif arg.startswith(u'-daemon:'):
+            socket_file = arg[len(u'-daemon:'):]
+        elif arg.startswith(u'-interval:'):
+            interval = int(arg[len(u'-interval:'):])
+        elif arg.startswith(u'-debounce:'):
+            debounce = int(arg[len(u'-debounce:'):])
+        elif arg.startswith(u'-dependencies:'):
+            dependency_file = arg[len(u'-dependencies:'):]
+        elif arg.startswith(u'-journal:'):
+            journal_file = arg[len(u'-journal:'):]
+        elif arg.startswith(u'-index:'):
+            index_name = arg[len(u'-index:'):]
+        elif arg.startswith(u'-global:'):
+            global_name = arg[len(u'-global:'):]
+        elif arg == u'-redirects':
+            redirects = snapshot.RedirectTable.from_wiki(pywikibot.Site())
+        elif arg.startswith(u'-redirects:'):
+            redirects = snapshot.open_redirects(arg[len(u'-redirects:'):])
+        elif arg == u'-warmimages':
+            warm_images = True
+        elif arg == u'-queue':
+            use_queue = True
+        elif not genFactory.handleArg(arg):
             pageTitle.append(arg)
 
     gen = genFactory.getCombinedGenerator()
 
+    if resume and not journal_file:
+        journal_file = JOURNAL_FILE
+
+    if index_name:
+        event_rewards.use_index(pageindex.open_snapshot(index_name)[1])
+    if global_name and redirects is None:
+        redirects = snapshot.open_redirects(global_name)
+    utils.use_redirects(redirects)
+    if warm_images and not global_name:
+        image_map.warm_up()
+    dependencies.load(dependency_file)
+    run_start = pywikibot.Site().getcurrenttime().isoformat()
+    if socket_file:
+        pywikibot.output(u'Listening on %s' % socket_file)
+        XrefDaemon(run_start).serve(socket_file)
+        return
+    if watch:
+        since = dependencies.timestamp or run_start
+        pywikibot.output(u'Watching for changes since %s' % since)
+        # Nobody is there to answer prompts, so accept every change
+        watcher = ChangeWatcher(XrefBot(iter([]), acceptall=True),
+                                since,
+                                dependency_file,
+                                interval,
+                                debounce)
+        watcher.run()
+        return
+    if incremental:
+        if dependencies.timestamp is None:
+            pywikibot.output(u'No record of an earlier run in %s' % dependency_file)
+            return
+        changes = utils.RecentChanges(pywikibot.Site(), dependencies.timestamp)
+        titles = sorted(pages_affected_by(changes.changed_titles()))
+        pywikibot.output(u'%d pages affected by changes since %s' % (len(titles),
+                                                                    dependencies.timestamp))
+        gen = (pywikibot.Page(pywikibot.Site(), t) for t in titles)
+
     if pageTitle:
         page = pywikibot.Page(pywikibot.Site(), ' '.join(pageTitle))
         gen = iter([page])
 
+    if global_name:
+        # Phase 1 - read and parse every page
+        pywikibot.output(u'Reading snapshot %s' % global_name)
+        all_facts = facts.FactTable.build(snapshot.Snapshot(global_name))
+        pywikibot.output(u'Read %d pages' % len(all_facts))
+        # Phase 2 - check every page against the facts
+        utils.use_snapshot(all_facts)
+        if warm_images:
+            image_map.warm_up()
+        pages = [all_facts.page(t) for t in all_facts.titles()]
+        journal = None
+        if journal_file:
+            journal = utils.RunJournal(journal_file, resume)
+        edits = None
+        if use_queue:
+            edits = editqueue.EditQueue()
+        bot = XrefBot(iter([p for p in pages if p.namespace() == 0]),
+                      journal=journal,
+                      edits=edits)
+        try:
+            bot.run()
+        finally:
+            # Keep what was recorded, even if the run was interrupted.
+            # The snapshot may be older than the last run
+            dependencies.save(dependency_file, dependencies.timestamp)
+        return
+
     if not gen:
         pywikibot.showHelp()
     else:
         preloadingGen = pagegenerators.PreloadingGenerator(gen)
-        bot = XrefBot(preloadingGen)
-        bot.run()
+        journal = None
+        if journal_file:
+            journal = utils.RunJournal(journal_file, resume)
+        edits = None
+        if use_queue:
+            edits = editqueue.EditQueue()
+        bot = XrefBot(preloadingGen, journal=journal, edits=edits)
+        completed = False
+        try:
+            bot.run()
+            completed = True
+        finally:
+            # Keep what was recorded, even if the run was interrupted.
+            # Other runs may not have covered every page changed since the
+            # last incremental run, and neither does an interrupted one,
+            # so they don't move its start point
+            if completed and (incremental or dependencies.timestamp is None):
+                dependencies.save(dependency_file, run_start)
+            else:
+                dependencies.save(dependency_file, dependencies.timestamp)
 
 if __name__ == "__main__":
     try:
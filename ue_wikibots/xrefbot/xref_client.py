@@ -0,0 +1,83 @@
+# Copyright (C) 2013-2015 Chris Brand
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#! /usr/bin/python
+
+"""
+Script to ask a running "xref.py -daemon" what it would change on some pages.
+
+Arguments:
+-socket:<file>    Connect to the daemon listening on <file>, rather than
+                  the default socket.
+-<generator arg>  Check the pages from a page generator (like -cat:Bosses).
+<title>           Check the page with this title. Words are joined with spaces.
+
+Nothing on the wiki is changed - the proposed diffs are just printed.
+This deliberately doesn't import pywikibot, so it starts quickly.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import sys
+import socket
+
+# Must match xref.SOCKET_FILE
+SOCKET_FILE = u'xref.sock'
+
+def request(socket_file, req):
+    """
+    Generator to return the lines of the daemon's reply to a request.
+
+    socket_file -- path of the daemon's Unix socket.
+    req -- page title or page generator argument.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(socket_file)
+    try:
+        sock.sendall((u'%s\n' % req).encode('utf-8'))
+        reply = sock.makefile('rb')
+        for line in reply:
+            line = line.decode('utf-8').rstrip(u'\n')
+            # The reply ends with an empty line
+            if not line:
+                break
+            yield line
+    finally:
+        sock.close()
+
+def main(args):
+    socket_file = SOCKET_FILE
+    requests = []
+    title = []
+    for arg in args:
+        if not isinstance(arg, type(u'')):
+            arg = arg.decode('utf-8')
+        if arg.startswith(u'-socket:'):
+            socket_file = arg[len(u'-socket:'):]
+        elif arg.startswith(u'-'):
+            requests.append(arg)
+        else:
+            title.append(arg)
+    if title:
+        requests.append(u' '.join(title))
+    if not requests:
+        print(__doc__)
+        return
+    for req in requests:
+        for line in request(socket_file, req):
+            print(line)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])